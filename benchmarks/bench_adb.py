@@ -0,0 +1,110 @@
+"""
+Runs the adb commands of pidcat against a fake adb server (fake_adb_server.py) serving a generated log, through the
+adb server client of --adb-server and, if there is an adb on PATH, through adb processes talking to the same server.
+Checks that --adb-server gets what the commands print on the fake device, then reports the time of the commands of
+the startup probes and of every --pid-refresh, and how fast the log comes through logcat.
+
+Exits with status 1 if --adb-server got anything else than the fake device printed.
+
+    python benchmarks/bench_adb.py [lines] [rounds]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+from fake_adb_server import FakeAdbServer, FakeDevice  # noqa: E402
+from synthetic import LogcatGenerator  # noqa: E402
+
+PROBES = [
+    ['adb', 'shell', 'getprop ro.build.version.sdk; getprop ro.product.model'],
+    ['adb', 'shell', pidcat.PS_COMMAND],
+    ['adb', 'shell', 'dumpsys', 'activity', 'activities'],
+]
+
+
+def check(device: FakeDevice, serial: str) -> list[str]:
+    # The commands pidcat runs through the client, with what the fake device prints for each
+    expected = [(['adb', 'get-serialno'], serial.encode() + b'\n'),
+                (['adb', '-s', serial, 'get-state'], b'device\n'),
+                (['adb', 'devices'], b'List of devices attached\n%s\tdevice\n' % serial.encode()),
+                (['adb', '-s', 'missing', 'get-state'], b''),
+                (['adb', 'logcat', '-d', '-v', 'time'], device.run('logcat -d -v time'))]
+    expected.extend((command, device.run(' '.join(command[2:]))) for command in PROBES)
+
+    errors = []
+    for command, output in expected:
+        # Twice, the second time in a shell kept open
+        for _ in range(2):
+            got = pidcat.adb_output(command)
+            if got != output:
+                errors.append('%s: got %r, expected %r' % (' '.join(command), got[:80], output[:80]))
+    return errors
+
+
+def measure(name: str, rounds: int, lines: int):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for command in PROBES:
+            pidcat.adb_output(command)
+    probes = (time.perf_counter() - started) / rounds / len(PROBES)
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        pidcat.adb_output(PROBES[1])
+    refresh = (time.perf_counter() - started) / rounds
+
+    started = time.perf_counter()
+    read = sum(1 for _ in pidcat.LogcatProcess(['adb', 'logcat', '-v', 'time'], []))
+    elapsed = time.perf_counter() - started
+    print('%-12s %12.1f %12.1f %12.0f %10s' % (name, probes * 1000, refresh * 1000, read / elapsed,
+                                               'ok' if read == lines else '%d lines' % read))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    with tempfile.NamedTemporaryFile(suffix='.log') as log:
+        log.write(b'\n'.join(LogcatGenerator().lines(count)) + b'\n')
+        log.flush()
+        lines = sum(1 for _ in open(log.name, 'rb'))
+
+        device = FakeDevice(log.name)
+        server = FakeAdbServer(device)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        os.environ['ANDROID_ADB_SERVER_PORT'] = str(server.port)
+        os.environ.pop('ANDROID_SERIAL', None)
+        try:
+            pidcat.ADB_SERVER = pidcat.AdbServer(('localhost', server.port))
+            errors = check(device, server.serial)
+            for error in errors:
+                print(error)
+
+            print('%-12s %12s %12s %12s %10s' % ('client', 'probe ms', 'ps ms', 'log lines/s', 'log'))
+            measure('adb-server', rounds, lines)
+            print('%d connections for %d shell commands' % (pidcat.ADB_SERVER.connections,
+                                                            pidcat.ADB_SERVER.commands))
+            pidcat.ADB_SERVER.close()
+
+            pidcat.ADB_SERVER = None
+            if shutil.which('adb'):
+                measure('adb', rounds, lines)
+            else:
+                print('no adb on PATH, only --adb-server was measured')
+        finally:
+            server.shutdown()
+            server.server_close()
+            device.close()
+
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Compares reading `logcat -v time` text (LineReader + DeviceSession.records) against the binary entries of `logcat -B`
+(LogEntryReader + DeviceSession.entry_records), from the record read to the record shown.
+
+The binary log is the text corpus encoded with version 4 entry headers. It can be written to a file for testing:
+
+    python benchmarks/bench_binary.py [lines] [--write-entries FILE < logcat.txt]
+"""
+
+import calendar
+import os
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+from bench_parser import corpus  # noqa: E402
+
+# len, hdr_size, pid, tid, sec, nsec, lid, uid
+HEADER_V4 = struct.Struct('<HHiiIIII')
+
+
+def to_entries(lines, year: int = time.localtime().tm_year) -> bytes:
+    entries = []
+    for line in lines:
+        log_line = pidcat.LOG_LINE_BYTES.match(line.strip())
+        if log_line is None:
+            continue
+
+        date, clock, level, tag, owner, message = log_line.groups()
+        stamp = time.strptime('%d-%s %s' % (year, date.decode(), clock[:8].decode()), '%Y-%m-%d %H:%M:%S')
+        sec = int(time.mktime(stamp))
+        nsec = int(clock[9:12]) * 1000000
+        payload = bytes([pidcat.LOG_ENTRY_LEVELS.index(level.decode())]) + tag.strip() + b'\0' + message + b'\0'
+        entries.append(HEADER_V4.pack(len(payload), HEADER_V4.size, int(owner), int(owner), sec, nsec, 0, 0))
+        entries.append(payload)
+    return b''.join(entries)
+
+
+def run(args, path: str, binary: bool) -> tuple[int, float]:
+    session = pidcat.DeviceSession(args, [])
+    session.create_filters()
+    with open(path, 'rb') as source:
+        start = time.perf_counter()
+        if binary:
+            shown = sum(1 for _ in session.entry_records(pidcat.LogEntryReader(source)))
+        else:
+            shown = sum(1 for _ in session.records(pidcat.LineReader(source)))
+        return shown, time.perf_counter() - start
+
+
+def main():
+    if '--write-entries' in sys.argv:
+        with open(sys.argv[sys.argv.index('--write-entries') + 1], 'wb') as f:
+            f.write(to_entries(sys.stdin.buffer))
+        return
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    lines = corpus(count)
+
+    with tempfile.NamedTemporaryFile(suffix='.txt') as text, tempfile.NamedTemporaryFile(suffix='.bin') as binary:
+        text.write(b'\n'.join(lines) + b'\n')
+        text.flush()
+        binary.write(to_entries(lines))
+        binary.flush()
+
+        for name, package in (('all', []), ('one app', ['com.example.app0'])):
+            args = pidcat.parse_args(package)
+            for path, is_binary in ((text.name, False), (binary.name, True)):
+                shown, elapsed = run(args, path, is_binary)
+                print('%-7s %-6s %10.0f lines/s  (%d shown, %.3fs)' % (
+                    name, 'binary' if is_binary else 'text', count / elapsed, shown, elapsed))
+
+
+if __name__ == '__main__':
+    main()
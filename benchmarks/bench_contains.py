@@ -0,0 +1,72 @@
+"""
+Measures --contains with 1, 100, 10,000 and 100,000 literals: checking every literal with `in`, against
+LiteralMatcher with its trie shaped regex and, when pyahocorasick is installed, its Aho-Corasick automaton, whatever
+the number of literals LiteralMatcher would use each for. The time to build each is shown in brackets.
+
+The literals are request ids, as when grepping a log for the requests of a failed test run; about 1% of the
+messages contain one. Checking every literal is only measured up to 100 literals.
+
+    python benchmarks/bench_contains.py [messages]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+from bench_parser import corpus  # noqa: E402
+
+
+def measure(search, messages: list[str]) -> tuple[float, int]:
+    start = time.perf_counter()
+    found = sum(1 for message in messages if search(message))
+    return len(messages) / (time.perf_counter() - start), found
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rnd = random.Random(42)
+    messages = [pidcat.parse_line(line).message for line in corpus(count)]
+    ids = ['req-%08x' % rnd.getrandbits(32) for _ in range(100000)]
+    for i in range(0, count, 100):
+        messages[i] += ' request=' + rnd.choice(ids[:10000])
+
+    try:
+        import ahocorasick  # noqa: F401
+        has_automaton = True
+    except ImportError:
+        has_automaton = False
+
+    for needles in (1, 100, 10000, 100000):
+        literals = ids[:needles]
+        results = []
+        if needles <= 100:
+            results.append(('every literal',) + measure(lambda message: any(l in message for l in literals),
+                                                         messages))
+
+        modules = sys.modules.copy()
+        sys.modules['ahocorasick'] = None
+        start = time.perf_counter()
+        matcher = pidcat.LiteralMatcher(literals)
+        build = time.perf_counter() - start
+        sys.modules.clear()
+        sys.modules.update(modules)
+        results.append(('regex (%.0f ms)' % (build * 1000),) + measure(matcher.search, messages))
+
+        if has_automaton:
+            automaton_size, pidcat.CONTAINS_AUTOMATON_SIZE = pidcat.CONTAINS_AUTOMATON_SIZE, 0
+            start = time.perf_counter()
+            matcher = pidcat.LiteralMatcher(literals)
+            build = time.perf_counter() - start
+            pidcat.CONTAINS_AUTOMATON_SIZE = automaton_size
+            results.append(('automaton (%.0f ms)' % (build * 1000),) + measure(matcher.search, messages))
+
+        for name, rate, found in results:
+            print('%6d literals  %-20s %10.0f messages/s  (%d found)' % (needles, name, rate, found))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Measures the aggregate throughput of following several devices at once: every device is a DeviceSession reading its
+own copy of the corpus on its own thread, merged into one stream by stream_sessions.
+
+    python benchmarks/bench_devices.py [lines per device]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+from bench_parser import corpus  # noqa: E402
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    args = pidcat.parse_args([])
+
+    with tempfile.NamedTemporaryFile(suffix='.log') as log:
+        log.write(b'\n'.join(corpus(count)) + b'\n')
+        log.flush()
+
+        for devices in (1, 2, 4, 8):
+            sources = [open(log.name, 'rb') for _ in range(devices)]
+            sessions = [pidcat.DeviceSession(args, ['adb'], device='device-%d' % i, source=source)
+                        for i, source in enumerate(sources)]
+            received = 0
+
+            def handle(record):
+                nonlocal received
+                received += 1
+
+            start = time.perf_counter()
+            pidcat.stream_sessions(sessions, handle, latency=0.05)
+            elapsed = time.perf_counter() - start
+            for source in sources:
+                source.close()
+
+            print('%d device(s) %10.0f lines/s  (%d lines in %.3fs)' % (devices, received / elapsed, received,
+                                                                        elapsed))
+
+
+if __name__ == '__main__':
+    main()
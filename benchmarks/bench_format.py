@@ -0,0 +1,52 @@
+"""
+Compares the text rendering of a pipeline (no terminal, so no wrapping, but still tags, colors and highlight rules)
+against --format json, csv and raw, which write the fields of each record as they are. Lines go to an OutputWriter
+on /dev/null; the text path runs once without highlight rules and once with two, which every other format skips.
+json and csv come out about as fast as text without rules: escaping the fields costs about what the cached headers
+of the text path leave to do.
+
+    python benchmarks/bench_format.py [lines]
+"""
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+from bench_parser import corpus  # noqa: E402
+
+
+def run(create, records: list[pidcat.LogRecord]) -> float:
+    output = pidcat.OutputWriter(open(os.devnull, 'w'))
+    render = create(output).render
+    start = time.perf_counter()
+    for record in records:
+        render(record)
+    output.flush()
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    records = [record._replace(package='com.example.app') for record in map(pidcat.parse_line, corpus(count))
+               if record is not None]
+    args = pidcat.parse_args([])
+
+    text = run(lambda output: pidcat.Renderer(args, -1, output=output), records)
+    print('%-14s %10.0f lines/s' % ('text', len(records) / text))
+    pidcat.RULES.add(re.compile(r'Skipped \d+ frames!'), pidcat.colorize(r'\g<0>', fg=pidcat.YELLOW))
+    pidcat.RULES.add(re.compile(r'https://\S+'), pidcat.colorize(r'\g<0>', fg=pidcat.BLUE))
+    highlighted = run(lambda output: pidcat.Renderer(args, -1, output=output), records)
+    print('%-14s %10.0f lines/s' % ('text, 2 rules', len(records) / highlighted))
+
+    for output_format in pidcat.OUTPUT_FORMATS[1:]:
+        elapsed = run(lambda output: pidcat.RecordFormatter(output_format, output), records)
+        print('%-14s %10.0f lines/s  (%.1fx text, %.1fx text with rules)' % (
+            output_format, len(records) / elapsed, text / elapsed, highlighted / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Compares running every highlight rule's regex on every message, as the old RULES dict did, against Highlighter,
+which skips a rule unless the message contains the piece of text the rule can't match without.
+
+The rules are the built-in StrictMode and --color-gc ones plus a team's worth of --highlight rules.
+
+    python benchmarks/bench_highlight.py [messages]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+from bench_parser import corpus  # noqa: E402
+
+TEAM_RULES = [
+    'white/red:ANR in \\S+',
+    'red:java\\.lang\\.OutOfMemoryError.*',
+    'white/red:FATAL EXCEPTION: .*',
+    'yellow:Skipped \\d+ frames!',
+    'yellow:Davey! duration=\\d+ms',
+    'yellow:Slow (?:dispatch|delivery) took \\d+ms',
+    'magenta:NetworkOnMainThreadException',
+    'cyan:SocketTimeoutException: .*',
+    'red:Process \\S+ \\(pid \\d+\\) has died',
+    'yellow:Long monitor contention with owner .*',
+]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    messages = [pidcat.parse_line(line).message for line in corpus(count)]
+
+    pidcat.RULES.add(
+        pidcat.re.compile(r'^(GC_(?:CONCURRENT|FOR_M?ALLOC|EXTERNAL_ALLOC|EXPLICIT) )(freed <?\d+.)'
+                          r'(, \d+\% free \d+./\d+., )(paused \d+ms(?:\+\d+ms)?)'), r'\1\2\3\4')
+
+    for team_rules in (0, len(TEAM_RULES)):
+        highlighter = pidcat.Highlighter()
+        highlighter.rules = pidcat.RULES.rules + [pidcat.parse_highlight_rule(rule) for rule in TEAM_RULES[:team_rules]]
+
+        start = time.perf_counter()
+        for message in messages:
+            for rule in highlighter.rules:
+                message = rule.pattern.sub(rule.replacement, message)
+        every = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for message in messages:
+            highlighter.apply(message)
+        prefiltered = time.perf_counter() - start
+
+        print('%2d rules: every regex %10.0f messages/s   Highlighter %10.0f messages/s' % (
+            len(highlighter.rules), count / every, count / prefiltered))
+
+
+if __name__ == '__main__':
+    main()
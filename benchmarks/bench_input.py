@@ -0,0 +1,45 @@
+"""
+Measures how reading a saved log with --input scales with the number of worker processes (--jobs), from 1 up to the
+number of CPUs. Only parsing and filtering are timed, not rendering.
+
+    python benchmarks/bench_input.py [lines]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+from bench_parser import corpus  # noqa: E402
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    # Track the app the corpus starts, so the timeline pass has work to do
+    args = pidcat.parse_args(['com.example.app0'])
+
+    jobs = [1]
+    while jobs[-1] * 2 <= (os.cpu_count() or 1):
+        jobs.append(jobs[-1] * 2)
+    if jobs[-1] != os.cpu_count():
+        jobs.append(os.cpu_count())
+
+    with tempfile.NamedTemporaryFile(suffix='.log') as log:
+        log.write(b'\n'.join(corpus(count)) + b'\n')
+        log.flush()
+
+        for workers in jobs:
+            session = pidcat.DeviceSession(args, [])
+            session.create_filters()
+            start = time.perf_counter()
+            received = sum(1 for _ in pidcat.LogFileProcessor(session, [log.name], workers))
+            elapsed = time.perf_counter() - start
+            print('%2d job(s) %10.0f lines/s  (%d of %d lines shown, %.3fs)' % (workers, count / elapsed, received,
+                                                                              count, elapsed))
+
+
+if __name__ == '__main__':
+    main()
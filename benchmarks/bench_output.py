@@ -0,0 +1,53 @@
+"""
+Compares the old print() per line output path against OutputWriter.
+
+Both paths write to an unbuffered /dev/null stream, which is what stdout looks like when pidcat runs under `python -u`.
+
+    python benchmarks/bench_output.py [lines]
+"""
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+
+
+def unbuffered_devnull() -> io.TextIOWrapper:
+    return io.TextIOWrapper(open(os.devnull, 'wb', buffering=0), encoding='utf-8', write_through=True)
+
+
+def bench_print(lines: list[str]) -> float:
+    stream = unbuffered_devnull()
+    start = time.perf_counter()
+    for line in lines:
+        print(line, file=stream)
+    return time.perf_counter() - start
+
+
+def bench_writer(lines: list[str]) -> float:
+    stream = unbuffered_devnull()
+    writer = pidcat.OutputWriter(stream)
+    start = time.perf_counter()
+    for line in lines:
+        writer.write(line)
+    writer.flush()
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    line = pidcat.colorize('ActivityManager'.rjust(23), fg=pidcat.WHITE) + ' ' + pidcat.TAG_TYPES['I'] + \
+        ' Displayed com.example.app/.MainActivity: +412ms'
+    lines = [line] * count
+
+    for name, bench in (('print', bench_print), ('OutputWriter', bench_writer)):
+        elapsed = bench(lines)
+        print('%-14s %10.0f lines/s  (%.3fs)' % (name, count / elapsed, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Compares the old per-line regex cascade against the fused parser (parse_line).
+
+The old cascade is reproduced here as it was: BUG_LINE, then LOG_LINE, then all three start patterns against the whole
+line, then the death patterns for ActivityManager lines.
+
+    python benchmarks/bench_parser.py [lines]
+"""
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+
+BUG_LINE = re.compile(r'.*nativeGetEnabledTags.*')
+LOG_LINE = re.compile(r'^[0-9-]+ ([0-9:.]+) ([A-Z])/(.+?)\( *(\d+)\): (.*?)$')
+PID_START = re.compile(r'^.*: Start proc ([a-zA-Z0-9._:]+) for ([a-z]+ [^:]+): pid=(\d+) uid=(\d+) gids=(.*)$')
+PID_START_5_1 = re.compile(r'^.*: Start proc (\d+):([a-zA-Z0-9._:]+)/[a-z0-9]+ for (.*)$')
+PID_START_DALVIK = re.compile(r'^E/dalvikvm\(\s*(\d+)\): >>>>> ([a-zA-Z0-9._:]+) \[ userId:0 \| appId:(\d+) \]$')
+
+TAGS = ['ActivityManager', 'Choreographer', 'OkHttp', 'ViewRootImpl', 'chatty', 'WindowManager', 'InputReader',
+        'BluetoothAdapter', 'wpa_supplicant', 'dalvikvm', 'art', 'SurfaceFlinger', 'NetworkMonitor', 'MyApp']
+
+
+def old_cascade(raw: bytes):
+    line = raw.decode('utf-8', 'replace').strip()
+    if BUG_LINE.match(line) is not None:
+        return None
+
+    log_line = LOG_LINE.match(line)
+    if log_line is None:
+        return None
+
+    _time, _level, tag, _owner, message = log_line.groups()
+    tag = tag.strip()
+    start = PID_START_5_1.match(line) or PID_START.match(line) or PID_START_DALVIK.match(line)
+    if tag == 'ActivityManager':
+        start = start or pidcat.PID_KILL.match(message) or pidcat.PID_LEAVE.match(message) or \
+            pidcat.PID_LEAVE.match(message)
+
+    return log_line.groups(), start
+
+
+def corpus(count: int) -> list[bytes]:
+    rnd = random.Random(42)
+    lines = []
+    for i in range(count):
+        tag = rnd.choice(TAGS)
+        if tag == 'ActivityManager' and rnd.random() < 0.2:
+            message = 'Start proc %d:com.example.app%d/u0a%d for activity com.example.app/.Main' % (
+                rnd.randint(1000, 30000), i % 7, rnd.randint(10, 99))
+        else:
+            message = ' '.join(rnd.choice(['Skipped', 'frames!', 'onResume', 'GET', 'https://example.com/api',
+                                           'duration=', '42ms', 'state', 'changed', '{"id": 12}'])
+                               for _ in range(rnd.randint(2, 16)))
+        lines.append(('10-18 12:%02d:%02d.%03d %s/%s(%5d): %s' % (
+            i // 60000 % 60, i // 1000 % 60, i % 1000, rnd.choice('VDIWE'), tag, rnd.randint(100, 30000), message
+        )).encode())
+    return lines
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    lines = corpus(count)
+
+    for name, parse in (('cascade', old_cascade), ('parse_line', pidcat.parse_line)):
+        start = time.perf_counter()
+        for line in lines:
+            parse(line)
+        elapsed = time.perf_counter() - start
+        print('%-12s %10.0f lines/s  (%.3fs)' % (name, count / elapsed, elapsed))
+
+
+if __name__ == '__main__':
+    main()
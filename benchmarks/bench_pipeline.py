@@ -0,0 +1,100 @@
+"""
+Runs every stage of pidcat on a generated log (benchmarks/synthetic.py) and reports for each the lines per second
+and the memory it allocates: the peak of memory allocated while the stage runs, and what its output takes per line.
+parse and filter get the lines read, render and json the records left by filter. Runs of different commits can
+be compared without a device.
+
+    read     LineReader splitting the log, read from a file, into lines
+    parse    parse_line() on every line
+    filter   log_records(): parsing, process tracking and filters, for the pidcat options given
+    render   the Renderer (no terminal, so no wrapping), or the RecordFormatter with --format
+    json     the RecordFormatter of --format json
+
+    python benchmarks/bench_pipeline.py [lines] [pidcat options...]
+
+The options default to com.example.app, e.g. `bench_pipeline.py 500000 --min-level W` or `bench_pipeline.py 500000
+--tag MyApp com.example.app`.
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+from synthetic import LogcatGenerator  # noqa: E402
+
+
+def measure(stage, items: list) -> tuple[list, float, int, int]:
+    """
+    Returns the output of stage (a function from a list to an iterable), the seconds it took, the peak of memory
+    allocated while its output is consumed as it comes, and the bytes taken by its output once collected in a list.
+    Tracing allocations slows everything down, so each is a run of its own.
+    """
+    start = time.perf_counter()
+    output = list(stage(items))
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    deque(stage(items), maxlen=0)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    del output
+    tracemalloc.start()
+    output = list(stage(items))
+    kept = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return output, elapsed, peak, kept
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    args = pidcat.parse_args(sys.argv[2:] or ['com.example.app'])
+    output = pidcat.OutputWriter(open(os.devnull, 'w'))
+
+    def read(path):
+        with open(path[0], 'rb') as fr:
+            yield from pidcat.LineReader(fr)
+
+    def parse(lines):
+        return filter(None, map(pidcat.parse_line, lines))
+
+    def log_filter(lines):
+        return pidcat.log_records(lines, args)
+
+    def render_with(renderer):
+        def render(records):
+            for record in records:
+                renderer.render(record)
+            output.flush()
+            return ()
+        return render
+
+    def report(name: str, stage, items: list) -> list:
+        results, elapsed, peak, kept = measure(stage, items)
+        # Reading turns one file into lines, every other stage goes through its input
+        lines = max(len(items), len(results))
+        print('%-8s %10d %10d %10.0f %10.0f %12s' % (name, len(items), len(results), lines / elapsed, peak / 1024,
+                                                   '%.0f' % (kept / len(results)) if results else '-'))
+        return results
+
+    with tempfile.NamedTemporaryFile(suffix='.log') as log:
+        log.write(b'\n'.join(LogcatGenerator().lines(count)) + b'\n')
+        log.flush()
+
+        print('%-8s %10s %10s %10s %10s %12s' % ('stage', 'lines in', 'lines out', 'lines/s', 'peak KB', 'kept B/line'))
+        lines = report('read', read, [log.name])
+        report('parse', parse, lines)
+        # The filters get the lines rather than parsed records, they drop most lines before parsing them
+        records = report('filter', log_filter, lines)
+        report('render', render_with(pidcat.create_renderer(args, output=output)), records)
+        report('json', render_with(pidcat.RecordFormatter('json', output)), records)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Compares loading --proguard-mapping the old way (every line of the file matched and put in a dict) with
+ProguardMapping, which builds an index of the class lines once and afterwards only maps it. Reports the first (index
+building) and the following loads, the memory they add and the time to look up tags and deobfuscate stack traces,
+and checks that both give the same names.
+
+The mapping file is generated: classes with a few fields and methods each, like the output of R8.
+
+    python benchmarks/bench_proguard.py [classes]
+"""
+
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+
+OLD_PROGUARD_MAPPING = re.compile(r'^([\w$\.]+)\s->\s*([\w$\.]+)')
+
+
+def obfuscated_name(i: int) -> str:
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    name = ''
+    while True:
+        name += letters[i % 26]
+        i //= 26
+        if not i:
+            return name
+
+
+def write_mapping(fw, classes: int):
+    for i in range(classes):
+        package = 'com.example.feature%d' % (i % 50)
+        fw.write('%s.Class%d -> %s.%s:\n' % (package, i, obfuscated_name(i % 50), obfuscated_name(i)))
+        fw.write('# {"id":"sourceFile","fileName":"Class%d.kt"}\n' % i)
+        for j in range(4):
+            fw.write('    java.lang.String field%d -> %s\n' % (j, obfuscated_name(j)))
+        for j in range(8):
+            fw.write('    %d:%d:void method%d(android.os.Bundle):%d:%d -> %s\n' % (j, j + 5, j, j * 10, j * 10 + 5,
+                                                                            obfuscated_name(j)))
+
+
+def old_load(path: str) -> dict[str, str]:
+    proguard_mapping = {}
+    with open(path) as fr:
+        for line in fr:
+            mapping_match = OLD_PROGUARD_MAPPING.match(line.strip())
+            if mapping_match is not None:
+                proguard_mapping[mapping_match.group(2)] = mapping_match.group(1)
+    return proguard_mapping
+
+
+def retained(load, path: str) -> float:
+    # Memory held on to after loading, measured on a run of its own as tracemalloc slows everything down
+    tracemalloc.start()
+    mapping = load(path)  # noqa: F841
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / 1e6
+
+
+def main():
+    classes = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    random.seed(1)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['XDG_CACHE_HOME'] = directory
+        path = os.path.join(directory, 'mapping.txt')
+        with open(path, 'w') as fw:
+            write_mapping(fw, classes)
+        print('mapping: %d classes, %.0f MB' % (classes, os.path.getsize(path) / 1e6))
+
+        picked = [random.randrange(classes) for _ in range(50000)]
+        names = [obfuscated_name(i % 50) + '.' + obfuscated_name(i) for i in picked]
+        names += ['NotMapped%d' % i for i in range(5000)]
+        lines = ['\tat %s.a(SourceFile:%d)' % (name, i) for i, name in enumerate(names)]
+
+        for load in ('first', 'again'):
+            start = time.perf_counter()
+            mapping = pidcat.ProguardMapping.load(path)
+            print('ProguardMapping %s load: %7.1f ms' % (load, (time.perf_counter() - start) * 1000))
+        print('ProguardMapping keeps %.1f MB' % retained(pidcat.ProguardMapping.load, path))
+
+        start = time.perf_counter()
+        found = [mapping.get(name, name) for name in names]
+        frames = [pidcat.deobfuscate(mapping, line) for line in lines]
+        print('ProguardMapping lookups: %.1f ms for %d tags and stack frames' % (
+            (time.perf_counter() - start) * 1000, 2 * len(names)))
+
+        start = time.perf_counter()
+        old = old_load(path)
+        print('old load:                 %7.1f ms' % ((time.perf_counter() - start) * 1000))
+        print('old load keeps %.1f MB' % retained(old_load, path))
+
+        assert len(old) == len(mapping)
+        assert found == [old.get(name, name) for name in names]
+        assert frames == [pidcat.deobfuscate(old, line) for line in lines]
+        assert frames[0] != lines[0] and frames[-1] == lines[-1]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Feeds parsed records through a RecordQueue to a consumer printing 20000 lines per second, like a terminal over a
+slow SSH connection, and reports for each overflow policy how long the reader took to get through the log (how long
+adb would have been left unread) and what the consumer got to see.
+
+The log is the generated corpus with every line repeated a few times, so that coalescing has something to fold.
+
+    python benchmarks/bench_queue.py [lines]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+from bench_parser import corpus  # noqa: E402
+
+CONSUMER_RATE = 20000
+REPEATS = 4
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    records = [pidcat.parse_line(line) for line in corpus(count // REPEATS)]
+    records = [record for record in records if record is not None for _ in range(REPEATS)]
+
+    for policy in pidcat.RecordQueue.POLICIES:
+        queue = pidcat.RecordQueue(10000, policy)
+        read_time = 0.0
+
+        def read(put):
+            nonlocal read_time
+            start = time.perf_counter()
+            for record in records:
+                put(record)
+            read_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        queue.start_reader(read)
+        shown = 0
+        while True:
+            batch = queue.get()
+            if batch is None:
+                break
+            shown += len(batch)
+            time.sleep(len(batch) / CONSUMER_RATE)
+        elapsed = time.perf_counter() - start
+
+        print('%-11s log read in %5.2fs, printed %6d lines in %5.2fs (%d dropped, %d coalesced)' % (
+            policy, read_time, shown, elapsed, queue.dropped, queue.coalesced))
+
+
+if __name__ == '__main__':
+    main()
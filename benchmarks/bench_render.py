@@ -0,0 +1,108 @@
+"""
+Compares the old per-line rendering (indent_tag, create_tag_level, prepend_time and the quadratic indent_wrap, all
+recomputed for every line) against Renderer, which caches the header and wraps with a single join.
+
+Three cases: short lines on a wide terminal, 10 KB messages such as JSON payloads, and a narrow 60 column terminal
+(at 40 columns or less the header is wider than the terminal, which made the old indent_wrap loop forever).
+Rendered lines go to an OutputWriter on /dev/null, colors are on as on a terminal.
+
+    python benchmarks/bench_render.py [lines]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+
+TAGS = ['ActivityManager', 'Choreographer', 'OkHttp', 'ViewRootImpl', 'chatty', 'MyApp', 'NetworkMonitor']
+
+
+def old_indent_wrap(width: int, header_size: int, message: str):
+    if width == -1:
+        return message
+
+    message = message.replace('\t', '    ')
+    wrap_area = width - header_size
+    message_buf = ''
+    current = 0
+
+    while current < len(message):
+        _next = min(current + wrap_area, len(message))
+        message_buf += message[current:_next]
+        if _next < len(message):
+            message_buf += '\n'
+            message_buf += ' ' * header_size
+        current = _next
+
+    return message_buf
+
+
+def old_render(state: dict, args, width: int, header_size: int, record: pidcat.LogRecord):
+    tag, message = record.tag, record.message
+    create_tag = tag != state['last_tag'] or args.always_tags
+    color, line_buffer = pidcat.indent_tag(args.tag_width, tag, create_tag)
+    if create_tag:
+        state['last_tag'] = tag
+        state['last_color'] = color
+    elif state['last_color'] is not None:
+        color = state['last_color']
+
+    line_buffer += pidcat.create_tag_level(record.level) + " "
+    line_buffer = pidcat.prepend_time(line_buffer, record.time, args.add_timestamp)
+
+    for rule in pidcat.RULES.rules:
+        message = rule.pattern.sub(rule.replacement, message)
+
+    line_foreground = color if args.colorized else pidcat.WHITE
+    line_buffer += old_indent_wrap(width, header_size, pidcat.colorize(message, fg=line_foreground))
+    pidcat.print_line(line_buffer)
+
+
+def records(count: int, message_length: int) -> list[pidcat.LogRecord]:
+    rnd = random.Random(42)
+    result = []
+    for i in range(count):
+        message = ''.join(rnd.choice('abcdefghij {}":,0123456789') for _ in range(message_length))
+        # Runs of lines of the same tag, as in a real log
+        tag = TAGS[i // 5 % len(TAGS)]
+        result.append(pidcat.LogRecord('10-18', '12:00:00.%03d' % (i % 1000), rnd.choice('VDIWE'), tag, '1234',
+                                       message))
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    pidcat.IS_TTY = True
+    args = pidcat.parse_args(['--timestamp'])
+    header_size = args.tag_width + 1 + 3 + 1 + 12 + 1
+
+    for name, lines, message_length, width in (('short', count, 80, 200), ('10 KB', max(1, count // 100), 10240, 120),
+                                               ('narrow', count, 200, 60)):
+        corpus = records(lines, message_length)
+
+        pidcat.OUTPUT = pidcat.OutputWriter(open(os.devnull, 'w'))
+        state = {'last_tag': None, 'last_color': None}
+        start = time.perf_counter()
+        for record in corpus:
+            old_render(state, args, width, header_size, record)
+        pidcat.OUTPUT.flush()
+        old = time.perf_counter() - start
+
+        pidcat.OUTPUT = pidcat.OutputWriter(open(os.devnull, 'w'))
+        renderer = pidcat.Renderer(args, width)
+        start = time.perf_counter()
+        for record in corpus:
+            renderer.render(record)
+        pidcat.OUTPUT.flush()
+        new = time.perf_counter() - start
+
+        print('%-6s old %10.0f lines/s   Renderer %10.0f lines/s  (%d lines, %d columns)' % (
+            name, lines / old, lines / new, lines, width))
+
+
+if __name__ == '__main__':
+    main()
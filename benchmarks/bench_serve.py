@@ -0,0 +1,83 @@
+"""
+Load test for pidcat --serve: a LogDaemon fed from a generated log fans it out to N clients over a Unix socket, each
+subscribed to a different package (or to everything), plus one client which never reads. Reports how fast the
+daemon gets through the log, the lines delivered per second over all clients, and what the stalled client cost: its
+queue is bounded, so it only drops its own lines.
+
+    python benchmarks/bench_serve.py [lines]
+"""
+
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+from bench_parser import corpus  # noqa: E402
+
+
+def subscribe(path: str, package: list[str]) -> socket.socket:
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(path)
+    connection.sendall((json.dumps(pidcat.subscription(pidcat.parse_args(package))) + '\n').encode())
+    return connection
+
+
+def read_all(connection: socket.socket, received: list, index: int):
+    lines = 0
+    while True:
+        data = connection.recv(256 * 1024)
+        if not data:
+            break
+        lines += data.count(b'\n')
+    received[index] = lines - 1  # the header
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    packages = [[]] + [['com.example.app%d' % i] for i in range(7)]
+
+    with tempfile.TemporaryDirectory() as directory, tempfile.NamedTemporaryFile(suffix='.log') as log:
+        log.write(b'\n'.join(corpus(count)) + b'\n')
+        log.flush()
+
+        for clients in (1, 4, 16):
+            path = os.path.join(directory, 'pidcat-%d.sock' % clients)
+            session = pidcat.DeviceSession(pidcat.parse_args([]), [], device='bench')
+            daemon = pidcat.LogDaemon(session, path, queue_size=10000)
+            daemon.listen()
+
+            received = [0] * clients
+            readers = []
+            for i in range(clients):
+                reader = threading.Thread(target=read_all, args=(subscribe(path, packages[i % len(packages)]),
+                                                                 received, i))
+                reader.start()
+                readers.append(reader)
+            stalled = subscribe(path, [])
+            while len(daemon.clients) < clients + 1:
+                time.sleep(0.01)
+
+            source = open(log.name, 'rb')
+            start = time.perf_counter()
+            daemon.run(pidcat.LineReader(source))
+            parsed = time.perf_counter() - start
+            for reader in readers:
+                reader.join()
+            elapsed = time.perf_counter() - start
+            source.close()
+
+            stalled_client = daemon.clients[-1]
+            print('%2d clients: log read at %8.0f lines/s, %9.0f lines/s delivered (%d lines, %.2fs); the stalled '
+                  'client dropped %d' % (clients, count / parsed, sum(received) / elapsed, sum(received), elapsed,
+                                         stalled_client.dropped))
+            stalled.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Runs millions of generated lines through a session and the renderer, like pidcat left running for days, and checks
+that memory stays flat. Every few lines use a tag never seen before, and processes of the tracked package keep
+starting under new pids; most of them never log a death message. The resident set size and the sizes of the tables
+that grow with the log are reported as the lines go by.
+
+Exits with status 1 if the resident set grew by more than a few MB after the first quarter of the lines.
+
+    python benchmarks/bench_soak.py [lines]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+
+REPORTS = 10
+# A new tag every this many lines, a process start every this many lines
+TAG_CHURN = 4
+START_CHURN = 50
+# Share of the processes whose death is logged
+DEATHS_LOGGED = 0.1
+ALLOWED_GROWTH = 4 * 1024 * 1024
+
+
+def rss() -> int:
+    with open('/proc/self/statm') as fr:
+        return int(fr.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def soak_log(count: int):
+    # Generated as it is read, so that the log itself takes no memory
+    rnd = random.Random(42)
+    live = ['1000']
+    next_pid = 1000
+    for i in range(count):
+        stamp = '10-18 %02d:%02d:%02d.%03d' % (i // 3600000 % 24, i // 60000 % 60, i // 1000 % 60, i % 1000)
+        if i % START_CHURN == 0:
+            next_pid = next_pid % 4000000 + 1
+            yield ('%s I/ActivityManager(  500): Start proc %d:com.example.app:p%d/u0a42 for service '
+                   'com.example.app/.Sync' % (stamp, next_pid, i)).encode()
+            live.append(str(next_pid))
+            if len(live) > 64:
+                pid = live.pop(rnd.randrange(len(live)))
+                if rnd.random() < DEATHS_LOGGED:
+                    yield ('%s I/ActivityManager(  500): Process com.example.app (pid %s) has died' % (
+                        stamp, pid)).encode()
+            continue
+
+        tag = 'Tag%d' % (i // TAG_CHURN)
+        yield ('%s %s/%s(%5s): request %d took %d ms' % (stamp, rnd.choice('VDIWE'), tag, rnd.choice(live), i,
+                                                          rnd.randint(1, 500))).encode()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000000
+    pidcat.OUTPUT = pidcat.OutputWriter(open(os.devnull, 'w'))
+    args = pidcat.parse_args(['com.example.app'])
+    session = pidcat.DeviceSession(args, [])
+    session.create_filters()
+    renderer = pidcat.Renderer(args, -1)
+
+    print('%10s %9s %7s %7s %7s %8s %8s' % ('lines', 'lines/s', 'RSS MB', 'pids', 'names', 'colors', 'headers'))
+    samples = []
+    step = count // REPORTS
+    read = 0
+    start = last = time.perf_counter()
+
+    def lines():
+        nonlocal read, last
+        for line in soak_log(count):
+            yield line
+            read += 1
+            if read % step == 0:
+                pidcat.OUTPUT.flush()
+                now = time.perf_counter()
+                samples.append(rss())
+                print('%10d %9.0f %7.1f %7d %7d %8d %8d' % (
+                    read, step / (now - last), samples[-1] / 1024 / 1024, len(session.pids),
+                    len(session.process_names), pidcat.allocate_color.cache_info().currsize, len(renderer.headers)))
+                last = now
+
+    for record in session.records(lines()):
+        renderer.render(record)
+    pidcat.OUTPUT.flush()
+
+    growth = samples[-1] - samples[len(samples) // 4]
+    print('%d lines in %.1fs, RSS grew %.1f MB after the first quarter: %s' % (
+        count, time.perf_counter() - start, growth / 1024 / 1024, 'flat' if growth <= ALLOWED_GROWTH else 'GROWING'))
+    return 0 if growth <= ALLOWED_GROWTH else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
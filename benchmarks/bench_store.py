@@ -0,0 +1,99 @@
+"""
+Records the generated corpus into a --record store and compares a --query for one package, level W and up and a one
+minute window, which only reads the blocks the index points at, against reading every block. Also reports what
+recording costs the thread reading logcat, which only hands each block to the recording process.
+
+    python benchmarks/bench_store.py [lines]
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+from bench_parser import corpus  # noqa: E402
+
+PACKAGES = 20
+CHUNK_SIZE = 64 * 1024
+
+
+def processes() -> dict[str, str]:
+    # The corpus has random pids, give each one of a few packages
+    return dict((str(pid), 'com.example.app%d' % (pid % PACKAGES)) for pid in range(100, 30001))
+
+
+def new_session() -> pidcat.DeviceSession:
+    session = pidcat.DeviceSession(pidcat.parse_args(['com.example.app3', '-l', 'W']), [])
+    session.create_filters()
+    return session
+
+
+def query(directory: str, since: str, until: str) -> tuple[int, float, pidcat.LogStore]:
+    session = new_session()
+    store = pidcat.LogStore(directory)
+    start = time.perf_counter()
+    shown = sum(1 for record in store.query(session, since, until) if record.event is None)
+    return shown, time.perf_counter() - start, store
+
+
+def scan(directory: str, since: str, until: str) -> tuple[int, float, int]:
+    # What a store without an index would do: read every block and look at the time of every line
+    session = new_session()
+    store = pidcat.LogStore(directory)
+    low, high = since.encode(), until.encode()
+    start = time.perf_counter()
+    shown = blocks = 0
+    for path, _, _, entry in store.blocks():
+        entry = json.loads(entry)
+        with open(path + '.seg', 'rb') as segment:
+            lines = [line for line in store.read(segment, entry) if low <= line[:18] < high]
+        blocks += 1
+        session.pids.clear()
+        session.pids.update(pid for pid, name in entry['pids'].items() if session.is_tracked(name))
+        shown += sum(1 for record in session.records(lines) if record.event is None)
+    return shown, time.perf_counter() - start, blocks
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    data = b''.join(line + b'\n' for line in corpus(count))
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+    directory = tempfile.mkdtemp(prefix='pidcat-store-')
+    try:
+        writer = pidcat.LogStoreWriter(directory, float('inf'), processes)
+        start = time.perf_counter()
+        for chunk in chunks:
+            writer.feed(chunk)
+        writer.close()
+        elapsed = time.perf_counter() - start
+        print('record   %10.0f lines/s  %6.1f MB/s  %d blocks, %.1f MB -> %.1f MB (%.1fx)' % (
+            count / elapsed, len(data) / elapsed / 1e6, writer.blocks, writer.written / 1e6,
+            writer.compressed / 1e6, writer.written / writer.compressed))
+
+        since, until = '10-18 12:02:00.000', '10-18 12:03:00.000'
+        shown, elapsed, blocks = scan(directory, since, until)
+        print('scan     %8.1f ms  %d lines shown, %d blocks read' % (elapsed * 1000, shown, blocks))
+        shown, elapsed, store = query(directory, since, until)
+        print('indexed  %8.1f ms  %d lines shown, %d blocks read, %d skipped' % (
+            elapsed * 1000, shown, store.blocks_read, store.blocks_skipped))
+
+        # The reading thread's share: queueing the blocks for the recording process
+        recorder = pidcat.LogRecorder(os.path.join(directory, 'live'), [], float('inf'))
+        start = time.perf_counter()
+        for chunk in chunks:
+            recorder.write(chunk)
+        elapsed = time.perf_counter() - start
+        recorder.close()
+        print('tap      %8.1f us per %d KB block, %d dropped' % (
+            elapsed / len(chunks) * 1e6, CHUNK_SIZE // 1024, recorder.dropped))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+A fake adb server, to run pidcat --adb-server without a device. It speaks the protocol of the adb server on a local
+port and has one device: the commands of its exec: and shell: services run in sh on this computer, with the scripts
+of a FakeDevice first on PATH. Its getprop, ps, pm, dumpsys and logcat answer like those of a device, logcat printing
+a saved log.
+
+    python benchmarks/fake_adb_server.py [log] [port]
+
+serves the log (by default, one generated by synthetic.py) until interrupted, for e.g.
+`pidcat.py --adb-server localhost:PORT com.example.app`.
+"""
+
+import os
+import re
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import LogcatGenerator  # noqa: E402
+
+SERIAL = 'emulator-5554'
+HOST_REQUEST = re.compile(r'^host(?:-serial:(.+)|-usb|-local)?:([\w-]+)$')
+
+GETPROP = '''#!/bin/sh
+case "$1" in
+  ro.build.version.sdk) echo %(sdk)s;;
+  ro.product.model) echo %(model)s;;
+esac
+'''
+LOGCAT = '''#!/bin/sh
+for arg; do
+  case "$arg" in
+    -c) exit 0;;
+    -d) exec cat '%(log)s';;
+  esac
+done
+cat '%(log)s'
+exec sleep %(follow)s
+'''
+
+
+class FakeDevice:
+    """
+    The scripts standing in for the commands of a device, in a directory of their own. processes maps pids to the
+    process names `ps` lists. logcat prints the log and then, unless -d is given, waits follow seconds before it ends,
+    like the device going away.
+    """
+
+    def __init__(self, log: str, processes: Optional[dict] = None, sdk: int = 33, model: str = 'Pixel',
+                 follow: float = 0):
+        self.directory = tempfile.TemporaryDirectory(prefix='pidcat-fake-device-')
+        self.log = log
+        # The processes running when a log generated with the default settings starts
+        self.processes = processes or dict((pid, package) for pid, (package, _) in LogcatGenerator().live.items())
+        self.env = dict(os.environ, PATH=self.directory.name + os.pathsep + os.environ.get('PATH', ''))
+
+        ps = ['USER PID PPID VSZ RSS WCHAN ADDR S NAME'] + [
+            'u0_a%d %s 1 1 1 0 0 S %s' % (i, pid, name) for i, (pid, name) in enumerate(self.processes.items())]
+        packages = sorted(set(name.split(':')[0] for name in self.processes.values()))
+        self._script('getprop', GETPROP % {'sdk': sdk, 'model': model})
+        self._script('logcat', LOGCAT % {'log': log, 'follow': follow})
+        self._script('ps', "#!/bin/sh\ncat <<'EOF'\n%s\nEOF\n" % '\n'.join(ps))
+        self._script('pm', "#!/bin/sh\ncat <<'EOF'\n%s\nEOF\n" % '\n'.join('package:' + name for name in packages))
+        self._script('dumpsys', '#!/bin/sh\necho "  * Task{1 #12 type=standard A=10000:%s U=0 visible=true}"\n' %
+                     packages[0])
+
+    def _script(self, name: str, text: str):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as fw:
+            fw.write(text)
+        os.chmod(path, 0o755)
+
+    def run(self, command: str) -> bytes:
+        # What the command prints on the device, without the adb server in between
+        return subprocess.run(['sh', '-c', command], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, env=self.env).stdout
+
+    def close(self):
+        self.directory.cleanup()
+
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+    def read_request(self) -> Optional[str]:
+        length = self.read_exactly(4)
+        if length is None:
+            return None
+        request = self.read_exactly(int(length, 16))
+        return request.decode('utf-8') if request is not None else None
+
+    def read_exactly(self, size: int) -> Optional[bytes]:
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def okay(self, reply: Optional[str] = None):
+        data = b'OKAY'
+        if reply is not None:
+            data += b'%04x%s' % (len(reply.encode()), reply.encode())
+        self.request.sendall(data)
+
+    def fail(self, message: str):
+        self.request.sendall(b'FAIL%04x%s' % (len(message.encode()), message.encode()))
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        # As the adb server does, output written in pieces by the command mustn't wait for acknowledgements
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = False
+        while True:
+            request = self.read_request()
+            if request is None:
+                return
+
+            if request.startswith('host:transport') or request.startswith('host:tport:'):
+                serial = request.partition('transport:')[2] or request.partition('tport:serial:')[2]
+                if serial and serial != server.serial:
+                    return self.fail("device '%s' not found" % serial)
+                self.okay()
+                if request.startswith('host:tport:'):
+                    self.request.sendall(struct.pack('<Q', 1))
+                transport = True
+                continue
+
+            if transport:
+                service, _, command = request.partition(':')
+                if service not in ('exec', 'shell') or service not in server.services:
+                    return self.fail('closed')
+                self.okay()
+                return self.run(command)
+
+            host = HOST_REQUEST.match(request)
+            if host is None:
+                return self.fail('unknown host service')
+            serial, query = host.groups()
+            if serial is not None and serial != server.serial:
+                return self.fail("device '%s' not found" % serial)
+            if query == 'version':
+                return self.okay('%04x' % 41)
+            if query == 'features':
+                # No shell_v2, the client has to use the services above
+                return self.okay('')
+            if query in ('devices', 'devices-l'):
+                return self.okay('%s\tdevice\n' % server.serial)
+            if query == 'get-serialno':
+                return self.okay(server.serial)
+            if query == 'get-state':
+                return self.okay('device')
+            return self.fail('unknown host service')
+
+    def run(self, command: str):
+        self.server.commands += 1
+        # The command talks to the client directly, through the socket
+        fd = self.request.fileno()
+        process = subprocess.Popen(['sh', '-c', command or 'sh'], stdin=fd, stdout=fd, stderr=subprocess.STDOUT,
+                                   env=self.server.device.env)
+        process.wait()
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    """
+    Serves the device on port of localhost, 0 for any free port. services are the ones the device offers: without
+    'exec' it is like a device before Android 5.0. connections and commands count what the clients asked for.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, device: FakeDevice, port: int = 0, serial: str = SERIAL, services=('exec', 'shell')):
+        super().__init__(('127.0.0.1', port), FakeAdbHandler)
+        self.device = device
+        self.serial = serial
+        self.services = services
+        self.connections = 0
+        self.commands = 0
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+
+def main():
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 5037
+    if len(sys.argv) > 1:
+        log = os.path.abspath(sys.argv[1])
+    else:
+        generated = tempfile.NamedTemporaryFile(suffix='.log', delete=False)
+        generated.write(b'\n'.join(LogcatGenerator().lines(100000)) + b'\n')
+        generated.close()
+        log = generated.name
+
+    device = FakeDevice(log, follow=3600)
+    server = FakeAdbServer(device, port)
+    print('serving %s as %s on localhost:%d' % (log, server.serial, server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        device.close()
+        if len(sys.argv) <= 1:
+            os.unlink(log)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Generates logcat output (`-v time`) for the benchmarks, the same for the same seed and settings. Lines are spread over
+tags, levels and pids by configurable weights. Processes of the packages start and end in all the formats pidcat
+recognises (the three PID_START ones, Killing, No longer want and has died), and some of them crash with a Java stack
+trace or a native backtrace from DEBUG.
+
+Run it to save a log, e.g. for --input:
+
+    python benchmarks/synthetic.py [lines] [seed] > synthetic.log
+"""
+
+import random
+import sys
+from typing import Iterator, Optional
+
+TAGS = {
+    'ActivityManager': 8, 'Choreographer': 6, 'OkHttp': 10, 'ViewRootImpl': 5, 'chatty': 3, 'WindowManager': 6,
+    'InputReader': 4, 'BluetoothAdapter': 2, 'wpa_supplicant': 3, 'art': 4, 'SurfaceFlinger': 5, 'NetworkMonitor': 2,
+    'MyApp': 12, 'Glide': 3, 'SQLiteLog': 1, 'StrictMode': 1,
+}
+LEVELS = {'V': 20, 'D': 35, 'I': 25, 'W': 12, 'E': 7, 'F': 1}
+PACKAGES = ['com.example.app', 'com.example.app:remote', 'com.android.chrome', 'com.google.android.gms',
+            'com.google.android.gms.persistent', 'com.android.systemui', 'com.other.game']
+WORDS = ['Skipped', 'frames!', 'onResume', 'GET', 'https://example.com/api/v1/items', 'duration=', '42ms', 'state',
+         'changed', '{"id": 12}', 'the', 'application', 'may', 'be', 'doing', 'too', 'much', 'work', 'on', 'its',
+         'main', 'thread.', 'android.view.ViewRootImpl', '0x7f0a01c2']
+START_FORMATS = ('5.1', 'legacy', 'dalvik')
+DEATH_FORMATS = ('kill', 'leave', 'died')
+SYSTEM_PID = 500
+DEBUGGERD_PID = 690
+
+
+def weighted(rnd: random.Random, weights: dict) -> Iterator[str]:
+    # Endless stream of keys, drawn in batches since every random.choices() call has some overhead
+    keys, cumulative = list(weights), []
+    total = 0
+    for weight in weights.values():
+        total += weight
+        cumulative.append(total)
+    while True:
+        yield from rnd.choices(keys, cum_weights=cumulative, k=1024)
+
+
+class LogcatGenerator:
+    """
+    A log of lines from processes of packages, plus system lines from the ActivityManager. Up to processes of them are
+    alive at once; every line starts a new one with probability start_rate (ending another when there are too many)
+    and crashes one with probability crash_rate, with one of crash_kinds stack traces. extra_tags adds that many tags
+    named Tag<n> with weight 1, for tag churn. The process starts and ends go round the formats given.
+    """
+
+    def __init__(self, seed: int = 42, tags: Optional[dict] = None, levels: Optional[dict] = None,
+                 packages: Optional[list] = None, processes: int = 32, start_rate: float = 0.002,
+                 crash_rate: float = 0.0002, extra_tags: int = 0, start_formats=START_FORMATS,
+                 death_formats=DEATH_FORMATS, backtrace_depth: int = 12, crash_kinds: int = 6):
+        self.rnd = random.Random(seed)
+        tags = dict(tags or TAGS)
+        tags.update(('Tag%d' % i, 1) for i in range(extra_tags))
+        self.tags = weighted(self.rnd, tags)
+        self.levels = weighted(self.rnd, levels or LEVELS)
+        self.packages = packages or PACKAGES
+        self.max_processes = processes
+        self.start_rate = start_rate
+        self.crash_rate = crash_rate
+        self.start_formats = start_formats
+        self.death_formats = death_formats
+        self.backtrace_depth = backtrace_depth
+        self.crash_kinds = [self.crash_kind() for _ in range(crash_kinds)]
+        self.clock = 0
+        self.next_pid = 1000
+        self.started = 0
+        self.ended = 0
+        # pid: (package, uid)
+        self.live: dict[str, tuple[str, int]] = {}
+        for _ in range(processes // 2):
+            self._spawn()
+
+    def _spawn(self) -> tuple[str, str, int]:
+        self.next_pid = self.next_pid % 32000 + 1
+        pid = str(self.next_pid)
+        package = self.rnd.choice(self.packages)
+        uid = 10000 + self.packages.index(package)
+        self.live[pid] = (package, uid)
+        return pid, package, uid
+
+    def stamp(self) -> str:
+        self.clock += self.rnd.randint(0, 3)
+        ms = self.clock
+        return '10-18 %02d:%02d:%02d.%03d' % (ms // 3600000 % 24, ms // 60000 % 60, ms // 1000 % 60, ms % 1000)
+
+    def start(self) -> list[str]:
+        pid, package, uid = self._spawn()
+        component = '%s/.Main' % package.split(':')[0]
+        kind = self.start_formats[self.started % len(self.start_formats)]
+        self.started += 1
+        if kind == '5.1':
+            return ['%s I/ActivityManager(%5d): Start proc %s:%s/u0a%d for activity %s' % (
+                self.stamp(), SYSTEM_PID, pid, package, uid - 10000, component)]
+        if kind == 'legacy':
+            return ['%s I/ActivityManager(%5d): Start proc %s for activity %s: pid=%s uid=%d gids={50%d, 3003}' % (
+                self.stamp(), SYSTEM_PID, package, component, pid, uid, uid - 10000)]
+        return ['%s E/dalvikvm(%5s): >>>>> %s [ userId:0 | appId:%d ]' % (self.stamp(), pid, package, uid)]
+
+    def end(self, pid: str) -> list[str]:
+        package, uid = self.live.pop(pid)
+        kind = self.death_formats[self.ended % len(self.death_formats)]
+        self.ended += 1
+        if kind == 'kill':
+            return ['%s I/ActivityManager(%5d): Killing %s:%s/u0a%d (adj 900): empty #17' % (
+                self.stamp(), SYSTEM_PID, pid, package, uid - 10000)]
+        if kind == 'leave':
+            return ['%s I/ActivityManager(%5d): No longer want %s (pid %s): empty #17' % (
+                self.stamp(), SYSTEM_PID, package, pid)]
+        return ['%s I/ActivityManager(%5d): Process %s (pid %s) has died' % (self.stamp(), SYSTEM_PID, package, pid)]
+
+    def crash_kind(self) -> tuple[bool, str, list[str]]:
+        # Whether the crash is native, its exception or signal, and its stack trace
+        rnd = self.rnd
+        if rnd.random() < 0.5:
+            exception = rnd.choice(['java.lang.IllegalStateException: Fragment not attached',
+                                    'java.lang.NullPointerException: Attempt to invoke virtual method on a null '
+                                    'object reference', 'java.lang.OutOfMemoryError: Failed to allocate'])
+            return False, exception, ['\tat com.example.app.feature%d.Screen%d.on%s(Screen.java:%d)' % (
+                rnd.randint(1, 5), rnd.randint(1, 9), rnd.choice(['Create', 'Resume', 'Click']), rnd.randint(10, 400))
+                for _ in range(self.backtrace_depth)]
+
+        signal = rnd.choice(['signal 11 (SIGSEGV), code 1 (SEGV_MAPERR), fault addr 0x0',
+                             'signal 6 (SIGABRT), code -6 (SI_TKILL), fault addr --------'])
+        return True, signal, ['    #%02d pc %%08x  /system/lib64/%s (%s+%d)' % (
+            frame, rnd.choice(['libc.so', 'libart.so', 'libexample.so']),
+            rnd.choice(['abort', 'memcpy', 'art_quick_invoke_stub', 'Java_com_example_Native_run']),
+            rnd.randint(4, 400)) for frame in range(self.backtrace_depth)]
+
+    def crash(self, pid: str) -> list[str]:
+        package, _ = self.live[pid]
+        rnd = self.rnd
+        native, cause, frames = rnd.choice(self.crash_kinds)
+        if not native:
+            lines = ['FATAL EXCEPTION: main', 'Process: %s, PID: %s' % (package, pid), cause] + frames
+            crash = ['%s E/AndroidRuntime(%5s): %s' % (self.stamp(), pid, line) for line in lines]
+        else:
+            # Libraries are loaded at a different address every time
+            lines = ['*** *** *** *** *** *** *** *** *** *** *** *** *** *** *** ***',
+                     'pid: %s, tid: %s, name: main  >>> %s <<<' % (pid, pid, package), cause, 'backtrace:']
+            lines.extend(frame % rnd.randrange(0x10000, 0xfffff) for frame in frames)
+            crash = ['%s F/DEBUG   (%5d): %s' % (self.stamp(), DEBUGGERD_PID, line) for line in lines]
+        return crash + self.end(pid)
+
+    def line(self) -> str:
+        rnd = self.rnd
+        tag = next(self.tags)
+        pid = SYSTEM_PID if tag == 'ActivityManager' else rnd.choice(list(self.live))
+        message = ' '.join(rnd.choices(WORDS, k=rnd.randint(2, 16)))
+        return '%s %s/%s(%5s): %s' % (self.stamp(), next(self.levels), tag, pid, message)
+
+    def lines(self, count: int) -> Iterator[bytes]:
+        """
+        Yields the lines, as bytes without the line feed, of count steps: a step is a log line, a process start (with
+        the end of another one if there are too many) or a crash with its stack trace.
+        """
+        rnd = self.rnd
+        for _ in range(count):
+            chance = rnd.random()
+            if chance < self.crash_rate and self.live:
+                lines = self.crash(rnd.choice(list(self.live)))
+            elif chance < self.crash_rate + self.start_rate or not self.live:
+                lines = self.start()
+                if len(self.live) > self.max_processes:
+                    lines += self.end(rnd.choice(list(self.live)))
+            else:
+                yield self.line().encode()
+                continue
+            for line in lines:
+                yield line.encode()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 42
+    out = sys.stdout.buffer
+    for line in LogcatGenerator(seed).lines(count):
+        out.write(line + b'\n')
+
+
+if __name__ == '__main__':
+    main()
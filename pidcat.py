@@ -22,23 +22,80 @@ limitations under the License.
 # Package filtering and output improvements by Jake Wharton, http://jakewharton.com
 
 import argparse
+import array
+import atexit
+import cProfile
+import functools
+import hashlib
+import heapq
+import itertools
+import json
+import mmap
+import multiprocessing
 import os
+import pstats
+import queue
 import re
+import shlex
+import signal
+import socket
+import struct
 import subprocess
 import sys
-from subprocess import PIPE
+import threading
+import time
+import unicodedata
+import zlib
+from subprocess import DEVNULL, PIPE
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from collections import deque
 
 __version__ = '2.2.0+unofficial'
 
-from typing import Pattern, List, Optional
+from typing import Iterator, Match, NamedTuple, Pattern, List, Optional, Union
 
 FROMFILE_PREFIX = '@'
 CONF_FILES = [os.path.expanduser('~/.pidcat.conf'), './.pidcat.conf']
+DEVICE_CACHE_TTL = 24 * 60 * 60
+COMPLETION_CACHE_TTL = 60
+# Bounds of the tables which would otherwise grow for as long as pidcat runs: tag colors, tracked processes (a process
+# whose death message was lost stays tracked), deobfuscated class names and tags offered for completion
+TAG_COLOR_CACHE_SIZE = 4096
+PID_TABLE_SIZE = 4096
+PROGUARD_NAME_CACHE_SIZE = 65536
+COMPLETION_TAGS_SIZE = 4096
+# --contains: from this many texts on, an Aho-Corasick automaton is built instead of a regex, if pyahocorasick is there
+CONTAINS_AUTOMATON_SIZE = 50000
+# Crashes are told apart by the exception or signal and this many frames of the stack trace. A crash report is held
+# back until they are known, at most this many lines or seconds, and this many signatures are remembered.
+CRASH_SIGNATURE_FRAMES = 3
+CRASH_HOLD_LINES = 64
+CRASH_HOLD_DELAY = 0.2
+CRASH_SIGNATURES_SIZE = 1024
+RECONNECT_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+# --adb-server: the port adb uses by default, and how many idle shells are kept open per device for the next command
+ADB_SERVER_PORT = 5037
+ADB_IDLE_SHELLS = 4
+# --record: lines are compressed in blocks of about this many bytes, a segment file holds this many bytes of lines
+STORE_BLOCK_SIZE = 256 * 1024
+STORE_SEGMENT_SIZE = 64 * 1024 * 1024
+STORE_FLUSH_DELAY = 1.0
+STORE_PROCESS_REFRESH = 5.0
+STORE_TIME = re.compile(r'^(?:(\d\d-\d\d) )?(\d\d:\d\d(?::\d\d(?:\.\d{1,3})?)?)$')
+# toybox ps only lists every process with -A, fall back to the plain listing on older devices (see
+# read_process_table() for toolbox ps, which doesn't fail on these options)
+PS_COMMAND = 'ps -A -o PID,NAME 2>/dev/null || ps'
 
 LOG_LEVELS = 'VDIWEF'
+OUTPUT_FORMATS = ('text', 'json', 'csv', 'raw')
 LOG_LEVELS_MAP = dict([(LOG_LEVELS[i], i) for i in range(len(LOG_LEVELS))])
-PROGUARD_MAPPING = re.compile(r'^([\w$\.]+)\s->\s*([\w$\.]+)')
+# Class lines of a mapping file, the members of a class are indented
+PROGUARD_MAPPING = re.compile(rb'^([^\s#]\S*)\s->\s*([^\s:]+)', re.MULTILINE)
+PROGUARD_INDEX = struct.Struct('=8sqqQ')
+PROGUARD_INDEX_MAGIC = b'PIDCATP1'
+STACK_TRACE_LINE = re.compile(r'^(\s*at |Caused by: )([\w$.-]+?)(\.[\w$<>-]+\(|:|$)')
 
 BLACK, RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN, WHITE = range(8)
 RESET = '\033[0m'
@@ -56,15 +113,38 @@ def split_or_empty(to_split: Optional[str], sep: str) -> list[str]:
 ENV_IGNORED_TAGS = split_or_empty(os.getenv("PIDCAT_IGNORED_TAGS"), ";")
 
 PID_LINE = re.compile(r'^\w+\s+(\w+)\s+\w+\s+\w+\s+\w+\s+\w+\s+\w+\s+\w\s([\w|\.|:|\/]+)$')
-PID_START = re.compile(r'^.*: Start proc ([a-zA-Z0-9._:]+) for ([a-z]+ [^:]+): pid=(\d+) uid=(\d+) gids=(.*)$')
-PID_START_5_1 = re.compile(r'^.*: Start proc (\d+):([a-zA-Z0-9._:]+)/[a-z0-9]+ for (.*)$')
-PID_START_DALVIK = re.compile(r'^E/dalvikvm\(\s*(\d+)\): >>>>> ([a-zA-Z0-9._:]+) \[ userId:0 \| appId:(\d+) \]$')
+PID_START = re.compile(r'^Start proc ([a-zA-Z0-9._:]+) for ([a-z]+ [^:]+): pid=(\d+) uid=(\d+) gids=(.*)$')
+PID_START_5_1 = re.compile(r'^Start proc (\d+):([a-zA-Z0-9._:]+)/[a-z0-9]+ for (.*)$')
+PID_START_DALVIK = re.compile(r'^>>>>> ([a-zA-Z0-9._:]+) \[ userId:0 \| appId:(\d+) \]$')
+PID_NAME_LINE = re.compile(r'^(\d+)\s+([\w|\.|:|\/]+)$')
 PID_KILL = re.compile(r'^Killing (\d+):([a-zA-Z0-9._:]+)/[^:]+: (.*)$')
 PID_LEAVE = re.compile(r'^No longer want ([a-zA-Z0-9._:]+) \(pid (\d+)\): .*$')
 PID_DEATH = re.compile(r'^Process ([a-zA-Z0-9._:]+) \(pid (\d+)\) has died.?$')
-LOG_LINE = re.compile(r'^[0-9-]+ ([0-9:.]+) ([A-Z])/(.+?)\( *(\d+)\): (.*?)$')
-BUG_LINE = re.compile(r'.*nativeGetEnabledTags.*')
+LOG_LINE = re.compile(r'^([0-9-]+) ([0-9:.]+) ([A-Z])/(.+?)\( *(\d+)\): (.*)$')
+LOG_LINE_BYTES = re.compile(LOG_LINE.pattern.encode())
+BUG_LINE_BYTES = b'nativeGetEnabledTags'
+# Lines of these tags are needed for process tracking, so they must survive the pid and level prefilters
+LIFECYCLE_TAGS_BYTES = {b'ActivityManager', b'dalvikvm', b'DEBUG'}
 BACKTRACE_LINE = re.compile(r'^#(.*?)pc\s(.*?)$')
+# Crash reports: the lines of a Java crash from AndroidRuntime, and of a native crash from DEBUG
+CRASH_TAGS = {'AndroidRuntime', 'DEBUG'}
+JAVA_CRASH_START = 'FATAL EXCEPTION'
+NATIVE_CRASH_START = '*** ***'
+NATIVE_FRAME = re.compile(r'^#(\d+) pc [0-9a-fA-F]+\s+(.*)$')
+NATIVE_SIGNAL = re.compile(r'^signal \d+ \((\w+)\)')
+NATIVE_PID = re.compile(r'^pid: (\d+),')
+LOG_TAG_BYTES = re.compile(rb'^[0-9-]+ [0-9:.]+ [A-Z]/(.+?)\( *\d+\):', re.MULTILINE)
+# Names of app processes, as opposed to kernel threads and native daemons
+PROCESS_NAME = re.compile(r'^[a-zA-Z][\w]*(\.[\w]+)+(:[\w.]+)?$')
+
+# Header of an entry of `logcat -B`: payload length, header size (0 for the 20 byte version 1 header), pid, tid,
+# seconds, nanoseconds. Newer headers append fields we don't need, the payload starts after header size bytes.
+LOG_ENTRY_HEADER = struct.Struct('<HHiiII')
+LOG_ENTRY_MAX_PAYLOAD = 5 * 1024
+# Index is the android_LogPriority; unknown and default priorities never show up in the text format either
+LOG_ENTRY_LEVELS = (None, None, 'V', 'D', 'I', 'W', 'E', 'F', 'S')
+# Buffers whose payload is binary data rather than a tag and a message
+BINARY_BUFFERS = {'events', 'stats', 'security'}
 
 
 def parse_regex_input(input_str: str) -> Pattern:
@@ -89,6 +169,37 @@ def parse_regex_inputs(input_strs: list[str]) -> list[Pattern]:
     return [parse_regex_input(_str) for _str in input_strs]
 
 
+def parse_store_time(value: str) -> str:
+    # Padded to the "MM-DD hh:mm:ss.mmm" prefix of `-v time` lines, the date is left out when not given
+    match = STORE_TIME.match(value.strip())
+    if match is None:
+        raise argparse.ArgumentTypeError("Time must look like [MM-DD ]HH:MM[:SS[.mmm]]")
+
+    day, clock = match.groups()
+    clock += '00:00:00.000'[len(clock):]
+    return '%s %s' % (day, clock) if day else clock
+
+
+def parse_adb_server(value: str) -> tuple[str, int]:
+    """
+    Parses [HOST:]PORT. Without a value, finds the server the way adb does: $ADB_SERVER_SOCKET (tcp:HOST:PORT),
+    $ANDROID_ADB_SERVER_ADDRESS and $ANDROID_ADB_SERVER_PORT.
+    """
+    value = value.strip()
+    if not value:
+        server_socket = os.getenv('ADB_SERVER_SOCKET', '')
+        if server_socket.startswith('tcp:'):
+            value = server_socket[4:]
+        else:
+            value = '%s:%s' % (os.getenv('ANDROID_ADB_SERVER_ADDRESS') or 'localhost',
+                               os.getenv('ANDROID_ADB_SERVER_PORT') or ADB_SERVER_PORT)
+
+    host, _, port = value.rpartition(':')
+    if not port.isdigit():
+        raise argparse.ArgumentTypeError("adb server must look like [HOST:]PORT")
+    return host or 'localhost', int(port)
+
+
 def parse_args(argv):
     parser = argparse.ArgumentParser(description='Filter logcat by package name', fromfile_prefix_chars=FROMFILE_PREFIX)
     parser.add_argument('package', nargs='*', help='Application package name(s)')
@@ -99,11 +210,21 @@ def parse_args(argv):
     parser.add_argument('-l', '--min-level', dest='min_level', type=str, choices=LOG_LEVELS + LOG_LEVELS.lower(),
                         default='V', help='Minimum level to be displayed')
     parser.add_argument('--color-gc', dest='color_gc', action='store_true', help='Color garbage collection')
+    parser.add_argument('--highlight', metavar='COLOR[/BACKGROUND]:REGEX', dest='highlight', action='append',
+                        type=parse_highlight_rule,
+                        help='Color the parts of messages matching the regex, e.g. "red:ANR in \\S+"; can be given '
+                             'several times, also in a config file')
     parser.add_argument('--always-display-tags', dest='always_tags', action='store_true',
                         help='Always display the tag name')
     parser.add_argument('--current', dest='current_app', action='store_true',
                         help='Filter logcat by current running app')
-    parser.add_argument('-s', '--serial', dest='device_serial', help='Device serial number (adb -s option)')
+    parser.add_argument('-s', '--serial', dest='device_serial', action='append',
+                        help='Device serial number (adb -s option); repeat it to follow several devices at once')
+    parser.add_argument('--all-devices', dest='all_devices', action='store_true', default=False,
+                        help='Follow every attached device at once')
+    parser.add_argument('--merge-latency', metavar='MS', dest='merge_latency', type=float, default=100,
+                        help='How long lines of several devices are held back to print them in timestamp order '
+                             '(default: 100)')
     parser.add_argument('-d', '--device', dest='use_device', action='store_true',
                         help='Use first device for log input (adb -d option)')
     parser.add_argument('-e', '--emulator', dest='use_emulator', action='store_true',
@@ -115,23 +236,106 @@ def parse_args(argv):
                         help='Only include the specified tag(s)')
     parser.add_argument('-i', '--ignore-tag', dest='ignored_tag', type=parse_regex_input, action='extend', nargs='+',
                         help='Filter output by ignoring tag(s) matching the given regex')
+    parser.add_argument('--device-filter', dest='device_filter', action='store_true', default=False,
+                        help='Let logcat on the device drop lines by level and tag where possible; --tag names are '
+                             'then matched case-sensitively, and left to pidcat with --proguard-mapping')
+    parser.add_argument('--pid-refresh', metavar='SECONDS', dest='pid_refresh', type=float, default=5.0,
+                        help='Re-read the process table of the device every N seconds to notice processes of the '
+                             'package(s) starting or ending; 0 disables it (default: 5)')
+    parser.add_argument('--reconnect', dest='reconnect', action='store_true', default=False,
+                        help='Keep running when the device disconnects or reboots: wait for it to come back and '
+                             'resume the log where it stopped')
+    parser.add_argument('--binary', dest='binary', action='store_true', default=False,
+                        help='Read the binary log format (logcat -B) instead of parsing text, falling back to text if '
+                             'the device can\'t; times are shown in the time zone of this computer')
+    parser.add_argument('--adb-server', metavar='[HOST:]PORT', dest='adb_server', nargs='?', const='',
+                        type=parse_adb_server,
+                        help='Talk to the adb server directly instead of running adb for every command, keeping '
+                             'shells on the device open for the next one (default: the server adb uses, '
+                             'localhost:5037)')
+    parser.add_argument('--input', metavar='FILE', dest='input_files', action='extend', nargs='+',
+                        help='Read saved logcat output (-v time) from the file(s) instead of a device')
+    parser.add_argument('-j', '--jobs', metavar='N', dest='jobs', type=int, default=os.cpu_count() or 1,
+                        help='Number of processes reading --input files, at most the number of CPUs (default: number '
+                             'of CPUs)')
+    parser.add_argument('--record', metavar='DIR', dest='record',
+                        help='Record every line read, before any filtering, into compressed segments in DIR (a '
+                             'subdirectory per device when following several), for --query')
+    parser.add_argument('--record-max-size', metavar='MB', dest='record_max_size', type=float, default=1024,
+                        help='Delete the oldest --record segments once they take more than MB megabytes '
+                             '(default: 1024)')
+    parser.add_argument('--query', metavar='DIR', dest='query',
+                        help='Show the lines recorded in DIR with --record instead of reading a device; the package '
+                             'and filter options apply')
+    parser.add_argument('--since', metavar='TIME', dest='since', type=parse_store_time,
+                        help='With --query, only show lines logged at or after [MM-DD ]HH:MM[:SS[.mmm]]; without a '
+                             'date, the day of the last line recorded')
+    parser.add_argument('--until', metavar='TIME', dest='until', type=parse_store_time,
+                        help='With --query, only show lines logged before [MM-DD ]HH:MM[:SS[.mmm]]')
+    parser.add_argument('--serve', dest='serve', action='store_true', default=False,
+                        help='Run as a daemon reading the device log once for any number of pidcat --connect viewers')
+    parser.add_argument('--connect', dest='connect', action='store_true', default=False,
+                        help='Read from a pidcat --serve daemon instead of adb; it filters for the packages and '
+                             'filter options given here')
+    parser.add_argument('--socket', metavar='PATH', dest='socket',
+                        help='Unix socket of --serve and --connect (default: one per device in $XDG_RUNTIME_DIR)')
+    parser.add_argument('--queue-size', metavar='N', dest='queue_size', type=int, default=10000,
+                        help='Number of lines read ahead of the terminal (default: 10000)')
+    parser.add_argument('--overflow', dest='overflow', choices=RecordQueue.POLICIES, default='block',
+                        help='What to do when the terminal falls --queue-size lines behind: block reading the log, '
+                             'drop the oldest lines, or fold repeated lines into one (default: block)')
     parser.add_argument('--proguard-mapping', dest='proguard_mapping', action='store',
-                        help='Use proguard mapping to translate the input tag names')
+                        help='Use proguard mapping to translate the input tag names and the class names of stack '
+                             'traces; an index of it is kept next to it')
 
-    # TODO: Add simple contains filter, make --filter and --contains mutually exclusive
     parser.add_argument('--filter', dest='filter', type=parse_regex_input, action='extend', nargs='+',
                         help='Only output messages matching the given regex; Input will be wrapped in ^$; Regex is '
                              'case-sensitive')
-    # parser.add_argument('--contains', dest='filter', action='store',
-    #                     help='Only output messages matching the given regex')
+    parser.add_argument('--contains', metavar='TEXT', dest='contains', action='extend', nargs='+',
+                        help='Only output messages containing any of the given texts; Case-sensitive; Use @FILE to '
+                             'read one text per line from a file')
+    parser.add_argument('--exclude-contains', metavar='TEXT', dest='exclude_contains', action='extend', nargs='+',
+                        help='Filter output by ignoring messages containing any of the given texts; Case-sensitive; '
+                             'Use @FILE to read one text per line from a file')
 
     parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + __version__,
                         help='Print the version number and exit')
+    parser.add_argument('--list-packages', dest='list', action='store_const', const='packages',
+                        help='Print the packages of the device, for shell completion, and exit')
+    parser.add_argument('--third-party', dest='third_party', action='store_true', default=False,
+                        help='With --list-packages, only print third-party packages (pm list packages -3)')
+    parser.add_argument('--list-tags', dest='list', action='store_const', const='tags',
+                        help='Print the tags in the log of the device or seen by pidcat, for shell completion, and '
+                             'exit')
+    parser.add_argument('--list-serials', dest='list', action='store_const', const='serials',
+                        help='Print the serials of the attached devices, for shell completion, and exit')
+    # Set by the background process refreshing a stale list
+    parser.add_argument('--refresh-list', dest='refresh_list', action='store_true', help=argparse.SUPPRESS)
     parser.add_argument('-a', '--all', dest='all', action='store_true', default=False, help='Print all log messages')
     parser.add_argument('--colorized', '--colorized', dest='colorized', action='store_true', default=False,
                         help='Colorize log messages as well')
     parser.add_argument('--timestamp', dest='add_timestamp', action='store_true',
                         help='Prepend each line of output with the current time.')
+    parser.add_argument('--format', dest='format', choices=OUTPUT_FORMATS, default='text',
+                        help='Write colored, wrapped text for people (the default), or the fields of every line for '
+                             'other programs: one JSON object per line, CSV, or raw logcat -v time lines')
+    parser.add_argument('--all-crashes', dest='all_crashes', action='store_true', default=False,
+                        help='Print the stack trace of every crash. By default a crash with the same exception or '
+                             'signal and top frames as one printed before is shown as a single "seen again" line')
+    parser.add_argument('--crash-summary', dest='crash_summary', action='store_true', default=False,
+                        help='Print how often each kind of crash was seen, and by which pids, to stderr on exit')
+    parser.add_argument('--debug', dest='debug', action='store_true', default=False,
+                        help='Print diagnostics, such as filter hit rates, to stderr')
+    parser.add_argument('--stats', dest='stats', action='store_true', default=False,
+                        help='Print the lines read, parsed, dropped by each filter and printed, the time spent in '
+                             'each stage and the lag behind the device every --stats-interval seconds and on exit')
+    parser.add_argument('--stats-interval', metavar='SECONDS', dest='stats_interval', type=float, default=10.0,
+                        help='How often --stats are printed (default: 10)')
+    parser.add_argument('--stats-file', metavar='FILE', dest='stats_file',
+                        help='Append --stats to the file instead of printing them to stderr')
+    parser.add_argument('--profile', metavar='FILE', dest='profile',
+                        help='Profile pidcat with cProfile while SIGUSR1 toggles it on and off, writing the profile '
+                             'to the file each time it is switched off')
     parser.add_argument('--force-windows-colors', dest='force_windows_colors', action='store_true', default=False,
                         help='Force converting colors to Windows format')
 
@@ -149,14 +353,103 @@ def encode(line_buffer: str) -> str:
     return line_buffer
 
 
+class OutputWriter:
+    """
+    Batches rendered lines into one write, flushed past max_bytes or max_delay seconds after the first pending line.
+    Once the reader of the pipe is gone (`pidcat | head`), closed is set and lines are thrown away.
+    """
+
+    def __init__(self, stream, max_bytes: int = 64 * 1024, max_delay: float = 0.005):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self._pending: list[str] = []
+        self._pending_size = 0
+        self.write_time = 0.0
+        self.written = 0
+        self.closed = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name='pidcat-output', daemon=True)
+        self._flusher.start()
+
+    def write(self, line: str):
+        with self._lock:
+            self._pending.append(line)
+            self._pending_size += len(line) + 1
+            if self._pending_size >= self.max_bytes:
+                self._flush_locked()
+            elif len(self._pending) == 1:
+                self._wakeup.set()
+
+    def write_block(self, lines: List[str]):
+        # All lines of a block end up in the same chunk, so banners are never torn apart by a flush
+        with self._lock:
+            self._pending.extend(lines)
+            self._pending_size += sum(len(line) + 1 for line in lines)
+            if self._pending_size >= self.max_bytes:
+                self._flush_locked()
+            else:
+                self._wakeup.set()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+
+        started = time.perf_counter()
+        chunk = encode('\n'.join(self._pending) + '\n')
+        self._pending = []
+        self._pending_size = 0
+        if self.closed:
+            return
+
+        try:
+            if isinstance(chunk, bytes):
+                self.stream.buffer.write(chunk)
+                self.stream.buffer.flush()
+            else:
+                self.stream.write(chunk)
+                self.stream.flush()
+        except BrokenPipeError:
+            self.closed = True
+            # Python flushes stdout once more on exit, let that go nowhere instead of failing again
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, self.stream.fileno())
+            os.close(devnull)
+            return
+        self.write_time += time.perf_counter() - started
+        self.written += len(chunk)
+
+    def _flush_loop(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            time.sleep(self.max_delay)
+            self.flush()
+
+
+OUTPUT: Optional[OutputWriter] = None
+
+
 def print_line(line: str):
     # Make development more straightforward by allowing all prints to be commented out in a single place
-    print(encode(line))
-    pass
+    OUTPUT.write(line)
+
+
+def debug(message: str):
+    sys.stderr.write('pidcat: %s\n' % message)
 
 
-def check_match_any_pattern(input_str: str, patterns: List[Pattern]):
-    return any(pattern.match(input_str) for pattern in patterns)
+def combine_patterns(patterns: Optional[List[Pattern]]) -> Optional[Pattern]:
+    # Try all patterns of a group in one go instead of looping over them in Python
+    if not patterns:
+        return None
+
+    return re.compile('|'.join('(?:%s)' % pattern.pattern for pattern in patterns), patterns[0].flags)
 
 
 TERM_CACHE: dict[(Optional[int], Optional[int]), str] = {}
@@ -185,12 +478,96 @@ def colorize(message: str, fg: Optional[int] = None, bg: Optional[int] = None):
     return termcolor(fg, bg) + message + RESET if IS_TTY else message
 
 
-RULES: dict[Pattern, str] = {
-    # StrictMode policy violation; ~duration=319 ms: android.os.StrictMode$StrictModeDiskWriteViolation: policy=31
-    # violation=1
-    re.compile(r'^(StrictMode policy violation)(; ~duration=)(\d+ ms)'): (
-            r'%s\1%s\2%s\3%s' % (termcolor(RED), RESET, termcolor(YELLOW), RESET))
-}
+COLOR_NAMES = {'black': BLACK, 'red': RED, 'green': GREEN, 'yellow': YELLOW, 'blue': BLUE, 'magenta': MAGENTA,
+               'cyan': CYAN, 'white': WHITE}
+
+
+def required_literal(pattern: Pattern) -> Optional[str]:
+    """
+    Returns the longest piece of text every match of pattern contains, or None if there is no such piece that is
+    easy to find. Only plain sequences of characters, possibly inside groups, are considered.
+    """
+    if pattern.flags & re.IGNORECASE or not isinstance(pattern.pattern, str):
+        return None
+
+    try:
+        from re import _parser as sre_parse
+    except ImportError:
+        import sre_parse
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+
+    runs = ['']
+
+    def walk(items):
+        for op, value in items:
+            name = str(op)
+            if name == 'LITERAL':
+                runs[-1] += chr(value)
+            elif name == 'SUBPATTERN' and not value[1] & re.IGNORECASE:
+                walk(value[-1])
+            elif name != 'AT':
+                # Anchors take no room, anything else may match different text
+                runs.append('')
+
+    walk(parsed)
+    literal = max(runs, key=len)
+    return literal or None
+
+
+class HighlightRule(NamedTuple):
+    pattern: Pattern
+    replacement: str
+    literal: Optional[str]
+
+
+class Highlighter:
+    """
+    Applies the highlight rules to messages. Every rule remembers a piece of text its pattern can't match without, and
+    the pattern only runs on messages containing it, so a rule only costs a substring search on the other messages.
+    """
+
+    def __init__(self):
+        self.rules: List[HighlightRule] = []
+
+    def add(self, pattern: Pattern, replacement: str):
+        self.rules.append(HighlightRule(pattern, replacement, required_literal(pattern)))
+
+    def apply(self, message: str) -> str:
+        for pattern, replacement, literal in self.rules:
+            if literal is None or literal in message:
+                message = pattern.sub(replacement, message)
+        return message
+
+
+def parse_highlight_rule(value: str) -> HighlightRule:
+    """
+    Parses a --highlight rule, COLOR[/BACKGROUND]:REGEX. Matches of the regex anywhere in a message are colored.
+    """
+    colors, separator, regex = value.partition(':')
+    fg, _, bg = colors.strip().lower().partition('/')
+    if not separator or fg not in COLOR_NAMES or (bg and bg not in COLOR_NAMES):
+        raise argparse.ArgumentTypeError("Highlight rules look like COLOR[/BACKGROUND]:REGEX, with the colors one of %s"
+                                         % ', '.join(COLOR_NAMES))
+    if len(regex) == 0:
+        raise argparse.ArgumentTypeError("Regex must not be empty!")
+
+    try:
+        pattern = re.compile(regex)
+    except re.error as e:
+        raise argparse.ArgumentTypeError("Invalid regex %r: %s" % (regex, e))
+
+    replacement = termcolor(COLOR_NAMES[fg], COLOR_NAMES[bg] if bg else None) + r'\g<0>' + RESET
+    return HighlightRule(pattern, replacement, required_literal(pattern))
+
+
+RULES = Highlighter()
+# StrictMode policy violation; ~duration=319 ms: android.os.StrictMode$StrictModeDiskWriteViolation: policy=31
+# violation=1
+RULES.add(re.compile(r'^(StrictMode policy violation)(; ~duration=)(\d+ ms)'),
+          r'%s\1%s\2%s\3%s' % (termcolor(RED), RESET, termcolor(YELLOW), RESET))
 
 TAG_TYPES = {
     'V': colorize(' V ', fg=WHITE, bg=BLACK),
@@ -201,7 +578,8 @@ TAG_TYPES = {
     'F': colorize(' F ', fg=BLACK, bg=RED),
 }
 
-LAST_USED: deque[int] = deque([RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN])
+TAG_COLORS = [RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN]
+DEVICE_COLORS = [CYAN, MAGENTA, YELLOW, BLUE, GREEN, RED]
 KNOWN_TAGS: dict[str, int] = {
     'dalvikvm': WHITE,
     'Process': WHITE,
@@ -214,16 +592,13 @@ KNOWN_TAGS: dict[str, int] = {
 }
 
 
+@functools.lru_cache(maxsize=TAG_COLOR_CACHE_SIZE)
 def allocate_color(tag: str) -> int:
-    # this will allocate a unique format for the given tag
-    # since we don't have very many colors, we always keep track of the LRU
+    # A tag gets the same color every time, in every run and on every device, without remembering all tags ever seen
     color = KNOWN_TAGS.get(tag, None)
-    first_color = LAST_USED.popleft()
     if color is None:
-        KNOWN_TAGS[tag] = first_color
-
-    LAST_USED.append(first_color)
-    return first_color
+        color = TAG_COLORS[zlib.crc32(tag.encode('utf-8', 'replace')) % len(TAG_COLORS)]
+    return color
 
 
 def init_colorama(force_windows_colors: bool):
@@ -246,24 +621,82 @@ def setup_terminal_width(width: int) -> (any, int):
             pass
 
 
+# Escape sequences of colorize() and the RULES, which take no room on the terminal
+ANSI_ESCAPE = re.compile(r'(\033\[[0-9;]*m)')
+
+
+@functools.lru_cache(maxsize=4096)
+def char_width(char: str) -> int:
+    # Columns a character takes on the terminal: 0 for combining marks, 2 for East-Asian wide ones
+    if unicodedata.combining(char) or unicodedata.category(char) in ('Me', 'Cf'):
+        return 0
+    return 2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1
+
+
+def display_width(text: str) -> int:
+    if text.isascii():
+        return len(text) if '\033' not in text else len(ANSI_ESCAPE.sub('', text))
+    return sum(map(char_width, ANSI_ESCAPE.sub('', text)))
+
+
+def rjust_columns(text: str, width: int) -> str:
+    # text[-width:].rjust(width), counting columns rather than characters
+    if text.isascii():
+        return text[-width:].rjust(width)
+
+    start = 0
+    columns = display_width(text)
+    while columns > width:
+        columns -= char_width(text[start])
+        start += 1
+    return ' ' * (width - columns) + text[start:]
+
+
 def indent_wrap(width: int, header_size: int, message: str):
+    """
+    Wraps message at width columns, indenting the continuation lines by header_size. Escape sequences take no room
+    and East-Asian wide characters take two columns.
+    """
     if width == -1:
         return message
 
     message = message.replace('\t', '    ')
     wrap_area = width - header_size
-    message_buf = ''
-    current = 0
+    if wrap_area < 1:
+        return message
+
+    if len(message) <= wrap_area and (message.isascii() or 2 * len(message) <= wrap_area):
+        return message
 
-    while current < len(message):
-        _next = min(current + wrap_area, len(message))
-        message_buf += message[current:_next]
-        if _next < len(message):
-            message_buf += '\n'
-            message_buf += ' ' * header_size
-        current = _next
+    newline = '\n' + ' ' * header_size
+    if message.isascii() and '\033' not in message:
+        return newline.join([message[i:i + wrap_area] for i in range(0, len(message), wrap_area)])
+
+    pieces = []
+    column = 0
+    for index, part in enumerate(ANSI_ESCAPE.split(message)):
+        if index % 2:
+            pieces.append(part)
+        elif part.isascii():
+            start = 0
+            while start < len(part):
+                if column == wrap_area:
+                    pieces.append(newline)
+                    column = 0
+                end = min(len(part), start + wrap_area - column)
+                pieces.append(part[start:end])
+                column += end - start
+                start = end
+        else:
+            for char in part:
+                columns = char_width(char)
+                if column + columns > wrap_area and column > 0:
+                    pieces.append(newline)
+                    column = 0
+                pieces.append(char)
+                column += columns
 
-    return message_buf
+    return ''.join(pieces)
 
 
 def match_packages(package: str, named_processes: set[str], catchall_package: set[str], token: str):
@@ -277,56 +710,349 @@ def match_packages(package: str, named_processes: set[str], catchall_package: se
     return (token in catchall_package) if index == -1 else (token[:index] in catchall_package)
 
 
+class ProcessStart(NamedTuple):
+    package: str
+    target: str
+    pid: str
+    uid: str
+    gids: str
+
+
+class ProcessDeath(NamedTuple):
+    pid: str
+    package: str
+
+
+class LinesSkipped(NamedTuple):
+    count: int
+
+
+class CrashRepeated(NamedTuple):
+    # A crash with the signature of one shown before, in place of its stack trace
+    summary: str
+    count: int
+    pid: str
+
+
+class LogRecord(NamedTuple):
+    date: str
+    time: str
+    level: str
+    tag: str
+    pid: str
+    message: str
+    event: Optional[Union[ProcessStart, ProcessDeath, LinesSkipped, CrashRepeated]] = None
+    device: str = ''
+    # The process name of pid, only known for lines which passed the filters
+    package: str = ''
+
+
+class LogEntry(NamedTuple):
+    # An entry of `logcat -B`. The message is a view into the read buffer, nothing is decoded yet, and the date and
+    # time are only formatted from sec and nsec once the entry passed the prefilter.
+    date: Optional[str]
+    time: Optional[str]
+    level: str
+    pid: str
+    tag: bytes
+    message: Union[memoryview, bytes]
+    sec: int = 0
+    nsec: int = 0
+    tid: int = 0
+
+
+# Creates a LogEntry without going through the Python level __new__ of NamedTuple
+new_log_entry = functools.partial(tuple.__new__, LogEntry)
+
+
 def try_parse_death(pattern: Pattern, message: str, pid_group: int = 2, package_line_group: int = 1) -> Optional[
-    tuple[str, str]]:
+    ProcessDeath]:
     match = pattern.match(message)
     if match:
         pid = match.group(pid_group)
         package_line = match.group(package_line_group)
-        return pid, package_line
+        return ProcessDeath(pid, package_line)
 
     return None
 
 
-def parse_death(package: str, named_processes: str, catchall_package: set[str], pids: set[str], tag: str,
-                message: str) -> Optional[tuple[str, str]]:
-    if tag != 'ActivityManager':
-        return None
-
-    killed = try_parse_death(PID_KILL, message, 1, 2)
-    if killed and match_packages(package, named_processes, catchall_package, killed[1]) and killed[0] in pids:
-        return killed
-
-    left = try_parse_death(PID_LEAVE, message)
-    if left and match_packages(package, named_processes, catchall_package, left[1]) and left[0] in pids:
-        return left
-
-    died = try_parse_death(PID_LEAVE, message)
-    if died and match_packages(package, named_processes, catchall_package, died[1]) and died[0] in pids:
-        return died
+def parse_death(message: str) -> Optional[ProcessDeath]:
+    # The first word tells which of the death messages this could be, so at most one regex is tried
+    if message.startswith('Killing '):
+        return try_parse_death(PID_KILL, message, 1, 2)
+    if message.startswith('No longer want '):
+        return try_parse_death(PID_LEAVE, message)
+    if message.startswith('Process '):
+        return try_parse_death(PID_DEATH, message)
 
     return None
 
 
-def parse_start_process(line: str) -> Optional[tuple[str, str, str, str, str]]:
-    start = PID_START_5_1.match(line)
+def parse_start_process(message: str) -> Optional[ProcessStart]:
+    if not message.startswith('Start proc '):
+        return None
+
+    start = PID_START_5_1.match(message)
     if start:
         line_pid, line_package, target = start.groups()
-        return line_package, target, line_pid, "-", "-"
+        return ProcessStart(line_package, target, line_pid, "-", "-")
 
-    start = PID_START.match(line)
+    start = PID_START.match(message)
     if start:
         line_package, target, line_pid, line_uid, line_gids = start.groups()
-        return line_package, target, line_pid, line_uid, line_gids
+        return ProcessStart(line_package, target, line_pid, line_uid, line_gids)
+
+    return None
 
-    start = PID_START_DALVIK.match(line)
+
+def parse_dalvik_start_process(pid: str, message: str) -> Optional[ProcessStart]:
+    start = PID_START_DALVIK.match(message)
     if start:
-        line_pid, line_package, line_uid = start.groups()
-        return line_package, "-", line_pid, line_uid, "-"
+        line_package, line_uid = start.groups()
+        return ProcessStart(line_package, "-", pid, line_uid, "-")
 
     return None
 
 
+def parse_event(tag: str, pid: str, message: str) -> Optional[Union[ProcessStart, ProcessDeath]]:
+    # Only these two tags ever announce process starts and deaths, every other line skips the lifecycle regexes
+    if tag == 'ActivityManager':
+        return parse_start_process(message) or parse_death(message)
+    if tag == 'dalvikvm':
+        return parse_dalvik_start_process(pid, message)
+
+    return None
+
+
+def track_pid(names: dict[str, str], pid: str, name: str, pids: Optional[set[str]] = None,
+              limit: int = PID_TABLE_SIZE):
+    """
+    Adds a process to names, and its pid to pids. A process whose death message was lost would stay forever, so once
+    there are more than limit processes the ones started longest ago are forgotten. Both are only updated in place.
+    """
+    # Moved to the end, names are in the order the processes started
+    names.pop(pid, None)
+    names[pid] = name
+    if pids is not None:
+        pids.add(pid)
+    while len(names) > limit:
+        oldest = next(iter(names))
+        del names[oldest]
+        if pids is not None:
+            pids.discard(oldest)
+
+
+def replace_pids(target: set[str], pids):
+    # The filters hold on to the set of pids, it is only ever updated in place
+    target.intersection_update(pids)
+    target.update(pids)
+
+
+def parse_record(log_line: Match) -> LogRecord:
+    date, time, level, tag, owner, message = log_line.groups()
+    # Everything but the tag and the message is plain ASCII by construction of LOG_LINE
+    date, time, level, owner = date.decode(), time.decode(), level.decode(), owner.decode()
+    tag = tag.decode('utf-8', 'replace').strip()
+    message = message.decode('utf-8', 'replace')
+    return LogRecord(date, time, level, tag, owner, message, parse_event(tag, owner, message))
+
+
+def parse_line(line: bytes) -> Optional[LogRecord]:
+    line = line.strip()
+    if BUG_LINE_BYTES in line:
+        return None
+
+    log_line = LOG_LINE_BYTES.match(line)
+    if log_line is None:
+        return None
+
+    return parse_record(log_line)
+
+
+class LiteralMatcher:
+    """
+    Tells whether a message contains any of a set of literals in one scan, through a trie shaped regex. From
+    CONTAINS_AUTOMATON_SIZE literals on, which take it seconds to build, a pyahocorasick automaton is used if installed.
+    """
+
+    def __init__(self, literals: List[str]):
+        literals = set(literal for literal in literals if literal)
+        self.literal = next(iter(literals)) if len(literals) == 1 else None
+        self.automaton = None
+        self.pattern = None
+        if self.literal is not None or not literals:
+            return
+
+        ahocorasick = None
+        if len(literals) >= CONTAINS_AUTOMATON_SIZE:
+            try:
+                import ahocorasick
+            except ImportError:
+                pass
+        if ahocorasick is None:
+            self.pattern = re.compile(self.trie_regex(literals))
+            return
+
+        self.automaton = ahocorasick.Automaton(ahocorasick.STORE_LENGTH)
+        for literal in literals:
+            self.automaton.add_word(literal)
+        self.automaton.make_automaton()
+
+    @staticmethod
+    def trie_regex(literals) -> str:
+        trie: dict = {}
+        for literal in literals:
+            node = trie
+            for char in literal:
+                node = node.setdefault(char, {})
+            node[''] = None
+
+        def regex(node: dict) -> str:
+            # A literal ending here is all a search needs, whatever longer literals continue with
+            if '' in node:
+                return ''
+
+            branches = [re.escape(char) + regex(child) for char, child in sorted(node.items())]
+            if len(branches) == 1:
+                return branches[0]
+            singles = [branch for branch in branches if len(branch) == 1 or branch[0] == '\\' and len(branch) == 2]
+            if len(singles) == len(branches):
+                return '[%s]' % ''.join(singles)
+            return '(?:%s)' % '|'.join(branches)
+
+        return regex(trie)
+
+    def search(self, message: str) -> bool:
+        if self.literal is not None:
+            return self.literal in message
+        if self.automaton is not None:
+            for _ in self.automaton.iter(message):
+                return True
+            return False
+        return self.pattern is not None and self.pattern.search(message) is not None
+
+
+class FilterEngine:
+    """
+    Decides which log lines are displayed, cheapest check first: pids, level, tag, then the message filters. The tag
+    verdict is memoized per tag.
+    """
+
+    STAGES = ('pid', 'level', 'ignore', 'env-ignore', 'tag', 'filter', 'contains')
+
+    def __init__(self, pids: set[str], all_pids: bool, min_level: int, tags: Optional[List[Pattern]] = None,
+                 ignored_tags: Optional[List[Pattern]] = None, message_filters: Optional[List[Pattern]] = None,
+                 contains: Optional[List[str]] = None, excluded_contains: Optional[List[str]] = None,
+                 tag_cache_size: int = 4096, env_ignored_tags: Optional[List[Pattern]] = None):
+        self.pids = pids
+        self.all_pids = all_pids
+        self.min_level = min_level
+        self.tag_filter = combine_patterns(tags)
+        self.ignored_tag_filter = combine_patterns(ignored_tags)
+        self.env_ignored_tag_filter = combine_patterns(env_ignored_tags)
+        self.message_filter = combine_patterns(message_filters)
+        self.contains = LiteralMatcher(contains) if contains else None
+        self.excluded_contains = LiteralMatcher(excluded_contains) if excluded_contains else None
+        self.dropped_levels = set(level.encode() for level in LOG_LEVELS[:min_level])
+        self.dropped_level_names = set(LOG_LEVELS[:min_level])
+        self.tag_verdict = functools.lru_cache(maxsize=tag_cache_size)(self._tag_verdict)
+        # Every tag looked at, for shell completion
+        self.tags: set[str] = set()
+        self.checked = 0
+        self.dropped = dict((stage, 0) for stage in self.STAGES)
+
+    def _tag_verdict(self, tag: str) -> Optional[str]:
+        # The stage dropping the tag, None if it is shown
+        if len(self.tags) < COMPLETION_TAGS_SIZE:
+            self.tags.add(tag)
+        if self.ignored_tag_filter is not None and self.ignored_tag_filter.match(tag):
+            return 'ignore'
+        if self.env_ignored_tag_filter is not None and self.env_ignored_tag_filter.match(tag):
+            return 'env-ignore'
+        if self.tag_filter is not None and not self.tag_filter.match(tag):
+            return 'tag'
+
+        return None
+
+    def prefilter(self, log_line: Match) -> bool:
+        """
+        Runs the pid and level checks on an undecoded LOG_LINE_BYTES match. Lines with a lifecycle tag always pass,
+        since process tracking needs them whatever the filters say.
+        """
+        if log_line.group(4).strip() in LIFECYCLE_TAGS_BYTES:
+            return True
+
+        # Lines passing here are counted by accepts() later on
+        if not self.all_pids and log_line.group(5).decode() not in self.pids:
+            self.checked += 1
+            self.dropped['pid'] += 1
+            return False
+        if log_line.group(3) in self.dropped_levels:
+            self.checked += 1
+            self.dropped['level'] += 1
+            return False
+
+        return True
+
+    def prefilter_entry(self, entry: LogEntry) -> bool:
+        """
+        The same checks as prefilter() for an entry of `logcat -B`, before its tag and message are decoded.
+        """
+        if entry.tag in LIFECYCLE_TAGS_BYTES:
+            return True
+
+        if not self.all_pids and entry.pid not in self.pids:
+            self.checked += 1
+            self.dropped['pid'] += 1
+            return False
+        if entry.level in self.dropped_level_names:
+            self.checked += 1
+            self.dropped['level'] += 1
+            return False
+
+        return True
+
+    def accepts(self, owner: str, level: str, tag: str, message: str) -> bool:
+        self.checked += 1
+        if not self.all_pids and owner not in self.pids:
+            self.dropped['pid'] += 1
+            return False
+        if level in LOG_LEVELS_MAP and LOG_LEVELS_MAP[level] < self.min_level:
+            self.dropped['level'] += 1
+            return False
+        verdict = self.tag_verdict(tag)
+        if verdict is not None:
+            self.dropped[verdict] += 1
+            return False
+        if self.message_filter is not None and not self.message_filter.match(message):
+            self.dropped['filter'] += 1
+            return False
+        if self.contains is not None and not self.contains.search(message):
+            self.dropped['contains'] += 1
+            return False
+        if self.excluded_contains is not None and self.excluded_contains.search(message):
+            self.dropped['contains'] += 1
+            return False
+
+        return True
+
+    def report(self) -> List[str]:
+        lines = []
+        remaining = self.checked
+        for stage in self.STAGES:
+            dropped = self.dropped[stage]
+            rate = 100.0 * dropped / remaining if remaining else 0.0
+            lines.append('filter %-10s checked %d, dropped %d (%.1f%%)' % (stage, remaining, dropped, rate))
+            remaining -= dropped
+
+        cache = self.tag_verdict.cache_info()
+        lookups = cache.hits + cache.misses
+        rate = 100.0 * cache.hits / lookups if lookups else 0.0
+        lines.append('filter tag cache: %d hits, %d misses (%.1f%% hit rate), %d/%d entries' % (
+            cache.hits, cache.misses, rate, cache.currsize, cache.maxsize))
+        return lines
+
+
 def set_term_title(title: str):
     print_line("\033]0;%s\007" % title)
 
@@ -335,292 +1061,3394 @@ def clear_term_title():
     set_term_title("")
 
 
-# This is a ducktype of the subprocess.Popen object
-class FakeStdInProcess:
-    def __init__(self):
-        self.stdout = sys.stdin
+class LineReader:
+    """
+    Reads a binary pipe in large blocks and yields its lines undecoded. on_idle is called before a read that would
+    block, data on wakeup_fd yields an empty line, and tap gets every block read.
+    """
+
+    def __init__(self, stream, chunk_size: int = 64 * 1024, on_idle=None, wakeup_fd: Optional[int] = None, tap=None):
+        self.fd = stream.fileno()
+        self.chunk_size = chunk_size
+        self.tap = tap
+        # select() only supports sockets on Windows
+        self.on_idle = on_idle if os.name != 'nt' else None
+        self.wakeup_fd = wakeup_fd if os.name != 'nt' else None
+        self._watched = [self.fd] if self.wakeup_fd is None else [self.fd, self.wakeup_fd]
+
+    def _ready(self, timeout: Optional[float]) -> list[int]:
+        import select
+        readable, _, _ = select.select(self._watched, [], [], timeout)
+        return readable
+
+    def chunks(self):
+        # Yields the blocks read, and an empty block whenever wakeup_fd fired
+        while True:
+            if self.on_idle is not None or self.wakeup_fd is not None:
+                ready = self._ready(0)
+                if not ready:
+                    if self.on_idle is not None:
+                        self.on_idle()
+                    if self.wakeup_fd is not None:
+                        ready = self._ready(None)
+
+                if self.wakeup_fd in ready:
+                    os.read(self.wakeup_fd, 4096)
+                    yield b''
+                    if self.fd not in ready:
+                        continue
+
+            chunk = os.read(self.fd, self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def __iter__(self):
+        remainder = b''
+        tap = self.tap
+        for chunk in self.chunks():
+            if not chunk:
+                yield b''
+                continue
+            if tap is not None:
+                tap(chunk)
+
+            lines = (remainder + chunk).split(b'\n')
+            remainder = lines.pop()
+            yield from lines
+
+        if remainder:
+            yield remainder
+
+
+class LogFormatError(ValueError):
+    pass
 
-    def poll(self):
+
+class LogEntryReader(LineReader):
+    """
+    Decodes the entries of `logcat -B` into LogEntry tuples, with the message as a memoryview. Raises LogFormatError on
+    data that doesn't look like log entries.
+    """
+
+    def __iter__(self):
+        unpack_from = LOG_ENTRY_HEADER.unpack_from
+        header_length = LOG_ENTRY_HEADER.size
+        levels = LOG_ENTRY_LEVELS
+
+        buffer = b''
+        for chunk in self.chunks():
+            if not chunk:
+                yield None
+                continue
+
+            buffer = buffer + chunk if buffer else chunk
+            view = memoryview(buffer)
+            size = len(buffer)
+            offset = 0
+            while size - offset >= header_length:
+                length, header_size, pid, tid, sec, nsec = unpack_from(buffer, offset)
+                if header_size == 0:
+                    header_size = header_length
+                if not header_length <= header_size <= 128 or not 2 <= length <= LOG_ENTRY_MAX_PAYLOAD:
+                    raise LogFormatError('invalid log entry header at byte %d' % offset)
+
+                payload = offset + header_size
+                end = payload + length
+                if end > size:
+                    break
+                offset = end
+
+                priority = buffer[payload]
+                if priority >= len(levels):
+                    raise LogFormatError('invalid log entry priority %d' % priority)
+                level = levels[priority]
+                if level is None:
+                    continue
+
+                tag_end = buffer.find(b'\0', payload + 1, end)
+                if tag_end == -1:
+                    continue
+                if buffer[end - 1] == 0:
+                    end -= 1
+
+                yield new_log_entry((None, None, level, str(pid), buffer[payload + 1:tag_end], view[tag_end + 1:end],
+                                     sec, nsec, tid))
+
+            buffer = buffer[offset:]
+
+
+def entry_from_line(line: bytes) -> Optional[LogEntry]:
+    # Turns a line of `logcat -v time` into an entry, for devices which can't do -B
+    line = line.strip()
+    if BUG_LINE_BYTES in line:
         return None
 
+    log_line = LOG_LINE_BYTES.match(line)
+    if log_line is None:
+        return None
 
-def indent_tag(tag_width: int, tag: str, create_tag: bool, force_color: Optional[int] = None) -> tuple[Optional[int], str]:
-    if tag_width > 0:
-        # right-align tag title and allocate color if needed
-        if create_tag:
-            color = force_color if force_color else allocate_color(tag)
-            tag = tag[-tag_width:].rjust(tag_width)
-            return color, colorize(tag, fg=color) + " "
-        else:
-            return None, " " * (tag_width + 1)
+    date, time, level, tag, owner, message = log_line.groups()
+    return LogEntry(date.decode(), time.decode(), level.decode(), owner.decode(), tag.strip(), message)
 
-    return None, ""
 
+class ResumePoint:
+    """
+    Remembers the timestamp of the newest line read and the lines logged at that timestamp. Once logcat was restarted
+    with -T <timestamp>, accept() skips the lines the new process replays up to and including that point.
+    """
 
-def create_tag_level(level: str) -> str:
-    if level in TAG_TYPES:
-        return TAG_TYPES[level]
+    # Length of the "MM-DD hh:mm:ss.mmm" prefix of a `-v time` line
+    TIMESTAMP_LENGTH = 18
 
-    return level
+    def __init__(self):
+        self._key = None
+        self._lines = set()
+        self.replaying = False
+
+    @property
+    def timestamp(self) -> Optional[str]:
+        return self._key.decode() if self._key is not None else None
+
+    def accept(self, line: bytes) -> bool:
+        if not line[:1].isdigit():
+            # Headers such as "--------- beginning of main" are printed again by every new process
+            return not self.replaying
+
+        return self.accept_key(line[:self.TIMESTAMP_LENGTH], line)
+
+    def accept_key(self, key, line) -> bool:
+        if self.replaying:
+            if key < self._key or (key == self._key and line in self._lines):
+                return False
+            if key > self._key:
+                self.replaying = False
+
+        if key != self._key:
+            self._key = key
+            self._lines.clear()
+        self._lines.add(line)
+        return True
 
 
-def prepend_time(line_buffer: str, time: str, add_timestamp: bool) -> str:
-    if add_timestamp:
-        return f"{time} {line_buffer}"
+class EntryResumePoint(ResumePoint):
+    """
+    ResumePoint for the entries of `logcat -B`, which carry the time in seconds and nanoseconds since the epoch. logcat
+    -T takes that as 'sssss.mmm' too, which is immune to time zone differences between the device and the host.
+    """
+
+    @property
+    def timestamp(self) -> Optional[str]:
+        if self._key is None:
+            return None
+
+        sec, nsec = self._key
+        return '%d.%03d' % (sec, nsec // 1000000)
+
+    def accept(self, entry: LogEntry) -> bool:
+        return self.accept_key((entry.sec, entry.nsec), (entry.pid, entry.tid, entry.sec, entry.nsec))
+
+
+class LogcatProcess:
+    """
+    Owns the `adb logcat` process and iterates over its lines, or LogEntry tuples with binary_command (falling back to
+    text). When logcat ends, reconnect() decides whether it is restarted with -T at the last line read.
+    """
+
+    def __init__(self, command: List[str], filter_args: List[str], on_idle=None, wakeup_fd: Optional[int] = None,
+                 binary_command: Optional[List[str]] = None, reconnect=None, tap=None):
+        self.command = command
+        self.reconnect = reconnect
+        self.tap = tap
+        self.binary_command = binary_command
+        self.entries = binary_command is not None
+        self.filter_args = filter_args
+        self.on_idle = on_idle
+        self.wakeup_fd = wakeup_fd
+        self.resume = EntryResumePoint() if self.entries else ResumePoint()
+        self._lock = threading.Lock()
+        self.process = self._spawn(filter_args)
+
+    def _spawn(self, filter_args: List[str], since: Optional[str] = None) -> subprocess.Popen:
+        command = (self.binary_command or self.command)[:]
+        if since is not None:
+            command.extend(['-T', since])
+        command.extend(filter_args)
+        if ADB_SERVER is not None:
+            process = ADB_SERVER.spawn(command)
+            if process is not None:
+                return process
+        return subprocess.Popen(command, stdin=PIPE, stdout=PIPE)
 
-    return line_buffer
+    def poll(self):
+        return self.process.poll()
+
+    def _read(self):
+        # Returns True when it switched to text and the new process is still to be read
+        resume = self.resume
+        if self.binary_command is not None:
+            decoded = False
+            try:
+                for entry in LogEntryReader(self.process.stdout, on_idle=self.on_idle, wakeup_fd=self.wakeup_fd):
+                    if entry is None:
+                        yield entry
+                        continue
+
+                    decoded = True
+                    if resume.accept(entry):
+                        yield entry
+            except LogFormatError as e:
+                self._fall_back_to_text(str(e))
+                return True
+
+            if not decoded and self.process.wait() != 0:
+                self._fall_back_to_text('logcat -B exited with status %d' % self.process.returncode)
+                return True
+            return False
+
+        for line in LineReader(self.process.stdout, on_idle=self.on_idle, wakeup_fd=self.wakeup_fd, tap=self.tap):
+            if resume.accept(line):
+                yield entry_from_line(line) if self.entries else line
+        return False
+
+    def _fall_back_to_text(self, reason: str):
+        debug('cannot read binary logs (%s), reading text instead' % reason)
+        with self._lock:
+            if self.process.poll() is None:
+                self.process.terminate()
+            self.process.wait()
+
+            # Lines already shown may be shown again, the text lines can't be matched to the entries
+            since = self.resume.timestamp
+            self.binary_command = None
+            self.resume = ResumePoint()
+            self.process = self._spawn(self.filter_args, since)
+
+    def __iter__(self):
+        while True:
+            if (yield from self._read()):
+                continue
+
+            if self.reconnect is None or not self.reconnect():
+                return
+
+            resume = self.resume
+            with self._lock:
+                self.process.wait()
+                self.process = self._spawn(self.filter_args, resume.timestamp)
+                resume.replaying = resume.timestamp is not None
+            if self.tap is not None:
+                self.tap(None)
+
+
+class AdbError(Exception):
+    pass
 
 
-def main():
-    argv = ['%s%s' % (FROMFILE_PREFIX, conf) for conf in CONF_FILES if os.path.isfile(conf)]
-    argv.extend(sys.argv[1:])
-    args = parse_args(argv)
-    min_level = LOG_LEVELS_MAP[args.min_level.upper()]
+# This is a ducktype of the subprocess.Popen object, for a command streaming through the adb server
+class AdbServiceProcess:
+    def __init__(self, connection: socket.socket, returncode: Optional[int] = None):
+        # LineReader reads the socket itself, the bytes don't go through an adb process and a pipe
+        self.stdout = connection
+        self.returncode = returncode
 
-    package = args.package
+    def poll(self) -> Optional[int]:
+        return self.returncode
 
-    base_adb_command = ['adb']
-    if args.device_serial:
-        base_adb_command.extend(['-s', args.device_serial])
-    if args.use_device:
-        base_adb_command.append('-d')
-    if args.use_emulator:
-        base_adb_command.append('-e')
+    def terminate(self):
+        # Ends the stream for the thread reading it, like the end of a process would
+        if self.returncode is None:
+            self.returncode = -signal.SIGTERM
+        try:
+            self.stdout.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
-    android_version_command = base_adb_command + ["shell", "getprop", "ro.build.version.sdk"]
-    android_sdk = subprocess.Popen(android_version_command, stdout=PIPE, stderr=PIPE).communicate()[0]
+    def wait(self) -> int:
+        # The exit status of the command on the device doesn't come through the adb server
+        if self.returncode is None:
+            self.returncode = 0
+        self.stdout.close()
+        return self.returncode
+
+
+class AdbShell:
+    """
+    A shell kept open on the device through the adb server (exec:sh), running one command after the other. The output of
+    a command ends at a marker printed after it.
+    """
+
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        self.end = b'\n__pidcat_%s__\n' % os.urandom(8).hex().encode()
+        self.commands = 0
+
+    def run(self, command: str) -> bytes:
+        # The command doesn't get the connection as stdin, that is where the next commands come from
+        self.connection.sendall(b"{ %s\n} </dev/null 2>/dev/null; printf '%s'\n" % (
+            command.encode('utf-8'), self.end.replace(b'\n', b'\\n')))
+        output = bytearray()
+        while not output.endswith(self.end):
+            chunk = self.connection.recv(64 * 1024)
+            if not chunk:
+                raise AdbError('the shell on the device ended')
+            output += chunk
+
+        self.commands += 1
+        return bytes(output[:-len(self.end)])
+
+    def close(self):
+        self.connection.close()
+
+
+class AdbServer:
+    """
+    Talks to the adb server over its socket for --adb-server. output() and spawn() take adb command lines and return
+    None for what they leave to adb; shell commands run in shells kept open, up to ADB_IDLE_SHELLS per device.
+    """
+
+    def __init__(self, address: tuple[str, int]):
+        self.address = address
+        self._lock = threading.Lock()
+        self._idle: dict[str, List[AdbShell]] = {}
+        self._no_exec: set[str] = set()
+        self._started = False
+
+        self.connections = 0
+        self.commands = 0
+        self.reused = 0
+
+    @staticmethod
+    def _target(command: List[str]) -> tuple[Optional[str], List[str]]:
+        # The device chosen by the options of an adb command line, as 'serial:SERIAL', 'usb', 'local' or 'any'
+        if command[:1] != ['adb']:
+            return None, command
+        argv = command[1:]
+        target = 'serial:%s' % os.getenv('ANDROID_SERIAL') if os.getenv('ANDROID_SERIAL') else 'any'
+        while argv[:1] in (['-s'], ['-d'], ['-e']):
+            if argv[0] == '-s':
+                if len(argv) < 2:
+                    return None, argv
+                target, argv = 'serial:%s' % argv[1], argv[2:]
+            else:
+                target, argv = 'usb' if argv[0] == '-d' else 'local', argv[1:]
+        if argv[:1] and argv[0].startswith('-'):
+            return None, argv
+        return target, argv
 
-    if args.current_app:
-        system_dump_command = base_adb_command + ["shell", "dumpsys", "activity", "activities"]
-        system_dump = subprocess.Popen(system_dump_command, stdout=PIPE, stderr=PIPE).communicate()[0]
+    def _connect(self) -> socket.socket:
         try:
-            if int(android_sdk) >= 30:
-                running_package_name = re.search(".*Task.*A[= ][0-9]+:([^ ^}]*)", str(system_dump)).group(1)
+            connection = socket.create_connection(self.address)
+        except ConnectionRefusedError:
+            if self._started or self.address[0] not in ('localhost', '127.0.0.1', '::1'):
+                raise
+            self._started = True
+            subprocess.call(['adb', 'start-server'], stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL,
+                            env=dict(os.environ, ANDROID_ADB_SERVER_PORT=str(self.address[1])))
+            connection = socket.create_connection(self.address)
+        self.connections += 1
+        return connection
+
+    @staticmethod
+    def _read_exactly(connection: socket.socket, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            if not chunk:
+                raise AdbError('the adb server closed the connection')
+            data += chunk
+        return data
+
+    def _read_reply(self, connection: socket.socket) -> bytes:
+        return self._read_exactly(connection, int(self._read_exactly(connection, 4), 16))
+
+    def _request(self, connection: socket.socket, request: str):
+        # A request is its length in 4 hex digits and the request, answered by OKAY or by FAIL and a message
+        payload = request.encode('utf-8')
+        connection.sendall(b'%04x%s' % (len(payload), payload))
+        status = self._read_exactly(connection, 4)
+        if status == b'FAIL':
+            raise AdbError(self._read_reply(connection).decode('utf-8', 'replace'))
+        if status != b'OKAY':
+            raise AdbError('unexpected reply %r from the adb server' % status)
+
+    def _transport(self, target: str) -> socket.socket:
+        # A connection to the server switched to the device, for a service on it
+        connection = self._connect()
+        try:
+            if target.startswith('serial:'):
+                self._request(connection, 'host:transport:%s' % target[7:])
             else:
-                running_package_name = re.search(".*TaskRecord.*A[= ]([^ ^}]*)", str(system_dump)).group(1)
+                self._request(connection, 'host:transport-%s' % target)
+        except (AdbError, OSError):
+            connection.close()
+            raise
+        return connection
 
-            package.append(running_package_name)
-        except:
-            pass
+    def host_query(self, target: str, query: str) -> bytes:
+        # Questions the server answers itself, such as get-serialno
+        if target.startswith('serial:'):
+            prefix = 'host-serial:%s:' % target[7:]
+        else:
+            prefix = {'usb': 'host-usb:', 'local': 'host-local:'}.get(target, 'host:')
+        connection = self._connect()
+        try:
+            self._request(connection, prefix + query)
+            return self._read_reply(connection)
+        finally:
+            connection.close()
+
+    def open_command(self, target: str, command: str) -> socket.socket:
+        """
+        Runs a command on the device and returns the connection its output comes through, until it is closed.
+        """
+        connection = self._transport(target)
+        if target not in self._no_exec:
+            try:
+                # Unlike shell:, exec: never runs the command on a terminal, which would turn \n into \r\n
+                self._request(connection, 'exec:%s' % command)
+                return connection
+            except AdbError:
+                connection.close()
+                self._no_exec.add(target)
+            connection = self._transport(target)
 
-    proguard_mapping = {}
-    if args.proguard_mapping:
-        with open(args.proguard_mapping) as fr:
-            for line in fr:
-                mapping_match = PROGUARD_MAPPING.match(line.strip())
-                if mapping_match is not None:
-                    from_ = mapping_match.group(1)
-                    to = mapping_match.group(2)
-                    proguard_mapping[to] = from_
+        try:
+            self._request(connection, 'shell:%s' % command)
+        except (AdbError, OSError):
+            connection.close()
+            raise
+        return connection
+
+    def _take_shell(self, target: str) -> Optional[AdbShell]:
+        with self._lock:
+            idle = self._idle.get(target)
+            if idle:
+                self.reused += 1
+                return idle.pop()
+            if target in self._no_exec:
+                return None
+
+        connection = self._transport(target)
+        try:
+            self._request(connection, 'exec:sh')
+        except AdbError:
+            connection.close()
+            self._no_exec.add(target)
+            return None
+        return AdbShell(connection)
+
+    def _give_back(self, target: str, shell: AdbShell):
+        with self._lock:
+            idle = self._idle.setdefault(target, [])
+            if len(idle) < ADB_IDLE_SHELLS:
+                idle.append(shell)
+                return
+        shell.close()
+
+    def shell(self, target: str, command: str) -> bytes:
+        """
+        Returns the output of a shell command on the device, stdout only.
+        """
+        self.commands += 1
+        while True:
+            shell = self._take_shell(target)
+            if shell is None:
+                connection = self.open_command(target, '{ %s\n} 2>/dev/null' % command)
+                try:
+                    return read_all(connection)
+                finally:
+                    connection.close()
+
+            try:
+                output = shell.run(command)
+            except (AdbError, OSError):
+                shell.close()
+                if shell.commands:
+                    # Kept open while the device went away, try a new one
+                    continue
+                raise
+            self._give_back(target, shell)
+            return output
+
+    def output(self, command: List[str]) -> Optional[bytes]:
+        """
+        Returns what the adb command line would print on stdout, nothing if it failed. Returns None for the commands
+        it doesn't know, which are left to adb.
+        """
+        target, argv = self._target(command)
+        if target is None or not argv:
+            return None
+
+        name, argv = argv[0], argv[1:]
+        try:
+            if name == 'devices' and not argv:
+                return b'List of devices attached\n' + self.host_query('any', 'devices')
+            if name in ('get-serialno', 'get-state') and not argv:
+                return self.host_query(target, name) + b'\n'
+            if name == 'shell' and argv:
+                return self.shell(target, ' '.join(argv))
+            if name == 'logcat' and ('-d' in argv or '-c' in argv):
+                return self.shell(target, ' '.join(['logcat'] + [shlex.quote(arg) for arg in argv]))
+        except (AdbError, OSError):
+            return b''
+        return None
 
-    if len(package) == 0:
-        args.all = True
+    def spawn(self, command: List[str]) -> Optional[AdbServiceProcess]:
+        """
+        Starts `adb logcat ...`, whose output is then read from the connection to the server. Returns None for other
+        command lines, which are left to adb.
+        """
+        target, argv = self._target(command)
+        # LineReader reads with os.read(), which doesn't take sockets on Windows
+        if target is None or argv[:1] != ['logcat'] or os.name == 'nt':
+            return None
 
-    # Store the names of packages for which to match all processes.
-    catchall_package = set(filter(lambda pkg: pkg.find(":") == -1, package))
+        try:
+            return AdbServiceProcess(self.open_command(target, ' '.join(shlex.quote(arg) for arg in argv)))
+        except (AdbError, OSError):
+            # Like a process which failed, with nothing to read
+            connection, other = socket.socketpair()
+            other.close()
+            return AdbServiceProcess(connection, 1)
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for shell in idle:
+                    shell.close()
+            self._idle.clear()
+
+    def report(self) -> List[str]:
+        return ['adb server: %d connections, %d of %d shell commands ran in a shell kept open' % (
+            self.connections, self.reused, self.commands)]
+
+
+def read_all(connection: socket.socket) -> bytes:
+    chunks = []
+    while True:
+        chunk = connection.recv(64 * 1024)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
 
-    # Store the name of processes to match exactly.
-    named_processes = set(filter(lambda pkg: pkg.find(":") != -1, package))
 
-    # Convert default process names from <package>: (cli notation) to <package> (android notation) in the exact names
-    # match group.
-    named_processes = set([pkg if pkg.find(":") != len(pkg) - 1 else pkg[:-1] for pkg in named_processes])
+# Set by --adb-server
+ADB_SERVER: Optional[AdbServer] = None
 
-    header_size = args.tag_width + 1 + 3 + 1  # space, level, space
-    if args.add_timestamp:
-        header_size += 12 + 1  # time, space
 
-    width = args.width
-    new_size = setup_terminal_width(width)
-    if new_size:
-        h, width = new_size
+def adb_output(command: List[str]) -> bytes:
+    if ADB_SERVER is not None:
+        output = ADB_SERVER.output(command)
+        if output is not None:
+            return output
+    return subprocess.Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE).communicate()[0]
 
-    init_colorama(args.force_windows_colors)
 
-    # Only enable GC coloring if the user opted-in
-    if args.color_gc:
-        # GC_CONCURRENT freed 3617K, 29% free 20525K/28648K, paused 4ms+5ms, total 85ms
-        key = re.compile(
-            r'^(GC_(?:CONCURRENT|FOR_M?ALLOC|EXTERNAL_ALLOC|EXPLICIT) )(freed <?\d+.)(, \d+\% free \d+./\d+., )(paused \d+ms(?:\+\d+ms)?)')
-        val = r'\1%s\2%s\3%s\4%s' % (termcolor(GREEN), RESET, termcolor(YELLOW), RESET)
+def adb_call(command: List[str]) -> int:
+    if ADB_SERVER is not None and ADB_SERVER.output(command) is not None:
+        return 0
+    return subprocess.call(command)
 
-        RULES[key] = val
 
-    device_name_command = base_adb_command + ["shell", "getprop", "ro.product.model"]
-    device_name = subprocess.Popen(device_name_command, stdout=PIPE, stderr=PIPE).communicate()[0].decode(
-        "utf-8").strip()
-    set_term_title(device_name)
+def parse_process_table(ps_output: bytes) -> dict[str, str]:
+    # Understands both the full `ps` listing and `ps -o PID,NAME`
+    processes = {}
+    for line in ps_output.decode('utf-8', 'replace').splitlines():
+        line = line.strip()
+        pid_match = PID_LINE.match(line) or PID_NAME_LINE.match(line)
+        if pid_match is not None:
+            processes[pid_match.group(1)] = pid_match.group(2)
 
-    adb_command = base_adb_command[:]
-    adb_command.append('logcat')
-    adb_command.extend(['-v', 'time'])
+    return processes
 
-    if args.alternate_buffer:
-        for buffer in args.alternate_buffer:
-            adb_command.extend(['-b', buffer])
 
-    # Clear log before starting logcat
-    if args.clear_logcat:
-        adb_clear_command = list(adb_command)
-        adb_clear_command.append('-c')
-        adb_clear = subprocess.Popen(adb_clear_command)
+# The adb command lines of devices whose ps lists nothing with the options of PS_COMMAND
+PLAIN_PS_DEVICES: set[tuple] = set()
 
-        while adb_clear.poll() is None:
-            pass
 
-    if IS_TTY:
-        adb = subprocess.Popen(adb_command, stdin=PIPE, stdout=PIPE)
-    else:
-        adb = FakeStdInProcess()
+def read_process_table(base_adb_command: List[str]) -> dict[str, str]:
+    device = tuple(base_adb_command)
+    if device not in PLAIN_PS_DEVICES:
+        processes = parse_process_table(adb_output(base_adb_command + ['shell', PS_COMMAND]))
+        if processes:
+            return processes
 
-    pids: set[str] = set()
-    last_tag = None
-    app_pid = None
+    # toolbox ps of Android 6.0 and older takes the options for a process name: it lists no process and succeeds
+    processes = parse_process_table(adb_output(base_adb_command + ['shell', 'ps']))
+    if processes:
+        PLAIN_PS_DEVICES.add(device)
+    return processes
 
-    ps_command = base_adb_command + ['shell', 'ps']
-    ps_pid = subprocess.Popen(ps_command, stdin=PIPE, stdout=PIPE, stderr=PIPE)
-    while True:
+
+def cache_dir() -> str:
+    return os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'pidcat')
+
+
+class DeviceCache:
+    """
+    Per-serial JSON cache of device properties which stay the same between runs, such as the SDK level and the model
+    name. Entries expire after ttl seconds. Failing to read or write the cache is never an error.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = DEVICE_CACHE_TTL):
+        self.path = path or os.path.join(cache_dir(), 'devices.json')
+        self.ttl = ttl
+
+    def _load(self) -> dict:
         try:
-            line = ps_pid.stdout.readline().decode('utf-8', 'replace').strip()
-        except KeyboardInterrupt:
-            break
-        if len(line) == 0:
-            break
+            with open(self.path) as fr:
+                return json.load(fr)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, serial: str) -> Optional[dict]:
+        entry = self._load().get(serial)
+        if entry is None or time.time() - entry.get('time', 0) > self.ttl:
+            return None
+
+        return entry
+
+    def put(self, serial: str, properties: dict):
+        entries = self._load()
+        entries[serial] = dict(properties, time=time.time())
+        self._save(entries)
+
+    def _save(self, entries: dict):
+        # Written to a file of this process first, other pidcat processes may save at the same time
+        temporary = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temporary, 'w') as fw:
+                json.dump(entries, fw)
+            os.replace(temporary, self.path)
+        except OSError:
+            pass
 
-        pid_match = PID_LINE.match(line)
-        if pid_match is not None:
-            pid = pid_match.group(1)
-            proc = pid_match.group(2)
-            index = proc.find(':')
-            keep = (proc in catchall_package) if index == -1 else (proc[:index] in catchall_package)
-            if keep:
-                seen_pids = True
-                pids.add(pid)
-
-    compiled_env_ignore_tags = parse_regex_inputs(ENV_IGNORED_TAGS)
-
-    last_color = None
-    print_counter = 0
-    while adb.poll() is None:
+
+class CompletionCache(DeviceCache):
+    """
+    The lists printed by --list-packages, --list-tags and --list-serials, keyed by list and device. Unlike device
+    properties, an expired list is still used; the caller refreshes it in the background.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: float = COMPLETION_CACHE_TTL):
+        super().__init__(path or os.path.join(cache_dir(), 'completion.json'), ttl)
+
+    def lookup(self, key: str) -> tuple[Optional[List[str]], bool]:
+        # The list, None if there is none, and whether it is still fresh
+        entry = self._load().get(key)
+        if entry is None:
+            return None, False
+
+        return entry.get('items', []), time.time() - entry.get('time', 0) <= self.ttl
+
+    def merge(self, key: str, items: set[str]):
+        # Keeps the time of the list, so that it is still refreshed from the device when it expires
+        entries = self._load()
+        entry = entries.get(key)
+        if entry is not None and items.issubset(entry.get('items', [])):
+            return
+
+        if entry is None:
+            entry = entries[key] = {'time': time.time()}
+        entry['items'] = sorted(items.union(entry.get('items', [])))
+        self._save(entries)
+
+
+def completion_key(args, kind: str, serial: Optional[str] = None) -> str:
+    # The device as the options name it, without asking adb which one that is
+    if kind == 'serials':
+        return kind
+    serial = serial or (args.device_serial or [None])[0] or os.getenv('ANDROID_SERIAL')
+    device = serial or ('-d' if args.use_device else '-e' if args.use_emulator else '')
+    return '%s:%s' % (kind, device)
+
+
+def read_packages(base_adb_command: List[str], third_party: bool = False) -> List[str]:
+    options = ' -3' if third_party else ''
+    output = adb_output(base_adb_command + ['shell', 'pm list packages%s 2>/dev/null || cmd package list packages%s' % (
+        options, options)])
+    packages = set(line[8:].strip() for line in output.decode('utf-8', 'replace').splitlines()
+                   if line.startswith('package:'))
+    # Running processes add the <package>:<process> names
+    packages.update(name for name in read_process_table(base_adb_command).values() if PROCESS_NAME.match(name))
+    return sorted(packages)
+
+
+def read_tags(base_adb_command: List[str]) -> List[str]:
+    output = adb_output(base_adb_command + ['logcat', '-d', '-v', 'time'])
+    return sorted(set(tag.decode('utf-8', 'replace').strip() for tag in LOG_TAG_BYTES.findall(output)))
+
+
+def list_completions(args, argv: List[str]):
+    """
+    --list-packages, --list-tags and --list-serials: prints the cached list, one name per line. An expired list is
+    printed anyway and refreshed in the background.
+    """
+    cache = CompletionCache()
+    kind = 'third-party-packages' if args.list == 'packages' and args.third_party else args.list
+    key = completion_key(args, kind)
+    items, fresh = cache.lookup(key)
+    if items is None or args.refresh_list:
+        base_adb_command = ['adb'] + (['-s', args.device_serial[0]] if args.device_serial else [])
+        if args.use_device:
+            base_adb_command.append('-d')
+        if args.use_emulator:
+            base_adb_command.append('-e')
+
+        if args.list == 'serials':
+            read_items = list_devices()
+        elif args.list == 'packages':
+            read_items = read_packages(base_adb_command, args.third_party)
+        else:
+            read_items = read_tags(base_adb_command)
+        # Without a device, keep what was known about it
+        if read_items or args.list == 'serials' or items is None:
+            items = read_items
+            cache.put(key, {'items': items})
+    elif not fresh:
+        cache.put(key, {'items': items})
+        subprocess.Popen([sys.executable, os.path.abspath(__file__)] + argv + ['--refresh-list'], stdin=DEVNULL,
+                         stdout=DEVNULL, stderr=DEVNULL, start_new_session=True)
+
+    if not args.refresh_list:
+        sys.stdout.write(''.join(item + '\n' for item in items))
+
+
+class ProguardMapping:
+    """
+    Maps obfuscated class names through a memory-mapped index of a ProGuard/R8 mapping file, built once per file.
+    Layout: PROGUARD_INDEX header, 64-bit entry offsets, then `obfuscated<tab>original` lines sorted by name.
+    """
+
+    def __init__(self, path: str, index_path: str):
+        self.path = path
+        self.index_path = index_path
+        with open(index_path, 'rb') as fr:
+            self._map = mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ)
+        _, _, _, self.count = PROGUARD_INDEX.unpack_from(self._map)
+        self._offsets = memoryview(self._map)[PROGUARD_INDEX.size:PROGUARD_INDEX.size + 8 * self.count].cast('Q')
+        self._entries = PROGUARD_INDEX.size + 8 * self.count
+        self._names: dict[str, Optional[str]] = {}
+
+    def __len__(self):
+        return self.count
+
+    def __reduce__(self):
+        # Worker processes map the index themselves
+        return ProguardMapping.load, (self.path,)
+
+    @staticmethod
+    def index_paths(path: str) -> List[str]:
+        digest = hashlib.sha1(os.path.realpath(path).encode()).hexdigest()
+        return [path + '.pidcat-index', os.path.join(cache_dir(), 'proguard-%s.index' % digest)]
+
+    @staticmethod
+    def load(path: str) -> 'ProguardMapping':
+        stat = os.stat(path)
+        header = PROGUARD_INDEX.pack(PROGUARD_INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, 0)[:-8]
+        index_paths = ProguardMapping.index_paths(path)
+        for index_path in index_paths:
+            try:
+                with open(index_path, 'rb') as fr:
+                    if fr.read(len(header)) == header:
+                        return ProguardMapping(path, index_path)
+            except OSError:
+                pass
+
+        return ProguardMapping(path, ProguardMapping.build(path, index_paths, stat))
+
+    @staticmethod
+    def build(path: str, index_paths: List[str], stat: os.stat_result) -> str:
+        names = {}
+        with open(path, 'rb') as fr:
+            if stat.st_size:
+                with mmap.mmap(fr.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+                    for match in PROGUARD_MAPPING.finditer(mapping):
+                        names[match.group(2)] = match.group(1)
+
+        offsets = array.array('Q')
+        entries = []
+        offset = 0
+        for obfuscated in sorted(names):
+            entry = b'%s\t%s\n' % (obfuscated, names[obfuscated])
+            offsets.append(offset)
+            entries.append(entry)
+            offset += len(entry)
+
+        for index_path in index_paths:
+            # Written to a file of this thread first: other pidcat processes, or the clients of a daemon, may build
+            # the same index at the same time
+            temporary = '%s.%d.%d.tmp' % (index_path, os.getpid(), threading.get_ident())
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+                with open(temporary, 'wb') as fw:
+                    fw.write(PROGUARD_INDEX.pack(PROGUARD_INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, len(offsets)))
+                    fw.write(offsets.tobytes())
+                    fw.writelines(entries)
+                os.replace(temporary, index_path)
+                return index_path
+            except OSError:
+                try:
+                    os.unlink(temporary)
+                except OSError:
+                    pass
+                continue
+        raise OSError('cannot write an index of %s to %s' % (path, ' or '.join(index_paths)))
+
+    def _find(self, name: bytes) -> Optional[bytes]:
+        mapped, offsets, entries = self._map, self._offsets, self._entries
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = entries + offsets[middle]
+            end = mapped.find(b'\t', start)
+            key = mapped[start:end]
+            if key < name:
+                low = middle + 1
+            elif key > name:
+                high = middle
+            else:
+                return mapped[end + 1:mapped.find(b'\n', end)]
+        return None
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
         try:
-            line = adb.stdout.readline()
-        except KeyboardInterrupt:
-            break
-        if len(line) == 0:
-            break
+            original = self._names[name]
+        except KeyError:
+            if len(self._names) >= PROGUARD_NAME_CACHE_SIZE:
+                self._names.clear()
+            found = self._find(name.encode('utf-8', 'replace'))
+            original = self._names[name] = None if found is None else found.decode('utf-8', 'replace')
+        return default if original is None else original
+
+
+def deobfuscate(mapping, message: str) -> str:
+    """
+    Replaces the obfuscated class name of a stack trace line (`at a.b.c(...)` or `Caused by: a.b: ...`).
+    """
+    frame = STACK_TRACE_LINE.match(message)
+    if frame is None:
+        return message
 
-        line = line.decode('utf-8', 'replace').strip()
-        if len(line) == 0:
-            continue
+    original = mapping.get(frame.group(2))
+    if original is None:
+        return message
+    return message[:frame.start(2)] + original + message[frame.end(2):]
+
+
+def probe_device_properties(base_adb_command: List[str], serial: Optional[str],
+                            cache: DeviceCache) -> tuple[str, str]:
+    """
+    Returns the SDK level and the model name of the device, from the cache if possible. Otherwise both properties are
+    read with a single `adb shell` round-trip.
+    """
+    if serial is None:
+        # Answered by the local adb server, this doesn't reach the device
+        serial = adb_output(base_adb_command + ['get-serialno']).decode('utf-8', 'replace').strip()
+        if serial in ('', 'unknown'):
+            serial = None
+
+    cached = cache.get(serial) if serial else None
+    if cached is not None:
+        return cached['sdk'], cached['model']
+
+    getprop_command = base_adb_command + ['shell', 'getprop ro.build.version.sdk; getprop ro.product.model']
+    properties = adb_output(getprop_command).decode('utf-8', 'replace').splitlines() + ['', '']
+    android_sdk, device_name = properties[0].strip(), properties[1].strip()
+    if serial and android_sdk:
+        cache.put(serial, {'sdk': android_sdk, 'model': device_name})
+
+    return android_sdk, device_name
+
+
+def wait_for_device(base_adb_command: List[str], stopped: threading.Event, delay: float = RECONNECT_DELAY) -> bool:
+    """
+    Waits until adb reports the device online again, asking it after delay seconds and then twice as long each time,
+    up to RECONNECT_MAX_DELAY. Returns False if stopped is set first.
+    """
+    while not stopped.wait(delay):
+        if adb_output(base_adb_command + ['get-state']).strip() == b'device':
+            return True
+        delay = min(delay * 2, RECONNECT_MAX_DELAY)
+    return False
+
+
+def timed(function, *args):
+    # Runs function and returns its result together with the time it took, for --debug
+    started = time.monotonic()
+    result = function(*args)
+    return result, time.monotonic() - started
+
+
+class PidTracker:
+    """
+    Re-reads the process table every interval seconds, for the process starts and deaths the ActivityManager messages
+    miss. Changes are queued in events and signalled on wakeup_fd.
+    """
+
+    def __init__(self, base_adb_command: List[str], is_tracked, pids: set[str], names: dict[str, str],
+                 interval: float, report: bool = False):
+        self.base_adb_command = base_adb_command
+        self.is_tracked = is_tracked
+        self.pids = pids
+        self.names = names
+        self.interval = interval
+        self.report = report
+        self.events: deque[Union[ProcessStart, ProcessDeath]] = deque()
+        self.refreshes = 0
+        self.last_cost = 0.0
+        self.wakeup_fd, self._wakeup_write_fd = os.pipe() if os.name != 'nt' else (None, None)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='pidcat-pids', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def refresh(self):
+        known = set(self.pids)
+        started = time.monotonic()
+        processes = read_process_table(self.base_adb_command)
+        self.last_cost = time.monotonic() - started
+        self.refreshes += 1
+        if not processes:
+            # The query failed, e.g. because the device went away
+            return
+
+        current = dict((pid, name) for pid, name in processes.items() if self.is_tracked(name))
+        # Pids tracked by the reading thread while the query ran are not in the snapshot and can't be mistaken for
+        # dead ones, and pids it already added are not started again
+        ended = (known - current.keys()) & self.pids
+        started_pids = current.keys() - self.pids
+
+        # The reading thread checks the set concurrently, so it is only ever updated in place
+        self.pids.difference_update(ended)
+        for pid in ended:
+            self.events.append(ProcessDeath(pid, self.names.pop(pid, 'unknown')))
+        for pid in started_pids:
+            track_pid(self.names, pid, current[pid], self.pids)
+            self.events.append(ProcessStart(current[pid], '-', pid, '-', '-'))
+
+        if self.events and self._wakeup_write_fd is not None:
+            os.write(self._wakeup_write_fd, b'!')
+        if self.report:
+            debug('pid refresh: %.0f ms, %d started, %d ended' % (self.last_cost * 1000, len(started_pids),
+                                                                  len(ended)))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+
+def literal_tag(pattern: Pattern) -> Optional[str]:
+    # Patterns from parse_regex_input are wrapped in ^$, only plain names translate exactly to a logcat filterspec
+    match = re.fullmatch(r'\^([\w-]+)\$', pattern.pattern)
+    return match.group(1) if match else None
+
+
+def device_filter_args(min_level: int, tags: Optional[List[Pattern]], track_processes: bool) -> List[str]:
+    """
+    The logcat arguments for the filters that logcat on the device can apply exactly, pidcat still applies them all.
+    Never --pid, which would drop the ActivityManager and DEBUG lines of other processes.
+    """
+    level = LOG_LEVELS[min_level]
+    specs = {}
+    literal_tags = [literal_tag(tag) for tag in tags or []]
+    if literal_tags and all(literal_tags):
+        for tag in literal_tags:
+            specs[tag] = level
+        default_level = 'S'
+    else:
+        default_level = level
 
-        bug_line = BUG_LINE.match(line)
-        if bug_line is not None:
-            continue
+    if not specs and default_level == 'V':
+        return []
 
-        log_line = LOG_LINE.match(line)
-        if log_line is None:
-            continue
+    if track_processes:
+        # Process tracking needs these whatever their level
+        for tag in ('ActivityManager', 'dalvikvm', 'DEBUG'):
+            specs[tag] = 'V'
 
-        time, level, tag, owner, message = log_line.groups()
-        tag = tag.strip()
-        tag = proguard_mapping.get(tag, tag)
-        start = parse_start_process(line)
+    return ['%s:%s' % (tag, tag_level) for tag, tag_level in specs.items()] + ['*:%s' % default_level]
 
-        if start:
-            line_package, target, line_pid, line_uid, line_gids = start
-            if match_packages(package, named_processes, catchall_package, line_package):
-                pids.add(line_pid)
 
-                app_pid = line_pid
+# This is a ducktype of the subprocess.Popen object
+class FakeStdInProcess:
+    def __init__(self):
+        self.stdout = sys.stdin.buffer
 
-                color, line_buffer = indent_tag(args.tag_width, "Process started", True, force_color=GREEN)
-                level = colorize(" # ", fg=BLACK, bg=GREEN)
+    def poll(self):
+        return None
 
-                line_buffer += level + " "
-                line_buffer = prepend_time(line_buffer, time, args.add_timestamp)
-                line_foreground = color if args.colorized else WHITE
 
-                message_1 = f"Process {line_package.strip()} created for {target.strip()}"
-                message_2 = f"PID: {line_pid}\tUID: {line_uid}\tGIDs: {line_gids}"
+def indent_tag(tag_width: int, tag: str, create_tag: bool, force_color: Optional[int] = None) -> tuple[Optional[int], str]:
+    if tag_width > 0:
+        # right-align tag title and allocate color if needed
+        if create_tag:
+            color = force_color if force_color else allocate_color(tag)
+            tag = rjust_columns(tag, tag_width)
+            return color, colorize(tag, fg=color) + " "
+        else:
+            return None, " " * (tag_width + 1)
 
-                if print_counter > 0:
-                    print_line("\n")
+    return None, ""
 
-                print_line(colorize((header_size - 4) * " ", bg=GREEN) + level)
-                print_line(line_buffer + indent_wrap(width, header_size, colorize(message_1, fg=line_foreground)))
-                print_line(line_buffer + indent_wrap(width, header_size, colorize(message_2, fg=line_foreground)))
-                print_counter += 3
 
-                # line_buffer += '\nPID: %s   UID: %s   GIDs: %s' % (line_pid, line_uid, line_gids)
-                # line_buffer += '\n'
+def create_tag_level(level: str) -> str:
+    if level in TAG_TYPES:
+        return TAG_TYPES[level]
 
-                last_tag = None  # Ensure next log gets a tag printed
+    return level
 
-        dead = parse_death(package, named_processes, catchall_package, pids, tag, message)
-        if dead:
-            dead_pid, dead_pname = dead
-            pids.remove(dead_pid)
 
-            color, line_buffer = indent_tag(args.tag_width, "Process ended", True, force_color=RED)
-            level = colorize(" ~ ", fg=BLACK, bg=RED)
+def prepend_time(line_buffer: str, time: str, add_timestamp: bool) -> str:
+    if add_timestamp:
+        return f"{time} {line_buffer}"
 
-            line_buffer += level + " "
-            line_buffer = prepend_time(line_buffer, time, args.add_timestamp)
-            line_foreground = color if args.colorized else WHITE
+    return line_buffer
 
-            message = f"Process {dead_pname} (PID: {dead_pid}) ended"
 
-            if print_counter > 0:
-                print_line("\n")
+class Renderer:
+    """
+    Formats records for the terminal and prints them, process events as banners. Everything in front of the message but
+    the time is built once per device, tag, color and level.
+    """
+
+    HEADER_CACHE_SIZE = 4096
+
+    def __init__(self, args, width: int, device_width: int = 0, devices: List[str] = (),
+                 output: Optional[OutputWriter] = None, highlighter: Optional[Highlighter] = None):
+        # The lines go to OUTPUT and are highlighted by RULES, as set up by main(), unless given others
+        self.output = output or OUTPUT
+        self.highlighter = highlighter or RULES
+        self.tag_width = args.tag_width
+        self.always_tags = args.always_tags
+        self.colorized = args.colorized
+        self.add_timestamp = args.add_timestamp
+        self.width = width
+        self.device_width = device_width
+
+        self.header_size = args.tag_width + 1 + 3 + 1  # space, level, space
+        if args.add_timestamp:
+            self.header_size += 12 + 1  # time, space
+        if device_width:
+            self.header_size += device_width + 1  # device, space
+
+        # Devices keep their color for the whole session, unlike tags
+        self.device_colors = dict((device, DEVICE_COLORS[i % len(DEVICE_COLORS)]) for i, device in enumerate(devices))
+
+        self.headers: dict[tuple, str] = {}
+
+        self.last_tag = None
+        self.last_color = None
+        self.print_counter = 0
+
+    def device_header(self, device: str) -> str:
+        if not self.device_width:
+            return ''
+        return colorize(rjust_columns(device, self.device_width), fg=self.device_colors.get(device)) + ' '
+
+    def prepend_header(self, line_buffer: str, record: LogRecord) -> str:
+        return prepend_time(self.device_header(record.device) + line_buffer, record.time, self.add_timestamp)
+
+    def header(self, key: tuple) -> str:
+        device, tag, color, level = key
+        if self.tag_width > 0 and tag is None:
+            tag_header = ' ' * (self.tag_width + 1)
+        elif self.tag_width > 0:
+            tag_header = colorize(rjust_columns(tag, self.tag_width), fg=color) + ' '
+        else:
+            tag_header = ''
+
+        if len(self.headers) >= self.HEADER_CACHE_SIZE:
+            self.headers.clear()
+        header = self.headers[key] = self.device_header(device) + tag_header + create_tag_level(level) + ' '
+        return header
+
+    def render(self, record: LogRecord):
+        if record.event is not None:
+            if isinstance(record.event, ProcessStart):
+                self.print_process_started(record)
+            elif isinstance(record.event, ProcessDeath):
+                self.print_process_ended(record)
+            elif isinstance(record.event, CrashRepeated):
+                self.print_crash_repeated(record)
+            else:
+                self.print_lines_skipped(record)
+            return
+
+        tag, message = record.tag, record.message
+        # Lines of another device always repeat the tag
+        if (record.device, tag) != self.last_tag or self.always_tags:
+            color = allocate_color(tag) if self.tag_width > 0 else None
+            self.last_tag = (record.device, tag)
+            self.last_color = color
+            key = (record.device, tag, color, record.level)
+        else:
+            color = self.last_color
+            key = (record.device, None, None, record.level)
 
-            print_line(colorize((header_size - 4) * " ", bg=RED) + level)
-            print_line(line_buffer + indent_wrap(width, header_size, colorize(message, fg=line_foreground)))
-            print_counter += 2
+        line_buffer = self.headers.get(key) or self.header(key)
+        if self.add_timestamp:
+            line_buffer = f"{record.time} {line_buffer}"
 
-            last_tag = None  # Ensure next log gets a tag printed
+        # format tag message using rules
+        message = self.highlighter.apply(message)
+
+        line_foreground = color if self.colorized else WHITE
+        # Escape sequences take no room, wrapping before colorizing gives the same lines
+        message = indent_wrap(self.width, self.header_size, message)
+        self.output.write(line_buffer + colorize(message, fg=line_foreground))
+        self.print_counter += 1
+
+    def print_process_started(self, record: LogRecord):
+        line_package, target, line_pid, line_uid, line_gids = record.event
+        color, line_buffer = indent_tag(self.tag_width, "Process started", True, force_color=GREEN)
+        level = colorize(" # ", fg=BLACK, bg=GREEN)
+
+        line_buffer += level + " "
+        line_buffer = self.prepend_header(line_buffer, record)
+        line_foreground = color if self.colorized else WHITE
+
+        message_1 = f"Process {line_package.strip()} created for {target.strip()}"
+        message_2 = f"PID: {line_pid}\tUID: {line_uid}\tGIDs: {line_gids}"
+
+        banner = ["\n"] if self.print_counter > 0 else []
+        banner.append(colorize((self.header_size - 4) * " ", bg=GREEN) + level)
+        banner.append(line_buffer + indent_wrap(self.width, self.header_size, colorize(message_1, fg=line_foreground)))
+        banner.append(line_buffer + indent_wrap(self.width, self.header_size, colorize(message_2, fg=line_foreground)))
+        self.output.write_block(banner)
+        self.print_counter += 3
+
+        self.last_tag = None  # Ensure next log gets a tag printed
+
+    def print_process_ended(self, record: LogRecord):
+        dead_pid, dead_pname = record.event
+        color, line_buffer = indent_tag(self.tag_width, "Process ended", True, force_color=RED)
+        level = colorize(" ~ ", fg=BLACK, bg=RED)
+
+        line_buffer += level + " "
+        line_buffer = self.prepend_header(line_buffer, record)
+        line_foreground = color if self.colorized else WHITE
+
+        message = f"Process {dead_pname} (PID: {dead_pid}) ended"
+
+        banner = ["\n"] if self.print_counter > 0 else []
+        banner.append(colorize((self.header_size - 4) * " ", bg=RED) + level)
+        banner.append(line_buffer + indent_wrap(self.width, self.header_size, colorize(message, fg=line_foreground)))
+        self.output.write_block(banner)
+        self.print_counter += 2
+
+        self.last_tag = None  # Ensure next log gets a tag printed
+
+    def print_lines_skipped(self, record: LogRecord):
+        color, line_buffer = indent_tag(self.tag_width, "pidcat", True, force_color=YELLOW)
+        level = colorize(" ! ", fg=BLACK, bg=YELLOW)
+
+        line_buffer += level + " "
+        line_buffer = self.prepend_header(line_buffer, record)
+        line_foreground = color if self.colorized else WHITE
+
+        message = colorize(f"{record.event.count} lines skipped", fg=line_foreground)
+        self.output.write(line_buffer + indent_wrap(self.width, self.header_size, message))
+        self.print_counter += 1
+
+        self.last_tag = None  # Ensure next log gets a tag printed
+
+    def print_crash_repeated(self, record: LogRecord):
+        summary, count, pid = record.event
+        color, line_buffer = indent_tag(self.tag_width, record.tag, True)
+        line_buffer += create_tag_level(record.level) + " "
+        line_buffer = self.prepend_header(line_buffer, record)
+        line_foreground = color if self.colorized else WHITE
+
+        message = colorize(f"{summary} seen again {count}× (pid {pid})", fg=line_foreground)
+        self.output.write(line_buffer + indent_wrap(self.width, self.header_size, message))
+        self.print_counter += 1
+
+        self.last_tag = None  # Ensure next log gets a tag printed
+
+
+def csv_field(value: str) -> str:
+    if '"' in value or ',' in value or '\n' in value or '\r' in value:
+        return '"%s"' % value.replace('"', '""')
+    return value
+
+
+class RecordFormatter:
+    """
+    Writes the fields of records as json, csv or raw lines, formatted by hand. Events are records with an event field,
+    left out by raw; in CSV their columns are empty on log lines and the other way round.
+    """
+
+    CSV_FIELDS = ('date', 'time', 'device', 'level', 'tag', 'pid', 'package', 'message', 'event', 'target', 'uid',
+                  'gids', 'count')
+
+    def __init__(self, output_format: str, output: Optional[OutputWriter] = None):
+        self.output = output or OUTPUT
+        self.format = output_format
+        self.render = getattr(self, 'render_' + output_format)
+        self.encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+        if output_format == 'csv':
+            self.output.write(','.join(self.CSV_FIELDS))
+
+    @staticmethod
+    def event_fields(record: LogRecord) -> dict:
+        event = record.event
+        if isinstance(event, ProcessStart):
+            return {'event': 'start', 'pid': event.pid, 'package': event.package, 'target': event.target,
+                    'uid': event.uid, 'gids': event.gids}
+        if isinstance(event, ProcessDeath):
+            return {'event': 'end', 'pid': event.pid, 'package': event.package}
+        return {'event': 'skipped', 'count': event.count}
+
+    def render_json(self, record: LogRecord):
+        if record.event is not None:
+            fields = {'date': record.date, 'time': record.time}
+            fields.update(self.event_fields(record))
+            if record.device:
+                fields['device'] = record.device
+            self.output.write(self.encode(fields))
+            return
+
+        quote = json.encoder.encode_basestring
+        line = '{"date":"%s","time":"%s","level":"%s","tag":%s,"pid":"%s","package":%s,"message":%s' % (
+            record.date, record.time, record.level, quote(record.tag), record.pid, quote(record.package),
+            quote(record.message))
+        self.output.write(line + (',"device":%s}' % quote(record.device) if record.device else '}'))
+
+    def render_csv(self, record: LogRecord):
+        if record.event is not None:
+            fields = self.event_fields(record)
+            fields.update(date=record.date, time=record.time, device=record.device)
+            self.output.write(','.join(csv_field(str(fields.get(name, ''))) for name in self.CSV_FIELDS))
+            return
+
+        self.output.write('%s,%s,%s,%s,%s,%s,%s,%s,,,,,' % (
+            record.date, record.time, csv_field(record.device), record.level, csv_field(record.tag), record.pid,
+            csv_field(record.package), csv_field(record.message)))
+
+    def render_raw(self, record: LogRecord):
+        if record.event is None:
+            self.output.write('%s %s %s/%s(%5s): %s' % (record.date, record.time, record.level, record.tag, record.pid,
+                                                 record.message))
+
+
+class DeviceSession:
+    """
+    Everything pidcat keeps per device: adb commands, tracked pids, PidTracker, filters and log source. Iterating over
+    it yields the records to display.
+    """
+
+    def __init__(self, args, base_adb_command: List[str], serial: Optional[str] = None, device: str = '',
+                 proguard_mapping: Optional[Union[dict[str, str], ProguardMapping]] = None, source=None):
+        self.args = args
+        self.source = source
+        self.base_adb_command = base_adb_command
+        self.serial = serial
+        self.device = device
+        self.proguard_mapping = proguard_mapping or {}
+        self.env_ignored_tags = ENV_IGNORED_TAGS
+        self.stats: Optional[PipelineStats] = None
+        self.min_level = LOG_LEVELS_MAP[args.min_level.upper()]
+
+        self.logcat_command = base_adb_command + ['logcat', '-v', 'time']
+        self.binary_command = base_adb_command + ['logcat', '-B']
+        if args.alternate_buffer:
+            for buffer in args.alternate_buffer:
+                self.logcat_command.extend(['-b', buffer])
+                self.binary_command.extend(['-b', buffer])
+
+        self.all = args.all
+        self.package: List[str] = []
+        self.catchall_package: set[str] = set()
+        self.named_processes: set[str] = set()
+        self.set_packages(list(args.package))
+
+        self.android_sdk = ''
+        self.device_name = ''
+        self.pids: set[str] = set()
+        self.process_names: dict[str, str] = {}
+        self.app_pid: Optional[str] = None
+        self.pid_tracker: Optional[PidTracker] = None
+        self.logcat: Optional[LogcatProcess] = None
+        self.reader = None
+        self.recorder: Optional[LogRecorder] = None
+        self.filters: Optional[FilterEngine] = None
+        self.closed = threading.Event()
+        self.reconnect_delay = RECONNECT_DELAY
+        self.reconnected_at: Optional[float] = None
+
+    def set_packages(self, package: List[str]):
+        self.package = package
+        if len(package) == 0:
+            self.all = True
+
+        # Store the names of packages for which to match all processes.
+        self.catchall_package = set(filter(lambda pkg: pkg.find(":") == -1, package))
+
+        # Store the name of processes to match exactly.
+        named_processes = set(filter(lambda pkg: pkg.find(":") != -1, package))
+
+        # Convert default process names from <package>: (cli notation) to <package> (android notation) in the exact
+        # names match group.
+        self.named_processes = set([pkg if pkg.find(":") != len(pkg) - 1 else pkg[:-1] for pkg in named_processes])
+
+    def is_tracked(self, process_name: str) -> bool:
+        return match_packages(self.package, self.named_processes, self.catchall_package, process_name)
+
+    def debug(self, message: str):
+        debug('%s: %s' % (self.device, message) if self.device else message)
+
+    def probe(self):
+        """
+        Reads the device properties, the process table and, with --current, the foreground app. Every probe is its
+        own adb round-trip, so they all run at once.
+        """
+        args = self.args
+        base_adb_command = self.base_adb_command
+        probes = ThreadPoolExecutor(max_workers=4)
+        serial = self.serial
+        if serial is None and not (args.use_device or args.use_emulator):
+            serial = os.getenv('ANDROID_SERIAL')
+        properties_probe = probes.submit(timed, probe_device_properties, base_adb_command, serial, DeviceCache())
+        ps_probe = probes.submit(timed, read_process_table, base_adb_command)
+        if args.current_app:
+            system_dump_command = base_adb_command + ["shell", "dumpsys", "activity", "activities"]
+            system_dump_probe = probes.submit(timed, adb_output, system_dump_command)
+        if args.clear_logcat:
+            # Clear log before starting logcat
+            clear_probe = probes.submit(timed, adb_call, self.logcat_command + ['-c'])
+
+        (self.android_sdk, self.device_name), elapsed = properties_probe.result()
+        if args.debug:
+            self.debug('startup: device properties after %.0f ms' % (elapsed * 1000))
+
+        if args.current_app:
+            system_dump, elapsed = system_dump_probe.result()
+            if args.debug:
+                self.debug('startup: dumpsys after %.0f ms' % (elapsed * 1000))
+            try:
+                if int(self.android_sdk) >= 30:
+                    running_package_name = re.search(".*Task.*A[= ][0-9]+:([^ ^}]*)", str(system_dump)).group(1)
+                else:
+                    running_package_name = re.search(".*TaskRecord.*A[= ]([^ ^}]*)", str(system_dump)).group(1)
+
+                self.set_packages(self.package + [running_package_name])
+                self.all = self.args.all
+            except:
+                pass
+
+        processes, elapsed = ps_probe.result()
+        self.process_names = dict((pid, name) for pid, name in processes.items() if self.is_tracked(name))
+        self.pids = set(self.process_names)
+        if args.debug:
+            self.debug('startup: process table after %.0f ms' % (elapsed * 1000))
+
+        if args.clear_logcat:
+            _, elapsed = clear_probe.result()
+            if args.debug:
+                self.debug('startup: log cleared after %.0f ms' % (elapsed * 1000))
+
+        probes.shutdown(wait=False)
+
+    def open(self, on_idle=None):
+        """
+        Starts reading the log: from the source stream given to the session, otherwise from `adb logcat` when stdout
+        is a terminal and from stdin when it isn't.
+        """
+        args = self.args
+        source = self.source
+        tap = None
+        if args.record:
+            tap = self.start_recording(self.base_adb_command if source is None and IS_TTY else [])
+
+        if source is None and IS_TTY:
+            if not self.all and args.pid_refresh > 0:
+                self.pid_tracker = PidTracker(self.base_adb_command, self.is_tracked, self.pids, self.process_names,
+                                              args.pid_refresh, report=args.debug)
+
+            filter_args = []
+            if args.device_filter and tap is not None:
+                self.debug('recording the whole log, not filtering on the device')
+            elif args.device_filter:
+                # Tags are matched after translating them, logcat only knows the obfuscated ones
+                tags = args.tag if not self.proguard_mapping else None
+                filter_args = device_filter_args(self.min_level, tags, not self.all)
+
+            binary_command = None
+            if args.binary and tap is not None:
+                self.debug('recording the log as text, not reading binary logs')
+            elif args.binary:
+                if BINARY_BUFFERS.intersection(args.alternate_buffer or []):
+                    self.debug('cannot read the %s buffer(s) in binary, reading text instead' % ', '.join(
+                        sorted(BINARY_BUFFERS.intersection(args.alternate_buffer))))
+                else:
+                    binary_command = self.binary_command
+
+            wakeup_fd = self.pid_tracker.wakeup_fd if self.pid_tracker is not None else None
+            self.logcat = LogcatProcess(self.logcat_command, filter_args, on_idle=on_idle, wakeup_fd=wakeup_fd,
+                                        binary_command=binary_command,
+                                        reconnect=self.reconnect if args.reconnect else None, tap=tap)
+            self.reader = self.logcat
+            if self.pid_tracker is not None:
+                self.pid_tracker.start()
+        else:
+            if source is None:
+                source = FakeStdInProcess().stdout
+            self.reader = LineReader(source, on_idle=on_idle, tap=tap)
+
+        self.create_filters()
+
+    def start_recording(self, base_adb_command: List[str]):
+        """
+        Starts recording into --record, in a subdirectory named after the device when following several. Returns
+        the tap for the log source. base_adb_command is used to read the process names, if there is a device.
+        """
+        args = self.args
+        directory = os.path.join(args.record, self.device) if self.device else args.record
+        self.recorder = LogRecorder(directory, base_adb_command, args.record_max_size * 1024 * 1024)
+        return self.recorder.write
+
+    def create_filters(self):
+        args = self.args
+        self.filters = FilterEngine(self.pids, self.all, self.min_level, args.tag, args.ignored_tag, args.filter,
+                                    args.contains, args.exclude_contains,
+                                    env_ignored_tags=parse_regex_inputs(self.env_ignored_tags))
+        if self.stats is not None:
+            self.stats.filters.append(self.filters)
+
+    def close(self):
+        self.closed.set()
+        if self.pid_tracker is not None:
+            self.pid_tracker.stop()
+        if self.logcat is not None and self.logcat.poll() is None:
+            self.logcat.process.terminate()
+        if self.logcat is not None and self.filters is not None and self.filters.tags:
+            # Offered by --list-tags from now on, for this device and for completions not naming a device
+            cache = CompletionCache()
+            for key in {completion_key(self.args, 'tags', self.serial), completion_key(self.args, 'tags')}:
+                cache.merge(key, self.filters.tags)
+        if self.recorder is not None:
+            self.recorder.close()
+            if self.recorder.dropped:
+                self.debug('record: %d blocks dropped, the recording fell behind' % self.recorder.dropped)
+
+    def reconnect(self) -> bool:
+        """
+        Called when logcat ended: waits for the device to come back and re-reads its process table, since pids
+        changed if it rebooted. Reconnecting again within RECONNECT_MAX_DELAY seconds doubles the first wait.
+        """
+        now = time.monotonic()
+        if self.reconnected_at is not None and now - self.reconnected_at < RECONNECT_MAX_DELAY:
+            self.reconnect_delay = min(self.reconnect_delay * 2, RECONNECT_MAX_DELAY)
+        else:
+            self.reconnect_delay = RECONNECT_DELAY
+
+        self.debug('device disconnected, waiting for it')
+        if not wait_for_device(self.base_adb_command, self.closed, self.reconnect_delay):
+            return False
+        self.reconnected_at = time.monotonic()
+
+        if self.pid_tracker is not None:
+            # Yields the processes which ended or started meanwhile like any refresh
+            self.pid_tracker.refresh()
+        elif not self.all:
+            processes = read_process_table(self.base_adb_command)
+            current = dict((pid, name) for pid, name in processes.items() if self.is_tracked(name))
+            replace_pids(self.pids, current)
+            self.process_names.clear()
+            self.process_names.update(current)
+
+        since = self.logcat.resume.timestamp if self.logcat is not None else None
+        self.debug('device reconnected after %.1f s, resuming %s' % (
+            self.reconnected_at - now, 'at %s' % since if since else 'from the start of the log'))
+        return True
+
+    def _process_event(self, record: LogRecord) -> Optional[LogRecord]:
+        event = record.event
+        if isinstance(event, ProcessStart):
+            if not self.is_tracked(event.package):
+                # The pid was reused, so the tracked process having it is gone even though its death was missed
+                self.pids.discard(event.pid)
+                self.process_names.pop(event.pid, None)
+                return None
+
+            track_pid(self.process_names, event.pid, event.package, self.pids)
+            self.app_pid = event.pid
+        elif event.pid in self.pids and self.is_tracked(event.package):
+            self.pids.discard(event.pid)
+            self.process_names.pop(event.pid, None)
+        else:
+            return None
+
+        return LogRecord(record.date, record.time, '', '', event.pid, '', event, self.device)
+
+    def _tracker_event(self, event: Union[ProcessStart, ProcessDeath]) -> LogRecord:
+        # The PidTracker already updated the pids, and there is no log line to take the time from
+        if isinstance(event, ProcessStart):
+            self.app_pid = event.pid
+
+        now = datetime.now()
+        return LogRecord(now.strftime('%m-%d'), now.strftime('%H:%M:%S.%f')[:-3], '', '', event.pid, '', event,
+                         self.device)
+
+    def __iter__(self):
+        if getattr(self.reader, 'entries', False):
+            return self.entry_records(self.reader)
+        return self.records(self.reader)
+
+    def records(self, raw_lines):
+        filters = self.filters
+        pid_events = self.pid_tracker.events if self.pid_tracker is not None else deque()
+        match, parse, prefilter, shown = LOG_LINE_BYTES.match, parse_record, filters.prefilter, self._shown
+        if self.stats is not None:
+            raw_lines = self.stats.reading(raw_lines)
+            match = self.stats.timed('parse', match)
+            parse = self.stats.timed('parse', parse, 'parsed')
+            prefilter = self.stats.timed('filter', prefilter)
+            shown = self.stats.timed('filter', shown)
+
+        for raw_line in raw_lines:
+            while pid_events:
+                yield self._tracker_event(pid_events.popleft())
+
+            raw_line = raw_line.strip()
+            if len(raw_line) == 0:
+                continue
+
+            if BUG_LINE_BYTES in raw_line:
+                continue
+
+            raw_log_line = match(raw_line)
+            if raw_log_line is None:
+                continue
+
+            # Drop lines of other processes and levels before decoding anything
+            if not prefilter(raw_log_line):
+                continue
+
+            record = parse(raw_log_line)
+            if record.event is not None:
+                banner = self._process_event(record)
+                if banner is not None:
+                    yield banner
+
+            record = shown(record)
+            if record is not None:
+                yield record
+
+    def entry_records(self, entries):
+        """
+        records() for the LogEntry tuples of `logcat -B`.
+        """
+        filters = self.filters
+        pid_events = self.pid_tracker.events if self.pid_tracker is not None else deque()
+        prefilter, shown = filters.prefilter_entry, self._shown
+        if self.stats is not None:
+            # Entries are decoded while they are read
+            entries = self.stats.reading(entries)
+            prefilter = self.stats.timed('filter', prefilter)
+            shown = self.stats.timed('filter', shown)
+        # Consecutive entries mostly share the second, format it once
+        last_sec = None
+        date = clock = ''
+
+        for entry in entries:
+            while pid_events:
+                yield self._tracker_event(pid_events.popleft())
+
+            if entry is None or not prefilter(entry):
+                continue
+
+            log_date, log_time, level, owner, tag, message, sec, nsec, _ = entry
+            if log_date is None:
+                if sec != last_sec:
+                    last_sec = sec
+                    stamp = time.localtime(sec)
+                    date = time.strftime('%m-%d', stamp)
+                    clock = time.strftime('%H:%M:%S', stamp)
+                log_date = date
+                log_time = '%s.%03d' % (clock, nsec // 1000000)
+            tag = str(tag, 'utf-8', 'replace')
+            message = str(message, 'utf-8', 'replace')
+            # logcat prints every line of a message as a line of its own
+            for message in message.rstrip('\n').split('\n') if '\n' in message else (message,):
+                record = LogRecord(log_date, log_time, level, tag, owner, message, parse_event(tag, owner, message))
+                if record.event is not None:
+                    banner = self._process_event(record)
+                    if banner is not None:
+                        yield banner
+
+                record = shown(record)
+                if record is not None:
+                    yield record
+
+    def process_record(self, record: LogRecord) -> List[LogRecord]:
+        """
+        Runs an already parsed record through the process tracking and the filters of this session, returning what
+        to display. Records without a level carry an event noticed by a PidTracker rather than a log line.
+        """
+        shown = []
+        event = record.event
+        if event is not None:
+            # Starts from the ActivityManager are always shown, PidTracker may notice the same process again
+            if record.level or not (isinstance(event, ProcessStart) and event.pid in self.pids):
+                banner = self._process_event(record)
+                if banner is not None:
+                    shown.append(banner)
+        if record.level:
+            record = self._shown(record)
+            if record is not None:
+                shown.append(record)
+        return shown
+
+    def _shown(self, record: LogRecord) -> Optional[LogRecord]:
+        # Returns the record as displayed, or None if the filters reject it
+        owner, message = record.pid, record.message
+        tag = self.proguard_mapping.get(record.tag, record.tag)
+        if self.proguard_mapping:
+            message = deobfuscate(self.proguard_mapping, message)
 
         # Make sure the backtrace is printed after a native crash
         if tag == 'DEBUG':
             bt_line = BACKTRACE_LINE.match(message.lstrip())
             if bt_line is not None:
                 message = message.lstrip()
-                owner = app_pid
-
-        if not args.all and owner not in pids:
-            continue
-        if level in LOG_LEVELS_MAP and LOG_LEVELS_MAP[level] < min_level:
-            continue
-        if args.ignored_tag and check_match_any_pattern(tag, args.ignored_tag):
-            continue
-        if args.tag and not check_match_any_pattern(tag, args.tag):
-            continue
-        if args.filter and not check_match_any_pattern(message, args.filter):
-            continue
-        if len(compiled_env_ignore_tags) > 0 and check_match_any_pattern(tag, compiled_env_ignore_tags):
-            continue
-
-        create_tag = tag != last_tag or args.always_tags
-        color, line_buffer = indent_tag(args.tag_width, tag, create_tag)
-        if create_tag:
-            last_tag = tag
-            last_color = color
-        elif last_color is not None:
-            color = last_color
+                # Before any process start was seen it stays with the pid of the DEBUG line
+                owner = self.app_pid if self.app_pid is not None else record.pid
+
+        if not self.filters.accepts(owner, record.level, tag, message):
+            return None
+
+        return LogRecord(record.date, record.time, record.level, tag, owner, message, None, self.device,
+                         self.process_names.get(owner, ''))
+
+
+class ReorderBuffer:
+    """
+    Merges the records of several devices in timestamp order, holding each back at most latency seconds and no more
+    than max_size at once.
+    """
+
+    def __init__(self, latency: float = 0.1, max_size: int = 10000):
+        self.latency = latency
+        self.max_size = max_size
+        self._heap: List[tuple[str, int, float, LogRecord]] = []
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, record: LogRecord, now: float):
+        heapq.heappush(self._heap, (record.date + record.time, next(self._sequence), now, record))
+
+    def deadline(self) -> Optional[float]:
+        # Records below the first one may be due earlier, but none of them is held back longer than 2 * latency
+        return self._heap[0][2] + self.latency if self._heap else None
+
+    def pop_ready(self, now: float):
+        heap = self._heap
+        while heap and (heap[0][2] + self.latency <= now or len(heap) > self.max_size):
+            yield heapq.heappop(heap)[3]
+
+    def drain(self):
+        while self._heap:
+            yield heapq.heappop(self._heap)[3]
+
+
+class Repeated(NamedTuple):
+    record: LogRecord
+    count: int
+
+
+class CrashReport:
+    """
+    The lines of one crash so far, AndroidRuntime from FATAL EXCEPTION or DEBUG from the backtrace on. The exception
+    class or signal and the top frames make its signature.
+    """
+
+    def __init__(self, record: LogRecord):
+        self.native = record.tag == 'DEBUG'
+        self.key = (record.device, None if self.native else record.pid)
+        self.first = record
+        # DEBUG lines come from the crash dumper, only the backtrace is shown as lines of the crashed process
+        self.pid = record.pid
+        self.pids = {record.pid}
+        self.cause: Optional[str] = None
+        self.frames: List[str] = []
+        self.top_frame_seen = False
+        self.shown = True
+
+    def add(self, record: LogRecord):
+        message = record.message.strip()
+        self.pids.add(record.pid)
+        if not self.native:
+            if message.startswith('at '):
+                if len(self.frames) < CRASH_SIGNATURE_FRAMES:
+                    self.frames.append(message[3:])
+            elif self.cause is None and not message.startswith((JAVA_CRASH_START, 'Process: ')):
+                # The message of the exception differs from crash to crash, its class doesn't
+                self.cause = message.partition(':')[0]
+            return
+
+        frame = NATIVE_FRAME.match(message)
+        if frame is not None:
+            if not self.top_frame_seen:
+                self.top_frame_seen = True
+                self.pid = record.pid
+            if len(self.frames) < CRASH_SIGNATURE_FRAMES:
+                # Without the address, which moves with the load address of the library
+                self.frames.append(frame.group(2))
+        elif self.cause is None and NATIVE_SIGNAL.match(message):
+            self.cause = NATIVE_SIGNAL.match(message).group(1)
+        elif NATIVE_PID.match(message):
+            self.pid = NATIVE_PID.match(message).group(1)
+
+    @property
+    def complete(self) -> bool:
+        return len(self.frames) >= CRASH_SIGNATURE_FRAMES and (self.native or self.cause is not None)
+
+    def continued_by(self, record: LogRecord) -> bool:
+        if self.native:
+            return record.tag == 'DEBUG' and record.device == self.first.device
+        return record.tag == 'AndroidRuntime' and record.pid == self.first.pid and record.device == self.first.device
+
+    def ended_by(self, record: LogRecord) -> bool:
+        # The next line of the crashed process from another tag, including its death
+        if self.native:
+            return record.tag != 'DEBUG' and record.pid in self.pids and record.device == self.first.device
+        return record.tag != 'AndroidRuntime' and record.pid == self.first.pid and record.device == self.first.device
+
+    def signature(self) -> tuple:
+        return self.native, self.cause, tuple(self.frames)
+
+    def summary(self) -> str:
+        cause = self.cause or ('native crash' if self.native else 'crash')
+        if not self.frames:
+            return cause
+        return '%s %s %s' % (cause, 'in' if self.native else 'at', self.frames[0])
+
+
+class CrashSignature:
+    def __init__(self, summary: str):
+        self.summary = summary
+        self.count = 0
+        self.first = None
+        self.last = None
+        self.pids: deque[str] = deque(maxlen=5)
+
+    def add(self, record: LogRecord, pid: str):
+        self.count += 1
+        self.last = '%s %s' % (record.date, record.time)
+        self.first = self.first or self.last
+        if pid not in self.pids:
+            self.pids.append(pid)
+
+
+class CrashAggregator:
+    """
+    Shows the first crash of a signature in full and later ones as a CrashRepeated line, holding back at most
+    CRASH_HOLD_LINES lines until the signature is known. With dedup off crashes are only counted, for summary().
+    """
+
+    # Crash reports still going on after their signature was decided
+    RUNNING_SIZE = 64
+
+    def __init__(self, dedup: bool = True, max_signatures: int = CRASH_SIGNATURES_SIZE):
+        self.dedup = dedup
+        self.max_signatures = max_signatures
+        self.signatures: dict[tuple, CrashSignature] = {}
+        self.forgotten = 0
+        self.crashes = 0
+        # The report held back, and the records since its first line with whether they belong to it
+        self.report: Optional[CrashReport] = None
+        self.held: List[tuple[LogRecord, bool]] = []
+        self.held_since = 0.0
+        self.running: dict[tuple, CrashReport] = {}
+
+    def starts(self, record: LogRecord) -> bool:
+        if record.tag == 'AndroidRuntime':
+            return record.message.startswith(JAVA_CRASH_START)
+        if record.tag != 'DEBUG':
+            return False
+
+        message = record.message.lstrip()
+        if message.startswith(NATIVE_CRASH_START):
+            return True
+        if not message.startswith('#00 '):
+            return False
+        # The first frame starts a report unless it belongs to the one whose header came before it
+        report = self.report
+        if report is None or report.key != (record.device, None):
+            report = self.running.get((record.device, None))
+        return report is None or report.top_frame_seen
+
+    def process(self, record: LogRecord) -> List[LogRecord]:
+        """
+        Takes the next record and returns the ones to show now.
+        """
+        tag = record.tag
+        if self.report is None and not self.running and tag not in CRASH_TAGS:
+            return [record]
+
+        if self.running and tag not in CRASH_TAGS:
+            for key, report in list(self.running.items()):
+                if report.ended_by(record):
+                    del self.running[key]
+
+        shown = []
+        if self.report is not None:
+            if not self.report.ended_by(record) and not self.starts(record):
+                part = self.report.continued_by(record)
+                if part:
+                    self.report.add(record)
+                self.held.append((record, part))
+                if (part and self.report.complete) or len(self.held) >= CRASH_HOLD_LINES or \
+                        time.monotonic() - self.held_since >= CRASH_HOLD_DELAY:
+                    return self.resolve()
+                return shown
+            shown = self.resolve()
+
+        if tag not in CRASH_TAGS:
+            shown.append(record)
+        elif self.starts(record):
+            self.report = CrashReport(record)
+            self.running.pop(self.report.key, None)
+            self.report.add(record)
+            self.held = [(record, True)]
+            self.held_since = time.monotonic()
+        else:
+            report = self.running.get((record.device, None if tag == 'DEBUG' else record.pid))
+            if report is None or not report.continued_by(record) or report.shown:
+                shown.append(record)
+        return shown
+
+    def resolve(self) -> List[LogRecord]:
+        # Decides on the report held back and returns what to show of what was held
+        report, held = self.report, self.held
+        self.report, self.held = None, []
+        self.crashes += 1
+
+        signature = report.signature()
+        # Moved to the end, the signatures are in the order they were last seen
+        known = self.signatures.pop(signature, None)
+        if known is None:
+            known = CrashSignature(report.summary())
+            if len(self.signatures) >= self.max_signatures:
+                del self.signatures[next(iter(self.signatures))]
+                self.forgotten += 1
+        self.signatures[signature] = known
+        known.add(report.first, report.pid)
+
+        report.shown = known.count == 1 or not self.dedup
+        self.running[report.key] = report
+        if len(self.running) > self.RUNNING_SIZE:
+            del self.running[next(iter(self.running))]
+        if report.shown:
+            return [record for record, _ in held]
+
+        repeated = report.first._replace(message='', event=CrashRepeated(known.summary, known.count - 1, report.pid))
+        return [repeated] + [record for record, part in held if not part]
+
+    def flush(self) -> List[LogRecord]:
+        return self.resolve() if self.report is not None else []
+
+    def summary(self) -> List[str]:
+        lines = ['crashes: %d, %d different' % (self.crashes, len(self.signatures) + self.forgotten)]
+        for known in sorted(self.signatures.values(), key=lambda known: -known.count):
+            lines.append('%6d× %s (first %s, last %s, pid %s)' % (known.count, known.summary, known.first, known.last,
+                                                                  ', '.join(known.pids)))
+        if self.forgotten:
+            lines.append('%d signatures seen longest ago were forgotten' % self.forgotten)
+        return lines
+
+
+class RecordQueue:
+    """
+    Hands records from the reading thread to the printing one. When max_size records wait, 'block' waits,
+    'drop-oldest' drops lines and reports them with a LinesSkipped record, keeping process starts and ends, and
+    'coalesce' folds repeats.
+    """
+
+    POLICIES = ('block', 'drop-oldest', 'coalesce')
+
+    def __init__(self, max_size: int = 10000, policy: str = 'block'):
+        self.max_size = max(1, max_size)
+        self.policy = policy
+        self._items: deque = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        self._skipped = 0
+        self._events: List[LogRecord] = []
+
+        self.peak = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.blocked = 0.0
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, record: LogRecord):
+        with self._lock:
+            items = self._items
+            if self.policy == 'coalesce' and items and record.event is None:
+                last = items[-1]
+                count = 1
+                if type(last) is Repeated:
+                    last, count = last
+                if (last.message == record.message and last.tag == record.tag and last.event is None and
+                        last.level == record.level and last.pid == record.pid and last.device == record.device):
+                    items[-1] = Repeated(last, count + 1)
+                    self.coalesced += 1
+                    return
+
+            if len(items) >= self.max_size:
+                if self.policy == 'drop-oldest':
+                    # Process starts and ends are set aside instead, the display would lose track of the processes
+                    while items and items[0].event is not None:
+                        self._events.append(items.popleft())
+                    if len(items) >= self.max_size:
+                        items.popleft()
+                        self._skipped += 1
+                        self.dropped += 1
+                else:
+                    started = time.monotonic()
+                    while len(items) >= self.max_size and not self._closed:
+                        self._not_full.wait()
+                    self.blocked += time.monotonic() - started
+
+            items.append(record)
+            if len(items) > self.peak:
+                self.peak = len(items)
+            self._not_empty.notify()
+
+    def get(self, max_items: int = 256, timeout: Optional[float] = None) -> Optional[List[LogRecord]]:
+        """
+        Waits for records and returns up to max_items of them, or None once the queue was closed and is empty. With a
+        timeout, returns an empty list if no record came in for that many seconds.
+        """
+        with self._lock:
+            items = self._items
+            while not items and not self._events and not self._closed:
+                if not self._not_empty.wait(timeout):
+                    return []
+            if not items and not self._events:
+                if self._error is not None:
+                    raise self._error
+                return None
+
+            # The events set aside are older than any record left
+            batch = self._events
+            self._events = []
+            if self._skipped:
+                following = items[0] if items else batch[-1]
+                batch.append(LogRecord(following.date, following.time, None, None, None, '',
+                                       LinesSkipped(self._skipped), following.device))
+                self._skipped = 0
+            for _ in range(min(max_items, len(items))):
+                batch.append(items.popleft())
+            self._not_full.notify()
+
+        if self.policy == 'coalesce':
+            for i, record in enumerate(batch):
+                if type(record) is Repeated:
+                    record, count = record
+                    batch[i] = record._replace(message=f'{record.message} (repeated {count}×)')
+        return batch
+
+    def close(self, error: Optional[BaseException] = None):
+        with self._lock:
+            self._closed = True
+            self._error = error
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    def start_reader(self, read):
+        """
+        Runs read(put) on a thread of its own, closing the queue once it returns. An exception it raises is raised
+        again by get().
+        """
+        def run():
+            error = None
+            try:
+                read(self.put)
+            except Exception as e:
+                error = e
+            self.close(error)
+
+        threading.Thread(target=run, name='pidcat-reader', daemon=True).start()
+
+    def report(self) -> List[str]:
+        return ['queue: %d of %d records at most, %d dropped, %d coalesced, reading blocked for %.0f ms' % (
+            self.peak, self.max_size, self.dropped, self.coalesced, self.blocked * 1000)]
+
+
+# Windows only counts thread time in 15 ms ticks
+STAGE_CLOCK = time.thread_time if os.name != 'nt' else time.perf_counter
+
+
+class PipelineStats:
+    """
+    Counts and times the pipeline stages for --stats, by wrapping the functions it calls (timed(), reading()) and only
+    one call in SAMPLE. toggle_profile() starts and stops cProfile in every pipeline thread.
+    """
+
+    STAGES = ('read', 'parse', 'filter', 'render', 'write')
+    COUNTS = ('read', 'parsed', 'printed')
+    SAMPLE = 16
+
+    def __init__(self, profile_path: Optional[str] = None):
+        self.started = time.monotonic()
+        # Part of reading the clock itself ends up in each sample, it is taken off again
+        empty = []
+        for _ in range(1001):
+            started = STAGE_CLOCK()
+            empty.append(STAGE_CLOCK() - started)
+        self.clock_overhead = sorted(empty)[len(empty) // 2]
+        self._last_snapshot = (self.started, 0)
+        self.counts = dict.fromkeys(self.COUNTS, 0)
+        self.times = dict.fromkeys(self.STAGES, 0.0)
+        self.filters: List[FilterEngine] = []
+        self.queue: Optional[RecordQueue] = None
+        self.output: Optional[OutputWriter] = None
+        self.stream = None
+        self._finished = threading.Event()
+        self._stream_lock = threading.Lock()
+
+        self.lag_last = 0.0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.lag_count = 0
+        self._epochs: dict[tuple[str, str], float] = {}
+
+        self.profile_path = profile_path
+        self.profiling = False
+        self._profiles: List[cProfile.Profile] = []
+        self._stopped = 0
+        self._profile_lock = threading.Lock()
+        self._thread = threading.local()
+
+    def reading(self, lines):
+        counts, times, clock, sample, overhead = self.counts, self.times, STAGE_CLOCK, self.SAMPLE, self.clock_overhead
+        lines = iter(lines)
+        for read in itertools.count(1):
+            if read % sample:
+                try:
+                    line = next(lines)
+                except StopIteration:
+                    return
+            else:
+                started = clock()
+                try:
+                    line = next(lines)
+                except StopIteration:
+                    return
+                times['read'] += max(0.0, clock() - started - overhead) * sample
+
+            counts['read'] += 1
+            self.sync_profile()
+            yield line
+
+    def timed(self, stage: str, function, counted: Optional[str] = None):
+        times, counts, clock, sample, overhead = self.times, self.counts, STAGE_CLOCK, self.SAMPLE, self.clock_overhead
+        calls = 0
+
+        def timed_function(*args):
+            nonlocal calls
+            calls += 1
+            if counted is not None:
+                counts[counted] += 1
+            if calls % sample:
+                return function(*args)
+
+            started = clock()
+            result = function(*args)
+            times[stage] += max(0.0, clock() - started - overhead) * sample
+            return result
+
+        return timed_function
+
+    def printed(self, record: LogRecord):
+        counts = self.counts
+        counts['printed'] += 1
+        self.sync_profile()
+        if counts['printed'] % self.SAMPLE or record.event is not None or not record.time:
+            return
+
+        # Device times are local times without a year, as are the times of the computer running pidcat
+        key = (record.date, record.time[:8])
+        epoch = self._epochs.get(key)
+        if epoch is None:
+            try:
+                epoch = time.mktime(time.strptime('%d-%s %s' % (time.localtime().tm_year, record.date, key[1]),
+                                                  '%Y-%m-%d %H:%M:%S'))
+            except (ValueError, OverflowError):
+                return
+            if len(self._epochs) >= 4096:
+                self._epochs.clear()
+            self._epochs[key] = epoch
+
+        lag = time.time() - epoch - float(record.time[8:] or 0)
+        self.lag_last = lag
+        self.lag_total += lag
+        if lag > self.lag_max or not self.lag_count:
+            self.lag_max = lag
+        self.lag_count += 1
+
+    def dropped(self) -> dict[str, int]:
+        dropped = dict.fromkeys(FilterEngine.STAGES, 0)
+        for filters in self.filters:
+            for stage, count in filters.dropped.items():
+                dropped[stage] += count
+        return dropped
+
+    def stage_times(self) -> dict[str, float]:
+        times = dict(self.times)
+        if self.output is not None:
+            times['write'] = self.output.write_time
+        return times
+
+    def snapshot(self) -> str:
+        now = time.monotonic()
+        counts = self.counts
+        # The rate since the last snapshot
+        last_time, last_read = self._last_snapshot
+        self._last_snapshot = (now, counts['read'])
+        rate = (counts['read'] - last_read) / max(now - last_time, 1e-9)
+        parts = ['%.1fs' % (now - self.started), 'read %d (%.0f/s)' % (counts['read'], rate),
+                 'parsed %d' % counts['parsed'], 'printed %d' % counts['printed'],
+                 'dropped ' + ' '.join('%s %d' % item for item in self.dropped().items()),
+                 'time ' + ' '.join('%s %.2fs' % item for item in self.stage_times().items())]
+        if self.lag_count:
+            parts.append('lag %.0f ms (avg %.0f, max %.0f)' % (self.lag_last * 1000, self.lag_total / self.lag_count *
+                                                                1000, self.lag_max * 1000))
+        if self.queue is not None:
+            parts.append('queue %d (max %d, dropped %d, coalesced %d)' % (len(self.queue), self.queue.peak,
+                                                                         self.queue.dropped, self.queue.coalesced))
+        return 'stats: ' + ', '.join(parts)
+
+    def summary(self) -> List[str]:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        counts = self.counts
+        lines = ['stats: %.1f s, read %d lines (%.0f/s), parsed %d, printed %d' % (
+            elapsed, counts['read'], counts['read'] / elapsed, counts['parsed'], counts['printed'])]
+        lines.append('stats: dropped by ' + ', '.join('%s %d' % item for item in self.dropped().items()))
+        lines.append('stats: time in ' + ', '.join('%s %.3f s' % item for item in self.stage_times().items()))
+        if self.lag_count:
+            lines.append('stats: lag behind the device avg %.0f ms, max %.0f ms, last %.0f ms' % (
+                self.lag_total / self.lag_count * 1000, self.lag_max * 1000, self.lag_last * 1000))
+        if self.queue is not None:
+            lines.extend('stats: ' + line for line in self.queue.report())
+        return lines
+
+    def start(self, stream, interval: float):
+        self.stream = stream
+
+        def report():
+            while not self._finished.wait(interval):
+                with self._stream_lock:
+                    if not self._finished.is_set():
+                        stream.write(self.snapshot() + '\n')
+                        stream.flush()
+
+        threading.Thread(target=report, name='pidcat-stats', daemon=True).start()
+        # Also when pidcat exits on an error
+        atexit.register(self.finish)
+
+    def finish(self):
+        # Writes the summary and closes a --stats-file, once
+        with self._stream_lock:
+            if self.stream is None or self._finished.is_set():
+                return
+            self._finished.set()
+            self.stream.write(''.join(line + '\n' for line in self.summary()))
+            self.stream.flush()
+            if self.stream is not sys.stderr:
+                self.stream.close()
+
+    def toggle_profile(self, *_):
+        # A signal handler
+        self.profiling = not self.profiling
+        debug('profiling %s' % ('started' if self.profiling else 'stopped, writing %s' % self.profile_path))
+
+    def sync_profile(self):
+        # Called by every pipeline thread for each line, starts or stops its profile
+        if not self.profiling and not self._profiles:
+            return
+        profile = getattr(self._thread, 'profile', None)
+        if self.profiling == (profile is not None):
+            return
+
+        with self._profile_lock:
+            if profile is None:
+                self._thread.profile = profile = cProfile.Profile()
+                self._profiles.append(profile)
+                profile.enable()
+                return
+
+            profile.disable()
+            self._thread.profile = None
+            self._stopped += 1
+            if self._stopped == len(self._profiles):
+                self._write_profile()
+
+    def _write_profile(self):
+        profiles, self._profiles, self._stopped = self._profiles, [], 0
+        if profiles and self.profile_path:
+            combined = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                combined.add(profile)
+            combined.dump_stats(self.profile_path)
+
+    def close(self):
+        # Profiles still running are written as they are
+        with self._profile_lock:
+            self.profiling = False
+            self._write_profile()
+
+
+def list_devices() -> List[str]:
+    devices = adb_output(['adb', 'devices']).decode('utf-8', 'replace').splitlines()[1:]
+    return [line.split('\t')[0] for line in devices if line.strip().endswith('\tdevice')]
+
+
+def stream_sessions(sessions: List[DeviceSession], handle, latency: float = 0.1, batch_size: int = 256,
+                    batches_per_device: int = 64):
+    """
+    Reads every session on its own thread and passes their records to handle in timestamp order, in batches through a
+    queue of batches_per_device per device.
+    """
+    batches = queue.Queue(maxsize=batches_per_device * len(sessions))
+
+    def read(session: DeviceSession):
+        batch = []
+
+        def flush():
+            nonlocal batch
+            if batch:
+                batches.put(batch)
+                batch = []
 
-        line_buffer += create_tag_level(level) + " "
-        line_buffer = prepend_time(line_buffer, time, args.add_timestamp)
+        try:
+            session.open(on_idle=flush)
+            for record in session:
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    flush()
+            flush()
+        finally:
+            batches.put(None)
+
+    for session in sessions:
+        threading.Thread(target=read, args=(session,), name='pidcat-%s' % session.device, daemon=True).start()
+
+    reorder = ReorderBuffer(latency, max_size=batch_size * batches_per_device * len(sessions))
+    remaining = len(sessions)
+    while remaining:
+        deadline = reorder.deadline()
+        try:
+            batch = batches.get(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            batch = ()
 
-        # format tag message using rules
-        for matcher in RULES:
-            replace = RULES[matcher]
-            message = matcher.sub(replace, message)
+        if batch is None:
+            remaining -= 1
+        else:
+            now = time.monotonic()
+            for record in batch:
+                reorder.push(record, now)
+
+        for record in reorder.pop_ready(time.monotonic()):
+            handle(record)
+
+    for record in reorder.drain():
+        handle(record)
+
+
+def split_log_files(paths: List[str], chunk_size: int) -> List[tuple[str, int, int]]:
+    """
+    Cuts the files into (path, start, end) chunks of about chunk_size bytes, each ending right after a newline.
+    """
+    chunks = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                continue
+
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                start = 0
+                while start < size:
+                    end = data.find(b'\n', min(start + chunk_size, size) - 1)
+                    end = size if end == -1 else end + 1
+                    chunks.append((path, start, end))
+                    start = end
+    return chunks
+
+
+def read_log_chunk(chunk: tuple[str, int, int]) -> bytes:
+    path, start, end = chunk
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return data[start:end]
+
+
+# Lines which may carry a process start or death, found without splitting the chunk into lines
+LIFECYCLE_LINE_BYTES = re.compile(rb'^.*/(?:ActivityManager|dalvikvm) *\(.*$', re.MULTILINE)
+
+
+def scan_log_chunk(chunk: tuple[str, int, int]) -> List[LogRecord]:
+    """
+    The first pass over a log file: returns the records of a chunk which carry a process start or death.
+    """
+    records = []
+    for lifecycle_line in LIFECYCLE_LINE_BYTES.finditer(read_log_chunk(chunk)):
+        log_line = LOG_LINE_BYTES.match(lifecycle_line.group().strip())
+        if log_line is not None:
+            record = parse_record(log_line)
+            if record.event is not None:
+                records.append(record)
+    return records
+
+
+# The DeviceSession a worker process filters chunks with, see init_log_chunk_worker()
+CHUNK_SESSION: Optional['DeviceSession'] = None
+
+
+def init_log_chunk_worker(args, proguard_mapping: Union[dict[str, str], ProguardMapping]):
+    global CHUNK_SESSION
+    CHUNK_SESSION = DeviceSession(args, [], proguard_mapping=proguard_mapping)
+    CHUNK_SESSION.create_filters()
+
+
+def filter_log_chunk(task: tuple[tuple[str, int, int], set[str], dict[str, str], Optional[str]]) -> List[LogRecord]:
+    """
+    The second pass over a log file: parses and filters a chunk, starting from the tracked processes at its start.
+    """
+    chunk, pids, process_names, app_pid = task
+    session = CHUNK_SESSION
+    replace_pids(session.pids, pids)
+    session.process_names = dict(process_names)
+    session.app_pid = app_pid
+    return list(session.records(read_log_chunk(chunk).split(b'\n')))
+
+
+class LogFileProcessor:
+    """
+    Reads saved logs in chunks on worker processes, yielding the records in order. A first pass over the process
+    start and death lines gives the tracked processes at the start of every chunk.
+    """
+
+    def __init__(self, session: DeviceSession, paths: List[str], jobs: int, chunk_size: int = 4 * 1024 * 1024):
+        self.session = session
+        self.paths = paths
+        # Workers beyond the CPUs only add the cost of the pool, on a single CPU the serial path is faster
+        self.jobs = max(1, min(jobs, os.cpu_count() or 1))
+        self.chunk_size = chunk_size
+
+    def timeline(self, scanned) -> List[tuple[set[str], dict[str, str], Optional[str]]]:
+        """
+        Replays the process starts and deaths of every chunk in order and returns the tracked processes at the start
+        of each one.
+        """
+        session = self.session
+        states = []
+        for records in scanned:
+            states.append((set(session.pids), dict(session.process_names), session.app_pid))
+            for record in records:
+                session._process_event(record)
+        return states
+
+    def __iter__(self):
+        session = self.session
+        chunks = split_log_files(self.paths, self.chunk_size)
+        if self.jobs == 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                yield from session.records(read_log_chunk(chunk).split(b'\n'))
+            return
+
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=init_log_chunk_worker,
+                                 initargs=(session.args, session.proguard_mapping)) as pool:
+            if session.all:
+                states = [(set(), {}, None)] * len(chunks)
+            else:
+                states = self.timeline(pool.map(scan_log_chunk, chunks))
+
+            # Keep a few chunks per worker in flight, results are only held until it is their turn
+            pending = deque()
+            tasks = iter(zip(chunks, *zip(*states)))
+            for task in itertools.islice(tasks, 2 * self.jobs):
+                pending.append(pool.submit(filter_log_chunk, task))
+            while pending:
+                records = pending.popleft().result()
+                for task in itertools.islice(tasks, 1):
+                    pending.append(pool.submit(filter_log_chunk, task))
+                yield from records
+
+
+class LogStoreWriter:
+    """
+    Appends lines to a log store in zlib blocks of about block_size, oldest segments deleted past max_size.
+    NNNNNNNN.seg holds the blocks, NNNNNNNN.idx a line per block: first and last time, then a JSON summary.
+    """
+
+    def __init__(self, directory: str, max_size: float, read_processes=None, block_size: int = STORE_BLOCK_SIZE,
+                 segment_size: int = STORE_SEGMENT_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self.read_processes = read_processes
+        self.block_size = block_size
+        self.segment_size = segment_size
+        self.process_names: dict[str, str] = {}
+        self.names_read_at = None
+        self.resume = ResumePoint()
+        self.blocks = 0
+        self.written = 0
+        self.compressed = 0
+        self._segment = None
+        self._index = None
+        self._segment_written = 0
+        self._remainder = b''
+        self._lines: List[bytes] = []
+        self._size = 0
+        self._levels: set[bytes] = set()
+        self._tags: set[bytes] = set()
+        self._pids: set[bytes] = set()
+        self._events: set[str] = set()
+        self.refresh_names()
+
+    def _reset_block(self):
+        # add() holds on to these, they are only ever cleared in place
+        self._lines.clear()
+        self._size = 0
+        self._levels.clear()
+        self._tags.clear()
+        self._pids.clear()
+        self._events.clear()
+
+    def refresh_names(self):
+        if self.read_processes is None:
+            return
+
+        processes = self.read_processes()
+        self.names_read_at = time.monotonic()
+        for pid, name in processes.items():
+            track_pid(self.process_names, pid, name)
+
+    def feed(self, chunk: bytes):
+        lines = (self._remainder + chunk).split(b'\n')
+        self._remainder = lines.pop()
+        self.add(lines)
+
+    def replay(self):
+        # A new logcat process replays lines up to the last one read, and after a reboot pids belong to new processes
+        self.gap()
+        self.flush()
+        self.resume.replaying = self.resume.timestamp is not None
+        self.refresh_names()
+
+    def gap(self):
+        # Blocks were lost, the partial line can't be completed anymore
+        self._remainder = b''
+
+    def add(self, lines: List[bytes]):
+        accept, match = self.resume.accept, LOG_LINE_BYTES.match
+        block, levels, tags, pids = self._lines, self._levels, self._tags, self._pids
+        block_size = self.block_size
+        size = self._size
+        for line in lines:
+            line = line.strip()
+            if not line or not accept(line):
+                continue
+
+            log_line = match(line)
+            if log_line is None:
+                continue
+
+            level, tag, pid = log_line.group(3, 4, 5)
+            tag = tag.strip()
+            if tag in LIFECYCLE_TAGS_BYTES:
+                self._track(tag, pid, log_line.group(6))
+            levels.add(level)
+            tags.add(tag)
+            pids.add(pid)
+            block.append(line)
+            size += len(line) + 1
+            if size >= block_size:
+                self._size = size
+                self.flush()
+                size = 0
+        self._size = size
+
+    def _track(self, tag: bytes, pid: bytes, message: bytes):
+        event = parse_event(tag.decode(), pid.decode(), message.decode('utf-8', 'replace'))
+        if event is None:
+            return
+
+        if isinstance(event, ProcessStart) or event.pid not in self.process_names:
+            # A process started before recording did is named by its death message
+            track_pid(self.process_names, event.pid, event.package)
+        # The block of a death has to track its pid for the banner, even when the process logged nothing else in it
+        self._pids.add(event.pid.encode())
+        self._events.add(event.package)
+
+    def _open_segment(self):
+        segments = LogStore.segments(self.directory)
+        number = int(os.path.basename(segments[-1])) + 1 if segments else 1
+        path = os.path.join(self.directory, '%08d' % number)
+        self._segment = open(path + '.seg', 'ab')
+        self._index = open(path + '.idx', 'a')
+        self._segment_written = 0
+
+    def _close_segment(self):
+        self._segment.close()
+        self._index.close()
+        self._segment = self._index = None
+        self.expire()
+
+    def expire(self):
+        # The segment being written is never deleted
+        segments = LogStore.segments(self.directory)
+        if self._segment is not None:
+            segments = segments[:-1]
+        sizes = [os.path.getsize(path + '.seg') + os.path.getsize(path + '.idx') for path in segments]
+        total = sum(sizes)
+        for path, size in zip(segments, sizes):
+            if total <= self.max_size:
+                break
+            for extension in ('.idx', '.seg'):
+                os.remove(path + extension)
+            total -= size
+
+    def flush(self):
+        if not self._lines:
+            return
+
+        names = self.process_names
+        pids = [pid.decode() for pid in self._pids]
+        if self.read_processes is not None and any(pid not in names for pid in pids) and \
+                time.monotonic() - self.names_read_at >= STORE_PROCESS_REFRESH:
+            self.refresh_names()
+
+        if self._segment is None:
+            self._open_segment()
+        # The fastest level still shrinks logs about five times, and the writer has to keep up with logcat dumping
+        # its whole buffer
+        data = zlib.compress(b'\n'.join(self._lines) + b'\n', 1)
+        # Lines of several buffers are interleaved a little out of order
+        keys = [line[:ResumePoint.TIMESTAMP_LENGTH] for line in self._lines]
+        entry = {
+            'offset': self._segment.tell(),
+            'length': len(data),
+            'lines': len(self._lines),
+            'levels': ''.join(level for level in LOG_LEVELS if level.encode() in self._levels),
+            'tags': sorted(tag.decode('utf-8', 'replace') for tag in self._tags),
+            'pids': dict((pid, names.get(pid, '')) for pid in sorted(pids)),
+            'events': sorted(self._events),
+        }
+        # The block is complete on disk before its index entry is, a --query running meanwhile never reads past it
+        self._segment.write(data)
+        self._segment.flush()
+        self._index.write('%s\t%s\t%s\n' % (min(keys).decode(), max(keys).decode(), json.dumps(entry)))
+        self._index.flush()
+
+        self.blocks += 1
+        self.written += self._size
+        self.compressed += len(data)
+        self._segment_written += self._size
+        self._reset_block()
+        if self._segment_written >= self.segment_size:
+            self._close_segment()
+
+    def close(self):
+        if self._remainder:
+            self.add([self._remainder])
+            self._remainder = b''
+        self.flush()
+        if self._segment is not None:
+            self._close_segment()
+
+
+def record_log(connection, directory: str, base_adb_command: List[str], max_size: float,
+               adb_server: Optional[tuple[str, int]] = None):
+    """
+    Runs in the process started by LogRecorder, writing what it receives to a LogStoreWriter. The current block is
+    written out when the log is quiet for STORE_FLUSH_DELAY seconds, so --query sees the latest lines.
+    """
+    global ADB_SERVER
+    # Ctrl-C reaches the whole process group, pidcat closes the connection once it is done reading
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if adb_server is not None:
+        ADB_SERVER = AdbServer(adb_server)
+    read_processes = functools.partial(read_process_table, base_adb_command) if base_adb_command else None
+    writer = LogStoreWriter(directory, max_size, read_processes)
+    try:
+        while True:
+            if not connection.poll(STORE_FLUSH_DELAY):
+                writer.flush()
+                continue
+
+            message = connection.recv_bytes()
+            kind = message[:1]
+            if kind == b'D':
+                writer.feed(message[1:])
+            elif kind == b'R':
+                writer.replay()
+            elif kind == b'G':
+                writer.gap()
+            else:
+                break
+    except EOFError:
+        pass
+    finally:
+        writer.close()
+
+
+class LogRecorder:
+    """
+    Runs a LogStoreWriter in a process of its own, fed by a thread. Blocks are dropped and counted when the writer is
+    more than max_pending blocks behind.
+    """
+
+    def __init__(self, directory: str, base_adb_command: List[str], max_size: float, max_pending: int = 1024):
+        # A forked writer would hold on to the sending end of its own pipe and that of others, and never see it closed
+        # when pidcat dies
+        context = multiprocessing.get_context('spawn')
+        receiver, self._sender = context.Pipe(duplex=False)
+        self.process = context.Process(target=record_log, name='pidcat-record', daemon=True,
+                                               args=(receiver, directory, base_adb_command, max_size,
+                                                     ADB_SERVER.address if ADB_SERVER is not None else None))
+        self.process.start()
+        receiver.close()
+        self.dropped = 0
+        self._gap = False
+        self._pending: queue.Queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._send_loop, name='pidcat-record', daemon=True)
+        self._thread.start()
+
+    def write(self, chunk: Optional[bytes]):
+        # None tells that logcat was restarted and replays lines
+        try:
+            if self._gap:
+                self._pending.put_nowait(b'G')
+                self._gap = False
+            self._pending.put_nowait(b'R' if chunk is None else (b'D', chunk))
+        except queue.Full:
+            self.dropped += 1
+            self._gap = True
+
+    def _send_loop(self):
+        send = self._sender.send_bytes
+        while True:
+            message = self._pending.get()
+            if message is None:
+                break
+            try:
+                send(message if isinstance(message, bytes) else message[0] + message[1])
+            except OSError:
+                break
+        # Processes forked meanwhile hold the pipe open as well, the writer can't wait for it to be closed
+        try:
+            send(b'E')
+        except OSError:
+            pass
+        self._sender.close()
+
+    def close(self):
+        self._pending.put(None)
+        self._thread.join()
+        self.process.join()
+
+
+class LogStore:
+    """
+    Reads what LogStoreWriter recorded. query() looks at the index entries first and only decompresses the blocks
+    which can have lines to show.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.blocks_read = 0
+        self.blocks_skipped = 0
+
+    @staticmethod
+    def segments(directory: str) -> List[str]:
+        # Paths of the segments without their extension, oldest first
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return []
+
+        return [os.path.join(directory, name[:-4]) for name in sorted(names)
+                if name.endswith('.seg') and name[:-4].isdigit() and len(name) == 12]
+
+    def blocks(self):
+        """
+        Yields the segment path, the times of the first and last line and the undecoded index entry of every block,
+        oldest first. Blocks outside of a time range are passed over without decoding their entry.
+        """
+        for path in self.segments(self.directory):
+            try:
+                with open(path + '.idx') as fr:
+                    for line in fr:
+                        fields = line.split('\t', 2)
+                        if len(fields) != 3 or not line.endswith('\n'):
+                            # Written half when recording was interrupted
+                            break
+                        yield path, fields[0], fields[1], fields[2]
+            except OSError:
+                # Expired meanwhile
+                continue
+
+    def read(self, segment, entry: dict) -> List[bytes]:
+        segment.seek(entry['offset'])
+        return zlib.decompress(segment.read(entry['length'])).split(b'\n')
+
+    def wanted(self, session: 'DeviceSession', entry: dict, levels: str) -> Optional[dict[str, str]]:
+        """
+        Returns the tracked pids of the block with their process names, None if no line of it can be shown.
+        """
+        pids = entry['pids']
+        if not session.all:
+            pids = dict((pid, name) for pid, name in pids.items() if session.is_tracked(name))
+            # Banners of the tracked packages are shown whatever the filters, native backtraces belong to the app
+            if not pids and 'DEBUG' not in entry['tags'] and not any(session.is_tracked(package)
+                                                                    for package in entry['events']):
+                return None
+        if any(session.is_tracked(package) for package in entry['events']):
+            return pids
+
+        if not any(level in levels for level in entry['levels']):
+            return None
+        mapping = session.proguard_mapping
+        if all(session.filters.tag_verdict(mapping.get(tag, tag)) for tag in entry['tags']):
+            return None
+        return pids
+
+    def query(self, session: 'DeviceSession', since: Optional[str] = None, until: Optional[str] = None):
+        """
+        Yields the records logged from since to before until, times without a date being on the day of the last line.
+        Only the blocks the index says can match are read.
+        """
+        blocks = list(self.blocks())
+        if not blocks:
+            return
+        day = max(last for _, _, last, _ in blocks)[:5]
+        if since is not None and len(since) < ResumePoint.TIMESTAMP_LENGTH:
+            since = '%s %s' % (day, since)
+        if until is not None and len(until) < ResumePoint.TIMESTAMP_LENGTH:
+            until = '%s %s' % (day, until)
+        low = since.encode() if since is not None else None
+        high = until.encode() if until is not None else None
+
+        levels = LOG_LEVELS[session.min_level:]
+        path = segment = None
+        try:
+            for block_path, first, last, entry in blocks:
+                pids = None
+                if (since is None or last >= since) and (until is None or first < until):
+                    entry = json.loads(entry)
+                    pids = self.wanted(session, entry, levels)
+                if pids is None:
+                    self.blocks_skipped += 1
+                    continue
+
+                if block_path != path:
+                    if segment is not None:
+                        segment.close()
+                    path = block_path
+                    segment = open(path + '.seg', 'rb')
+                lines = self.read(segment, entry)
+                self.blocks_read += 1
+
+                if low is not None and first < since or high is not None and last >= until:
+                    lines = [line for line in lines
+                             if (low is None or line[:ResumePoint.TIMESTAMP_LENGTH] >= low) and
+                             (high is None or line[:ResumePoint.TIMESTAMP_LENGTH] < high)]
+                if not session.all:
+                    replace_pids(session.pids, pids)
+                    session.process_names.clear()
+                    session.process_names.update(pids)
+                yield from session.records(lines)
+        finally:
+            if segment is not None:
+                segment.close()
+
+    def report(self) -> List[str]:
+        return ['query: read %d blocks, skipped %d' % (self.blocks_read, self.blocks_skipped)]
+
+
+def socket_path(serial: Optional[str] = None) -> str:
+    # Where a --serve daemon listens by default, one per device
+    return os.path.join(os.getenv('XDG_RUNTIME_DIR') or cache_dir(), 'pidcat-%s.sock' % (serial or 'default'))
+
+
+def encode_record(record: LogRecord) -> list:
+    event = record.event
+    if event is not None:
+        event = ['start' if isinstance(event, ProcessStart) else 'death'] + list(event)
+    return [record.date, record.time, record.level, record.tag, record.pid, record.message, event, record.package]
+
+
+def decode_record(item: list, device: str = '') -> LogRecord:
+    date, log_time, level, tag, pid, message, event = item[:7]
+    if event is not None:
+        event = ProcessStart(*event[1:]) if event[0] == 'start' else ProcessDeath(*event[1:])
+    # Daemons of earlier versions don't send the package
+    return LogRecord(date, log_time, level, tag, pid, message, event, device, item[7] if len(item) > 7 else '')
+
+
+# The options of a client the daemon filters with, and the ones holding regexes
+SUBSCRIPTION_OPTIONS = ('package', 'all', 'min_level', 'tag', 'ignored_tag', 'filter', 'contains', 'exclude_contains',
+                        'proguard_mapping')
+SUBSCRIPTION_PATTERNS = ('tag', 'ignored_tag', 'filter')
+
+
+def subscription(args) -> dict:
+    options = dict((name, getattr(args, name)) for name in SUBSCRIPTION_OPTIONS)
+    # The daemon has its own environment and working directory, send ours
+    options['env_ignored_tags'] = ENV_IGNORED_TAGS
+    if options['proguard_mapping']:
+        options['proguard_mapping'] = os.path.abspath(options['proguard_mapping'])
+    for name in SUBSCRIPTION_PATTERNS:
+        if options[name]:
+            options[name] = [(pattern.pattern, pattern.flags) for pattern in options[name]]
+    return options
+
+
+def subscription_args(options: dict):
+    args = parse_args([])
+    for name in SUBSCRIPTION_OPTIONS:
+        value = options.get(name)
+        if name in SUBSCRIPTION_PATTERNS and value:
+            value = [re.compile(pattern, flags) for pattern, flags in value]
+        if value is not None:
+            setattr(args, name, value)
+    return args
+
+
+class DaemonClient:
+    """
+    A viewer of a LogDaemon, with a DeviceSession of its own and a bounded queue. Records it can't take are dropped
+    for it alone and counted.
+    """
+
+    def __init__(self, connection: socket.socket, session: DeviceSession, queue_size: int):
+        self.connection = connection
+        self.session = session
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.sent = 0
+        self.closed = False
+
+    def offer(self, record: Optional[LogRecord]):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def finish(self):
+        # The end must get through even when the queue is full
+        while True:
+            try:
+                self.queue.put_nowait(None)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def send_loop(self, batch_size: int = 512):
+        reported = 0
+        try:
+            while True:
+                batch = [self.queue.get()]
+                while len(batch) < batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+
+                lines = []
+                if self.dropped != reported:
+                    reported = self.dropped
+                    lines.append(json.dumps({'dropped': reported}))
+                lines.extend(json.dumps(encode_record(record)) for record in batch if record is not None)
+                if lines:
+                    self.connection.sendall(('\n'.join(lines) + '\n').encode('utf-8'))
+                    self.sent += len(lines)
+                if batch[-1] is None:
+                    return
+        except OSError:
+            pass
+        finally:
+            self.closed = True
+            self.connection.close()
+
+
+class LogDaemon:
+    """
+    pidcat --serve: reads the log of a device once and sends every viewer on the Unix socket what its options keep.
+    A line of JSON per message: the options, then {"device": name}, records and {"dropped": count}.
+    """
+
+    def __init__(self, session: DeviceSession, path: str, queue_size: int = 10000, report: bool = False):
+        self.session = session
+        self.path = path
+        self.queue_size = queue_size
+        self.report = report
+        self.clients: List[DaemonClient] = []
+        self.records = 0
+        self._lock = threading.Lock()
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    def listen(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                probe.close()
+                raise OSError('a daemon is already serving on %s' % self.path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a daemon which didn't exit cleanly
+                os.unlink(self.path)
+        self.server.bind(self.path)
+        self.server.listen()
+        threading.Thread(target=self._accept_loop, name='pidcat-accept', daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._subscribe, args=(connection,), daemon=True).start()
+
+    def _subscribe(self, connection: socket.socket):
+        try:
+            connection.settimeout(10)
+            request = connection.makefile('rb').readline()
+            connection.settimeout(None)
+            options = json.loads(request)
+            args = subscription_args(options)
+            env_ignored_tags = [str(tag) for tag in options.get('env_ignored_tags') or []]
+            parse_regex_inputs(env_ignored_tags)
+            # The mapping of the client's app, else the daemon's
+            proguard_mapping = self.session.proguard_mapping
+            if args.proguard_mapping:
+                proguard_mapping = ProguardMapping.load(str(args.proguard_mapping))
+        except (OSError, ValueError, TypeError, re.error):
+            connection.close()
+            return
+
+        session = DeviceSession(args, [], device=self.session.device, proguard_mapping=proguard_mapping)
+        session.env_ignored_tags = env_ignored_tags
+        with self._lock:
+            session.process_names = dict((pid, name) for pid, name in self.session.process_names.items()
+                                         if session.is_tracked(name))
+            session.pids = set(session.process_names)
+            session.create_filters()
+            client = DaemonClient(connection, session, self.queue_size)
+            self.clients.append(client)
+
+        try:
+            # Records queue up meanwhile, the sending thread starts after the header
+            connection.sendall((json.dumps({'device': self.session.device_name}) + '\n').encode('utf-8'))
+        except OSError:
+            client.closed = True
+        threading.Thread(target=client.send_loop, name='pidcat-client', daemon=True).start()
+        if self.report:
+            debug('serve: client connected for %s' % (', '.join(args.package) or 'all packages'))
+
+    def publish(self, record: LogRecord):
+        with self._lock:
+            self.records += 1
+            for client in self.clients:
+                for shown in client.session.process_record(record):
+                    client.offer(shown)
+
+            if any(client.closed for client in self.clients):
+                self.clients = [client for client in self.clients if not client.closed]
+                if self.report:
+                    debug('serve: client disconnected, %d left' % len(self.clients))
+
+    def track(self, pid_tracker: PidTracker):
+        # Processes the tracker noticed, for every client to check against its packages
+        while pid_tracker.events:
+            event = pid_tracker.events.popleft()
+            if isinstance(event, ProcessStart):
+                track_pid(self.session.process_names, event.pid, event.package)
+            else:
+                self.session.process_names.pop(event.pid, None)
+            now = datetime.now()
+            self.publish(LogRecord(now.strftime('%m-%d'), now.strftime('%H:%M:%S.%f')[:-3], '', '', event.pid, '',
+                                   event))
+
+    def run(self, reader, pid_tracker: Optional[PidTracker] = None):
+        session = self.session
+        for raw_line in reader:
+            if pid_tracker is not None and pid_tracker.events:
+                self.track(pid_tracker)
+
+            raw_line = raw_line.strip()
+            if len(raw_line) == 0 or BUG_LINE_BYTES in raw_line:
+                continue
+
+            raw_log_line = LOG_LINE_BYTES.match(raw_line)
+            if raw_log_line is None:
+                continue
+
+            record = parse_record(raw_log_line)
+            event = record.event
+            if event is not None:
+                # Keep the process table current for clients subscribing later
+                if isinstance(event, ProcessStart):
+                    track_pid(session.process_names, event.pid, event.package)
+                else:
+                    session.process_names.pop(event.pid, None)
+            self.publish(record)
+
+        self.close()
+
+    def close(self):
+        self.server.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        with self._lock:
+            for client in self.clients:
+                client.finish()
+
+
+def serve(args, session: DeviceSession, path: str):
+    if not hasattr(socket, 'AF_UNIX'):
+        sys.exit('pidcat: --serve needs Unix domain sockets')
 
-        line_foreground = color if args.colorized else WHITE
-        line_buffer += indent_wrap(width, header_size, colorize(message, fg=line_foreground))
-        print_line(line_buffer)
-        print_counter += 1
+    session.probe()
+    daemon = LogDaemon(session, path, report=args.debug)
+    try:
+        daemon.listen()
+    except OSError as e:
+        sys.exit('pidcat: %s' % e)
+    debug('serving %s on %s' % (session.device_name or 'device', path))
+
+    pid_tracker = None
+    if args.pid_refresh > 0:
+        # Tracks every process, the clients pick the ones of their packages
+        pid_tracker = PidTracker(session.base_adb_command, lambda name: True, session.pids, session.process_names,
+                                 args.pid_refresh)
+        pid_tracker.start()
+        session.pid_tracker = pid_tracker
+    tap = session.start_recording(session.base_adb_command) if args.record else None
+    reader = LogcatProcess(session.logcat_command, [],
+                           wakeup_fd=pid_tracker.wakeup_fd if pid_tracker is not None else None,
+                           reconnect=session.reconnect if args.reconnect else None, tap=tap)
+    session.logcat = reader
+    try:
+        daemon.run(reader, pid_tracker)
+    except KeyboardInterrupt:
+        daemon.close()
+    session.close()
+
+
+class RemoteSession:
+    """
+    Stands in for a DeviceSession when reading from a --serve daemon: the daemon tracks the processes and filters,
+    the records it sends only need to be displayed.
+    """
+
+    def __init__(self, args, path: str):
+        self.args = args
+        self.path = path
+        self.device = ''
+        self.device_name = ''
+        self.filters = None
+        self.connection: Optional[socket.socket] = None
+        self.reader = None
+        self.dropped = 0
+
+    def debug(self, message: str):
+        debug(message)
+
+    def probe(self):
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.connection.connect(self.path)
+        except OSError as e:
+            sys.exit('pidcat: cannot connect to a pidcat --serve daemon on %s: %s' % (self.path, e))
+        self.connection.sendall((json.dumps(subscription(self.args)) + '\n').encode('utf-8'))
+
+    def open(self, on_idle=None):
+        self.reader = LineReader(self.connection, on_idle=on_idle)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+    def __iter__(self):
+        for line in self.reader:
+            if not line:
+                continue
+
+            item = json.loads(line)
+            if isinstance(item, list):
+                yield decode_record(item)
+            elif 'device' in item:
+                self.device_name = item['device']
+                if self.args.format == 'text':
+                    set_term_title(self.device_name)
+            elif 'dropped' in item:
+                debug('the daemon dropped %d lines, reading too slowly' % (item['dropped'] - self.dropped))
+                self.dropped = item['dropped']
+
+
+# The stages of pidcat, for use without a device (see benchmarks/): LineReader splits a pipe into lines,
+# log_records() parses them, tracks processes and filters them, and create_renderer() prints what is left.
+# parse_args() gives the options, e.g. parse_args(['com.example.app', '--min-level', 'I']).
+
+def log_records(lines, args, device: str = '') -> Iterator[LogRecord]:
+    """
+    Parses and filters lines (bytes, as logcat -v time prints them) like pidcat does for a device. Yields the records to
+    display, process starts and ends included.
+    """
+    session = DeviceSession(args, [], device=device)
+    session.create_filters()
+    return session.records(lines)
+
+
+def add_highlight_rules(args, highlighter: Highlighter):
+    # Only enable GC coloring if the user opted-in
+    if args.color_gc:
+        # GC_CONCURRENT freed 3617K, 29% free 20525K/28648K, paused 4ms+5ms, total 85ms
+        key = re.compile(
+            r'^(GC_(?:CONCURRENT|FOR_M?ALLOC|EXTERNAL_ALLOC|EXPLICIT) )(freed <?\d+.)(, \d+\% free \d+./\d+., )(paused \d+ms(?:\+\d+ms)?)')
+        val = r'\1%s\2%s\3%s\4%s' % (termcolor(GREEN), RESET, termcolor(YELLOW), RESET)
+
+        highlighter.add(key, val)
 
-    clear_term_title()
+    highlighter.rules.extend(args.highlight or [])
+
+
+def create_renderer(args, width: int = -1, devices: List[str] = ('',), output: Optional[OutputWriter] = None,
+                    highlighter: Optional[Highlighter] = None) -> Union[Renderer, RecordFormatter]:
+    # Prints records through its render() method as --format asks, devices are the ones of the records to print
+    if args.format == 'text':
+        return Renderer(args, width, max(len(device) for device in devices), devices, output, highlighter)
+    return RecordFormatter(args.format, output)
+
+
+def main():
+    global OUTPUT, ADB_SERVER
+    OUTPUT = OutputWriter(sys.stdout)
+    started = time.monotonic()
+
+    argv = ['%s%s' % (FROMFILE_PREFIX, conf) for conf in CONF_FILES if os.path.isfile(conf)]
+    argv.extend(sys.argv[1:])
+    args = parse_args(argv)
+    if args.adb_server is not None:
+        ADB_SERVER = AdbServer(args.adb_server)
+    if args.list:
+        return list_completions(args, argv)
+
+    stats = None
+    if args.stats or args.profile:
+        stats = PipelineStats(args.profile)
+        stats.output = OUTPUT
+        if args.profile:
+            if hasattr(signal, 'SIGUSR1'):
+                signal.signal(signal.SIGUSR1, stats.toggle_profile)
+            else:
+                # No signal to toggle it with, profile everything
+                stats.profiling = True
+
+    serials = args.device_serial or []
+    if args.all_devices:
+        serials = list_devices()
+
+    # Loaded before --serve, whose daemon translates the lines of the clients without a mapping of their own. The
+    # daemon translates the lines of a --connect client too, loading it here only checks it and builds its index
+    proguard_mapping = {}
+    if args.proguard_mapping:
+        mapping_started = time.monotonic()
+        proguard_mapping = ProguardMapping.load(args.proguard_mapping)
+        if args.debug:
+            debug('startup: proguard mapping of %d classes after %.0f ms (%s)' % (
+                len(proguard_mapping), (time.monotonic() - mapping_started) * 1000, proguard_mapping.index_path))
+
+    sessions = []
+    if args.serve:
+        base_adb_command = ['adb'] + (['-s', serials[0]] if serials else [])
+        session = DeviceSession(args, base_adb_command, serials[0] if serials else None,
+                                proguard_mapping=proguard_mapping)
+        # The daemon reads everything, the clients filter
+        session.set_packages([])
+        return serve(args, session, args.socket or socket_path(serials[0] if serials else None))
+    if args.connect:
+        sessions.append(RemoteSession(args, args.socket or socket_path(serials[0] if serials else None)))
+    elif args.input_files or args.query:
+        # Saved logs, there is no device to ask anything
+        sessions.append(DeviceSession(args, []))
+    elif len(serials) > 1 and IS_TTY:
+        for serial in serials:
+            sessions.append(DeviceSession(args, ['adb', '-s', serial], serial, device=serial))
+    elif len(serials) > 1:
+        # Not on a terminal the log comes from stdin, there is only one
+        sys.exit('pidcat: several devices (%s) can only be followed when the output is a terminal' %
+                 ', '.join(serials))
+    else:
+        base_adb_command = ['adb']
+        if serials:
+            base_adb_command.extend(['-s', serials[0]])
+        if args.use_device:
+            base_adb_command.append('-d')
+        if args.use_emulator:
+            base_adb_command.append('-e')
+        sessions.append(DeviceSession(args, base_adb_command, serials[0] if serials else None))
+
+    if len(sessions) > 1:
+        with ThreadPoolExecutor(max_workers=len(sessions)) as probes:
+            list(probes.map(DeviceSession.probe, sessions))
+    elif not args.input_files and not args.query:
+        sessions[0].probe()
+
+    for session in sessions:
+        session.proguard_mapping = proguard_mapping
+
+    if stats is not None:
+        for session in sessions:
+            session.stats = stats
+    if args.stats:
+        stats.start(open(args.stats_file, 'a') if args.stats_file else sys.stderr, args.stats_interval)
+
+    width = args.width
+    new_size = setup_terminal_width(width)
+    if new_size:
+        h, width = new_size
+
+    init_colorama(args.force_windows_colors)
+
+    add_highlight_rules(args, RULES)
+
+    # A daemon sends the device name once connected
+    text = args.format == 'text'
+    if text and not args.input_files and not args.query and not args.connect:
+        set_term_title(', '.join(session.device_name for session in sessions))
+
+    render = create_renderer(args, width, [session.device for session in sessions]).render
+    first_line = True
+    records = None
+    store = None
+    if stats is not None:
+        render = stats.timed('render', render)
+    crashes = None
+    if (text and not args.all_crashes) or args.crash_summary:
+        # Only the terminal gets repeated crashes folded, other programs get every line
+        crashes = CrashAggregator(dedup=text and not args.all_crashes)
+
+    def handle(record: LogRecord):
+        if crashes is None or (crashes.report is None and not crashes.running and record.tag not in CRASH_TAGS):
+            show(record)
+        else:
+            for shown in crashes.process(record):
+                show(shown)
+
+    def show(record: LogRecord):
+        nonlocal first_line
+        render(record)
+        if stats is not None:
+            stats.printed(record)
+        if first_line and record.event is None:
+            first_line = False
+            if args.debug:
+                debug('startup: first line after %.0f ms' % ((time.monotonic() - started) * 1000))
+
+    try:
+        if args.input_files:
+            sessions[0].create_filters()
+            for record in LogFileProcessor(sessions[0], args.input_files, args.jobs):
+                handle(record)
+                if OUTPUT.closed:
+                    break
+        elif args.query:
+            sessions[0].create_filters()
+            store = LogStore(args.query)
+            for record in store.query(sessions[0], args.since, args.until):
+                handle(record)
+                if OUTPUT.closed:
+                    break
+        else:
+            def read(put):
+                if len(sessions) > 1:
+                    stream_sessions(sessions, put, latency=args.merge_latency / 1000.0)
+                else:
+                    sessions[0].open(on_idle=OUTPUT.flush)
+                    for record in sessions[0]:
+                        put(record)
+
+            # Read on a thread of its own so that a slow terminal doesn't stall adb
+            records = RecordQueue(args.queue_size, args.overflow)
+            if stats is not None:
+                stats.queue = records
+            records.start_reader(read)
+            while True:
+                batch = records.get(timeout=CRASH_HOLD_DELAY if crashes is not None and crashes.report else None)
+                if batch is None or OUTPUT.closed:
+                    break
+                if not batch:
+                    # The log went quiet while a crash report was held back
+                    for record in crashes.flush():
+                        show(record)
+                for record in batch:
+                    handle(record)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if records is not None:
+            records.close()
+
+    if crashes is not None:
+        for record in crashes.flush():
+            show(record)
+
+    for session in sessions:
+        session.close()
+    if ADB_SERVER is not None:
+        ADB_SERVER.close()
+
+    if text:
+        clear_term_title()
+    OUTPUT.flush()
+    if args.crash_summary:
+        sys.stderr.write(''.join(line + '\n' for line in crashes.summary()))
+
+    if args.debug:
+        for session in sessions:
+            if session.filters is not None:
+                for line in session.filters.report():
+                    session.debug(line)
+        if records is not None:
+            for line in records.report():
+                debug(line)
+        if store is not None:
+            for line in store.report():
+                debug(line)
+        if ADB_SERVER is not None:
+            for line in ADB_SERVER.report():
+                debug(line)
+
+    if stats is not None:
+        stats.finish()
+        stats.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+"""
+--adb-server: the client of the adb server socket, against the fake adb server of benchmarks/fake_adb_server.py.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+import pidcat  # noqa: E402
+from fake_adb_server import SERIAL, FakeAdbServer, FakeDevice  # noqa: E402
+
+LOG = [
+    b'10-18 10:00:00.000 I/ActivityManager(  500): Start proc 1234:com.example.app/u0a42 for activity '
+    b'com.example.app/.Main',
+    b'10-18 10:00:00.100 W/MyApp( 1234): hello',
+]
+
+
+class AdbServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.log = tempfile.NamedTemporaryFile(suffix='.log')
+        cls.log.write(b'\n'.join(LOG) + b'\n')
+        cls.log.flush()
+        cls.device = FakeDevice(cls.log.name, processes={'1234': 'com.example.app'})
+        cls.serial = os.environ.pop('ANDROID_SERIAL', None)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.device.close()
+        cls.log.close()
+        if cls.serial is not None:
+            os.environ['ANDROID_SERIAL'] = cls.serial
+
+    def serve(self, services=('exec', 'shell')) -> pidcat.AdbServer:
+        server = FakeAdbServer(self.device, services=services)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = pidcat.AdbServer(('127.0.0.1', server.port))
+
+        def stop():
+            client.close()
+            server.shutdown()
+            server.server_close()
+        self.addCleanup(stop)
+        self.server = server
+        return client
+
+    def test_output(self):
+        client = self.serve()
+        self.assertEqual(client.output(['adb', 'get-serialno']), SERIAL.encode() + b'\n')
+        self.assertEqual(client.output(['adb', 'devices']), b'List of devices attached\n%s\tdevice\n' % SERIAL.encode())
+        self.assertEqual(client.output(['adb', '-s', SERIAL, 'shell', pidcat.PS_COMMAND]),
+                         self.device.run(pidcat.PS_COMMAND))
+        self.assertEqual(client.output(['adb', 'logcat', '-d', '-v', 'time']), b'\n'.join(LOG) + b'\n')
+        # Left to adb
+        self.assertIsNone(client.output(['adb', 'install', 'app.apk']))
+
+    def test_shell_reused(self):
+        client = self.serve()
+        for _ in range(3):
+            self.assertEqual(client.output(['adb', 'shell', 'getprop', 'ro.build.version.sdk']), b'33\n')
+        # One connection to switch to the device and start the shell, the other commands run in it
+        self.assertEqual((client.connections, client.commands, client.reused), (1, 3, 2))
+        self.assertEqual(self.server.connections, 1)
+
+    def test_spawn(self):
+        client = self.serve()
+        process = client.spawn(['adb', '-s', SERIAL, 'logcat', '-v', 'time'])
+        self.assertEqual(list(pidcat.LineReader(process.stdout)), LOG)
+        self.assertEqual(process.wait(), 0)
+        self.assertIsNone(client.spawn(['adb', 'push', 'a', 'b']))
+
+    def test_without_exec(self):
+        # Before Android 5.0: a connection per command through shell:
+        client = self.serve(services=('shell',))
+        for _ in range(2):
+            self.assertEqual(client.output(['adb', 'shell', 'getprop', 'ro.product.model']), b'Pixel\n')
+        self.assertEqual(client.reused, 0)
+        self.assertEqual(self.server.commands, 2)
+
+    def test_refused(self):
+        client = self.serve(services=())
+        self.assertEqual(client.output(['adb', 'shell', 'getprop', 'ro.product.model']), b'')
+        self.assertEqual(client.output(['adb', '-s', 'missing', 'get-state']), b'')
+        process = client.spawn(['adb', 'logcat', '-v', 'time'])
+        self.assertEqual((process.poll(), list(pidcat.LineReader(process.stdout))), (1, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+--device-filter: the lines logcat on the device keeps with the arguments of device_filter_args() must include the
+ones pidcat needs to track the processes of the package and show their crashes.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+
+LOG = [
+    b'10-18 10:00:00.000 I/ActivityManager(  500): Start proc 1234:com.example.app/u0a42 for activity '
+    b'com.example.app/.Main',
+    b'10-18 10:00:00.100 W/MyApp( 1234): about to crash',
+    b'10-18 10:00:00.200 D/MyApp( 1234): not shown below W',
+    b'10-18 10:00:00.300 F/DEBUG   (  690): *** *** *** *** *** *** *** *** *** *** *** *** *** *** *** ***',
+    b'10-18 10:00:00.301 F/DEBUG   (  690): pid: 1234, tid: 1234, name: main  >>> com.example.app <<<',
+    b'10-18 10:00:00.302 F/DEBUG   (  690): backtrace:',
+    b'10-18 10:00:00.303 F/DEBUG   (  690):     #00 pc 0001a2b4  /system/lib64/libc.so (abort+120)',
+    b'10-18 10:00:00.304 F/DEBUG   (  690):     #01 pc 0004c8d0  /data/app/libexample.so (crash+16)',
+    b'10-18 10:00:00.400 I/ActivityManager(  500): Process com.example.app (pid 1234) has died',
+]
+
+
+def logcat(filter_args: list, lines: list) -> list:
+    # What logcat on the device keeps of the lines given these TAG:LEVEL filterspecs
+    specs = dict(arg.rsplit(':', 1) for arg in filter_args)
+    levels = pidcat.LOG_LEVELS + 'S'
+    kept = []
+    for line in lines:
+        level, tag = pidcat.LOG_LINE.match(line.decode()).group(3, 4)
+        if levels.index(level) >= levels.index(specs.get(tag.strip(), specs.get('*', 'V'))):
+            kept.append(line)
+    return kept
+
+
+class LogcatProcess:
+    # Stands in for the logcat of a device, keeping the arguments it was started with
+    def __init__(self, command: list, filter_args: list, **kwargs):
+        self.filter_args = filter_args
+
+
+class DeviceFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = pidcat.IS_TTY, pidcat.LogcatProcess
+        pidcat.IS_TTY, pidcat.LogcatProcess = True, LogcatProcess
+
+    def tearDown(self):
+        pidcat.IS_TTY, pidcat.LogcatProcess = self.saved
+
+    def filter_args(self, argv: list, proguard_mapping: Optional[dict] = None) -> list:
+        args = pidcat.parse_args(argv + ['--device-filter', '--pid-refresh', '0', 'com.example.app'])
+        session = pidcat.DeviceSession(args, ['adb'], proguard_mapping=proguard_mapping)
+        session.open()
+        return session.logcat.filter_args
+
+    def records(self, argv: list) -> list:
+        args = pidcat.parse_args(argv + ['--device-filter', 'com.example.app'])
+        session = pidcat.DeviceSession(args, [])
+        session.pids.add('1234')
+        session.create_filters()
+        return list(session.records(logcat(self.filter_args(argv), LOG)))
+
+    def check(self, records: list):
+        events = [type(record.event) for record in records if record.event is not None]
+        self.assertEqual(events, [pidcat.ProcessStart, pidcat.ProcessDeath])
+        backtrace = [record.message for record in records if record.tag == 'DEBUG']
+        self.assertEqual(backtrace, ['#00 pc 0001a2b4  /system/lib64/libc.so (abort+120)',
+                                     '#01 pc 0004c8d0  /data/app/libexample.so (crash+16)'])
+
+    def test_lifecycle_and_backtrace_get_through(self):
+        records = self.records(['--min-level', 'W'])
+        self.check(records)
+        self.assertNotIn('not shown below W', [record.message for record in records])
+
+    def test_every_level(self):
+        self.check(self.records([]))
+
+    def test_no_pid_filter(self):
+        self.assertEqual(pidcat.device_filter_args(0, None, True), [])
+        self.assertEqual(pidcat.device_filter_args(pidcat.LOG_LEVELS_MAP['W'], None, True),
+                         ['ActivityManager:V', 'dalvikvm:V', 'DEBUG:V', '*:W'])
+
+    def test_proguard_mapping(self):
+        # logcat sees the obfuscated tags, only the level can be left to it
+        argv = ['--min-level', 'W', '--tag', 'MyApp']
+        self.assertEqual(self.filter_args(argv), ['MyApp:W', 'ActivityManager:V', 'dalvikvm:V', 'DEBUG:V', '*:S'])
+        self.assertEqual(self.filter_args(argv, {'a.b': 'MyApp'}),
+                         ['ActivityManager:V', 'dalvikvm:V', 'DEBUG:V', '*:W'])
+
+
+if __name__ == '__main__':
+    unittest.main()
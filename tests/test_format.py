@@ -0,0 +1,69 @@
+"""
+--format json and csv: every row of the CSV output has the columns of the header, and the records of a native crash
+logged before any process start carry the pid of their DEBUG line.
+
+    python -m unittest discover tests
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+
+LOG = [
+    b'10-18 10:00:00.300 F/DEBUG   (  690): backtrace:',
+    b'10-18 10:00:00.303 F/DEBUG   (  690):     #00 pc 0001a2b4  /system/lib64/libc.so (abort+120)',
+    b'10-18 10:00:01.000 I/ActivityManager(  500): Start proc 1234:com.example.app/u0a42 for activity '
+    b'com.example.app/.Main',
+    b'10-18 10:00:01.100 W/MyApp( 1234): hello, "world"',
+    b'10-18 10:00:01.400 I/ActivityManager(  500): Process com.example.app (pid 1234) has died',
+]
+
+
+class Lines:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, line: str):
+        self.lines.append(line)
+
+
+class FormatTest(unittest.TestCase):
+    def render(self, output_format: str) -> list:
+        args = pidcat.parse_args(['--all', '--format', output_format])
+        output = Lines()
+        formatter = pidcat.create_renderer(args, output=output)
+        for record in pidcat.log_records(LOG, args):
+            formatter.render(record)
+        return output.lines
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO('\n'.join(self.render('csv')))))
+        # No row has more or fewer columns than the header
+        self.assertFalse([row for row in rows if None in row or None in row.values()])
+        self.assertEqual([row['pid'] for row in rows if row['tag'] == 'DEBUG'], ['690', '690'])
+        start = next(row for row in rows if row['event'] == 'start')
+        self.assertEqual((start['pid'], start['package'], start['target'], start['message']),
+                         ('1234', 'com.example.app', 'activity com.example.app/.Main', ''))
+        self.assertEqual(next(row for row in rows if row['tag'] == 'MyApp')['message'], 'hello, "world"')
+
+    def test_skipped_lines(self):
+        output = Lines()
+        formatter = pidcat.RecordFormatter('csv', output)
+        formatter.render(pidcat.LogRecord('10-18', '10:00:00.000', '', '', '', '', pidcat.LinesSkipped(12)))
+        row = dict(zip(pidcat.RecordFormatter.CSV_FIELDS, next(csv.reader(output.lines[1:]))))
+        self.assertEqual((row['event'], row['count'], row['message']), ('skipped', '12', ''))
+
+    def test_json_pid(self):
+        records = [json.loads(line) for line in self.render('json')]
+        self.assertEqual([record['pid'] for record in records if record.get('tag') == 'DEBUG'], ['690', '690'])
+
+
+if __name__ == '__main__':
+    unittest.main()
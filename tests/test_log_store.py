@@ -0,0 +1,63 @@
+"""
+--record and --query: the lines recorded into a log store and queried back show the same process starts and ends as
+the log read live.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+
+LOG = [
+    b'10-18 10:00:00.000 I/ActivityManager(  500): Start proc 1092:com.example.app/u0a42 for activity '
+    b'com.example.app/.Main',
+    b'10-18 10:00:00.050 I/ActivityManager(  500): Start proc 1215:com.example.app:remote/u0a42 for service '
+    b'com.example.app/.Sync',
+    b'10-18 10:00:00.100 W/MyApp( 1092): working',
+    b'10-18 10:00:00.200 I/OtherApp( 2000): not ours',
+    b'10-18 10:00:00.300 I/ActivityManager(  500): Process com.example.app (pid 1092) has died',
+    b'10-18 10:00:00.400 I/ActivityManager(  500): Process com.example.app:remote (pid 1215) has died',
+]
+
+
+class LogStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def events(self, records) -> list:
+        return [(type(record.event).__name__, record.event.pid) for record in records if record.event is not None]
+
+    def query(self, block_size: int) -> list:
+        writer = pidcat.LogStoreWriter(self.directory.name, 1 << 30, block_size=block_size)
+        writer.add(list(LOG))
+        writer.close()
+        args = pidcat.parse_args(['com.example.app', '--query', self.directory.name])
+        session = pidcat.DeviceSession(args, [])
+        session.create_filters()
+        return list(pidcat.LogStore(self.directory.name).query(session))
+
+    def test_round_trip(self):
+        live = self.events(pidcat.log_records(LOG, pidcat.parse_args(['com.example.app'])))
+        self.assertEqual(live, [('ProcessStart', '1092'), ('ProcessStart', '1215'), ('ProcessDeath', '1092'),
+                                ('ProcessDeath', '1215')])
+        # A block per line: the deaths are in blocks without any other line of their process
+        self.assertEqual(self.events(self.query(block_size=1)), live)
+
+    def test_one_block(self):
+        records = self.query(block_size=pidcat.STORE_BLOCK_SIZE)
+        self.assertEqual(self.events(records), [('ProcessStart', '1092'), ('ProcessStart', '1215'),
+                                                ('ProcessDeath', '1092'), ('ProcessDeath', '1215')])
+        self.assertEqual([record.message for record in records if record.event is None], ['working'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+Reading the process table of devices with toybox ps (Android 7.0 and newer) and toolbox ps (older ones).
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+
+TOOLBOX_PS = (b'USER     PID   PPID  VSIZE  RSS     WCHAN    PC         NAME\n'
+              b'root      1     0     8896   760   ffffffff 00000000 S /init\n'
+              b'u0_a42    1234  200   1021588 46304 ffffffff 00000000 S com.example.app\n')
+TOYBOX_PS = b'  PID NAME\n    1 init\n 1234 com.example.app\n'
+
+
+class ProcessTableTest(unittest.TestCase):
+    def setUp(self):
+        self.commands = []
+        self.adb_output = pidcat.adb_output
+        pidcat.PLAIN_PS_DEVICES.clear()
+
+    def tearDown(self):
+        pidcat.adb_output = self.adb_output
+
+    def device(self, toolbox: bool):
+        def adb_output(command):
+            self.commands.append(command[-1])
+            if command[-1] == pidcat.PS_COMMAND:
+                # toolbox ps takes the options for a process name and lists nothing, without failing
+                return TOOLBOX_PS.split(b'\n')[0] + b'\n' if toolbox else TOYBOX_PS
+            return TOOLBOX_PS
+        pidcat.adb_output = adb_output
+
+    def test_toybox(self):
+        self.device(toolbox=False)
+        self.assertEqual(pidcat.read_process_table(['adb']), {'1': 'init', '1234': 'com.example.app'})
+        self.assertEqual(self.commands, [pidcat.PS_COMMAND])
+
+    def test_toolbox(self):
+        self.device(toolbox=True)
+        for _ in range(2):
+            self.assertEqual(pidcat.read_process_table(['adb', '-s', 'old']),
+                             {'1': '/init', '1234': 'com.example.app'})
+        # The second time goes straight to plain ps
+        self.assertEqual(self.commands, [pidcat.PS_COMMAND, 'ps', 'ps'])
+
+
+if __name__ == '__main__':
+    unittest.main()
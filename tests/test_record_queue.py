@@ -0,0 +1,50 @@
+"""
+--overflow drop-oldest: the oldest lines are dropped and reported, process starts and ends never are.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pidcat  # noqa: E402
+
+
+def line(message: str) -> pidcat.LogRecord:
+    return pidcat.LogRecord('10-18', '10:00:00.000', 'I', 'MyApp', '1234', message)
+
+
+def event(event) -> pidcat.LogRecord:
+    return pidcat.LogRecord('10-18', '10:00:00.000', 'I', 'ActivityManager', '500', '', event)
+
+
+class RecordQueueTest(unittest.TestCase):
+    def test_drop_oldest_keeps_events(self):
+        records = pidcat.RecordQueue(3, 'drop-oldest')
+        start = event(pidcat.ProcessStart('com.example.app', 'activity', '1234', '-', '-'))
+        death = event(pidcat.ProcessDeath('1234', 'com.example.app'))
+        for record in [start, line('1'), line('2'), death, line('3'), line('4'), line('5')]:
+            records.put(record)
+        records.close()
+
+        batch = records.get()
+        self.assertEqual(batch[:2], [start, death])
+        self.assertEqual(batch[2].event, pidcat.LinesSkipped(2))
+        self.assertEqual([record.message for record in batch[3:]], ['3', '4', '5'])
+        self.assertEqual(records.dropped, 2)
+        self.assertIsNone(records.get())
+
+    def test_only_events(self):
+        records = pidcat.RecordQueue(1, 'drop-oldest')
+        deaths = [event(pidcat.ProcessDeath(str(pid), 'com.example.app')) for pid in range(3)]
+        for record in deaths:
+            records.put(record)
+        self.assertEqual(records.get(), deaths)
+        self.assertEqual(records.dropped, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()